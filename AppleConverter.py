@@ -1,20 +1,30 @@
-import os,sys,glob,shutil,time
+import os,sys,shutil,time,argparse,io,socket
 from typing import *
 from pathlib import *
-import subprocess,datetime,re
+import subprocess,datetime,re,math
+import ftplib,ssl,threading
+import ctypes,ctypes.util,select,struct
+import multiprocessing,multiprocessing.connection,sqlite3,hashlib
+import bisect,contextlib,cProfile,asyncio,errno
+import heapq,random,json,csv,collections
+from concurrent.futures import Future,ProcessPoolExecutor,ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 import xml.etree.ElementTree as ET
 from xml.dom import minidom
 
 
+# Bump whenever the XML produced for the same log changes, so the dedup
+# cache doesn't skip logs that would now convert differently
+CONVERTER_VERSION = "3"
+
 # Config Parsing
 APPLE_BASE = 'Logs/Apple'
 MOUNT_BASE = "/mnt/itad_share"
 
 CONFIG: Dict[str, Any] = {}
 
-def load_env_config(env_file: str = ".env", encoding: str = "utf-8") -> Dict[str, Any]:
-
-    global CONFIG
+def read_env_config(env_file: str = ".env", encoding: str = "utf-8") -> Dict[str, Any]:
+    # Into a fresh dict, so a reload can be checked before it replaces CONFIG
 
     required_keys = [
         "FTP_USER",
@@ -26,22 +36,66 @@ def load_env_config(env_file: str = ".env", encoding: str = "utf-8") -> Dict[str
         "SHARE_USER",
         "SHARE_PASS"
     ]
+    optional_keys = [
+        "FTP_BACKEND",
+        "FTP_POOL_SIZE",
+        "FTP_TLS",
+        "FTP_TIMEOUT",
+        "FTP_CONCURRENCY",
+        "FTP_LATENCY_TOLERANCE",
+        "JOBS",
+        "STATE_DIR",
+        "DEDUP_CACHE",
+        "DEDUP_MAX_ENTRIES",
+        "DEDUP_MAX_AGE_DAYS",
+        "METRICS_FILE",
+        "METRICS_INTERVAL",
+        "PIPELINE",
+        "PIPELINE_QUEUE_SIZE",
+        "STAGING_DIR",
+        "STAGING_FLUSH_INTERVAL",
+        "MOUNT_CHECK_INTERVAL",
+        "MOUNT_PROBE_TIMEOUT",
+        "JOURNAL",
+        "UPLOAD_RETRY_ATTEMPTS",
+        "UPLOAD_RETRY_BASE_DELAY",
+        "UPLOAD_RETRY_MAX_DELAY",
+        "MANIFEST",
+        "MANIFEST_DIR",
+        "INTAKE_STABLE_WINDOW",
+        "PROCESSED_RECONCILE_INTERVAL",
+        "MOUNT_BASE",
+        "APPLE_BASE",
+        "SOURCES",
+        "CLAIMS",
+        "NODE_ID",
+        "CLAIM_LEASE_TIMEOUT",
+        "ERROR_REPORTS",
+        "ERROR_FLUSH_INTERVAL",
+        "LOOKUP_FILE",
+        "CONFIG_CHECK_INTERVAL"
+    ]
 
-    CONFIG.clear()  # Reset global config
+    config: Dict[str, Any] = {}
     
     env_path = Path(env_file)
     if not env_path.exists():
-        for key in required_keys:
+        keys = required_keys + optional_keys
+        # Per-source overrides, e.g. SITE2_SHARE_IP for SOURCES=site1,site2
+        for name in os.environ.get("SOURCES", "").split(","):
+            if name.strip():
+                keys += [name.strip().upper() + "_" + key for key in required_keys + optional_keys]
+        for key in keys:
             value = os.environ.get(key)
             if value is not None:  
                 if value.startswith('"') and value.endswith('"'):
                     value = value[1:-1]
                 elif value.startswith("'") and value.endswith("'"):
                     value = value[1:-1]              
-                CONFIG[key] = value
+                config[key] = value
         
-        print(f"Loaded {len(CONFIG)} variables from system environment")
-        return CONFIG
+        print(f"Loaded {len(config)} variables from system environment")
+        return config
     
     with open(env_path, 'r', encoding=encoding) as file:
         for line_num, line in enumerate(file, 1):
@@ -65,11 +119,17 @@ def load_env_config(env_file: str = ".env", encoding: str = "utf-8") -> Dict[str
             elif value.startswith("'") and value.endswith("'"):
                 value = value[1:-1]
             
-            CONFIG[key] = value
+            config[key] = value
     
+    return config
+
+def load_env_config(env_file: str = ".env", encoding: str = "utf-8") -> Dict[str, Any]:
+    global CONFIG
+    CONFIG = read_env_config(env_file, encoding)
     return CONFIG
 
-def verify_env_config() -> bool:
+def verify_env_config(config: Optional[Dict[str, Any]] = None) -> bool:
+    config = CONFIG if config is None else config
     required_keys = [
         "FTP_USER",
         "FTP_PASS", 
@@ -85,9 +145,9 @@ def verify_env_config() -> bool:
     empty_keys = []
     
     for key in required_keys:
-        if key not in CONFIG:
+        if key not in config:
             missing_keys.append(key)
-        elif not CONFIG[key] or str(CONFIG[key]).strip() == "":
+        elif not config[key] or str(config[key]).strip() == "":
             empty_keys.append(key)
     
     # Report results
@@ -104,11 +164,6 @@ def verify_env_config() -> bool:
     print("✓ All required environment variables are present and populated")
     return True
 
-load_env_config("CREDS.env")
-
-if not verify_env_config():
-    sys.exit(1)
-
 # Share mounting
 
 
@@ -134,14 +189,16 @@ def is_share_mounted(mount_point: str) -> bool:
     except Exception:
         return False
 
-def unmount_share(mount_point: str = "/mnt/itad_share") -> bool:
+def unmount_share(mount_point: str = "/mnt/itad_share", lazy: bool = False) -> bool:
     if not is_share_mounted(mount_point):
         print(f"No share mounted at {mount_point}")
         return True
     
+    # A lazy unmount detaches even a hung mount that a plain umount would block on
+    umount_cmd = ["sudo", "umount", "-l", mount_point] if lazy else ["sudo", "umount", mount_point]
     try:
         print(f"Unmounting {mount_point}...")
-        result = subprocess.run(["sudo", "umount", mount_point], 
+        result = subprocess.run(umount_cmd, 
                               capture_output=True, text=True, timeout=15)
         
         if result.returncode == 0:
@@ -208,10 +265,128 @@ def mount_share(mount_point: str = "/mnt/itad_share") -> bool:
         print(f"Unexpected error during mount: {e}")
         return False
     
-successful_mount = mount_share()
+# Errors a dead or stale CIFS mount hands back instead of hanging
+STALE_MOUNT_ERRNOS = {errno.ESTALE, errno.EIO, errno.ENOTCONN, errno.EHOSTDOWN, errno.ETIMEDOUT}
 
-if not successful_mount:
-    sys.exit(1)
+class MountSupervisor:
+    """
+    Keeps the share mounted for the daemon.
+
+    The mount state is cached in an Event instead of re-reading
+    /proc/mounts on every check. A background thread probes the share with
+    a stat every `interval` seconds, bounded by `probe_timeout` so a hung
+    CIFS mount is noticed instead of hanging the probe. When the share is
+    missing, stale or hung, it is lazily unmounted and mounted again,
+    backing off exponentially up to max_backoff seconds between attempts.
+    The intake loop calls wait_healthy() and so pauses while the share is
+    down.
+    """
+
+    def __init__(self, mount_point: str, probe_path: str, interval: float = 15,
+                 probe_timeout: float = 5, max_backoff: float = 300):
+        self.mount_point = mount_point
+        self.probe_path = probe_path
+        self.interval = interval
+        self.probe_timeout = probe_timeout
+        self.max_backoff = max_backoff
+        self.backoff = 1.0
+        self._healthy = threading.Event()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._probe_thread: Optional[threading.Thread] = None
+        self._probe_result: Optional[BaseException] = None
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def healthy(self) -> bool:
+        return self._healthy.is_set()
+
+    def _stat(self) -> None:
+        try:
+            os.stat(self.probe_path)
+            self._probe_result = None
+        except BaseException as e:
+            self._probe_result = e
+
+    def probe(self) -> bool:
+        if not is_share_mounted(self.mount_point):
+            print(f"Share is not mounted at {self.mount_point}")
+            return False
+        if self._probe_thread is not None and self._probe_thread.is_alive():
+            # The last stat never came back; don't stack up more hung threads
+            print(f"Share at {self.mount_point} is still hung")
+            return False
+
+        self._probe_thread = threading.Thread(target=self._stat, name="mount-probe", daemon=True)
+        self._probe_thread.start()
+        self._probe_thread.join(self.probe_timeout)
+        if self._probe_thread.is_alive():
+            print(f"Share probe timed out after {self.probe_timeout}s")
+            return False
+        error = self._probe_result
+        if error is None:
+            return True
+        if isinstance(error, OSError) and error.errno in STALE_MOUNT_ERRNOS:
+            print(f"Share at {self.mount_point} is stale: {error}")
+        else:
+            print(f"Share probe failed: {error}")
+        return False
+
+    def remount(self) -> bool:
+        if is_share_mounted(self.mount_point):
+            unmount_share(self.mount_point, lazy=True)
+        # A stat hung on the old mount may never return; probe the new one afresh
+        self._probe_thread = None
+        return mount_share(self.mount_point) and self.probe()
+
+    def check(self) -> bool:
+        if self.probe() or self.remount():
+            if not self.healthy:
+                print("Share is healthy")
+            self._healthy.set()
+            self.backoff = 1.0
+            return True
+        self._healthy.clear()
+        self.backoff = min(self.backoff * 2, self.max_backoff)
+        print(f"Share unavailable, retrying in {self.backoff:.0f}s")
+        return False
+
+    def request_check(self) -> None:
+        # Something failed on the share; probe now instead of at the next interval
+        self._wake.set()
+
+    def wait_healthy(self) -> None:
+        while not self._healthy.wait(self.interval):
+            print("Intake paused until the share is healthy again")
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            self.check()
+            self._wake.wait(self.interval if self.healthy else self.backoff)
+            self._wake.clear()
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._run, name="mount-supervisor", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._wake.set()
+
+SUPERVISOR: Optional[MountSupervisor] = None
+
+def startup():
+    # Config is only needed by the daemon, so importing this module
+    # (benchmarks, tooling) has no side effects. Mounting is left to the
+    # MountSupervisor main() starts.
+    global MOUNT_BASE, APPLE_BASE
+    load_env_config("CREDS.env")
+
+    # With several sources each one is verified once its overrides are applied
+    if not source_names() and not verify_env_config():
+        sys.exit(1)
+    MOUNT_BASE = CONFIG.get("MOUNT_BASE", MOUNT_BASE)
+    APPLE_BASE = CONFIG.get("APPLE_BASE", APPLE_BASE)
 
 
 # File processing
@@ -219,51 +394,263 @@ if not successful_mount:
 ## old steve jobs functions
 
 def parse_input_txt(input_text):
-    data = {}
-    pattern2 = r'(.*):(.*)'
-    matches = re.findall(pattern2, input_text)
+    # The PARSED_KEYS lines, from scan_report's single pass
+    return scan_report(input_text)[0]
 
-    for key, value in matches:
-        data[key] = value
-        # print(key)
-    #     print(key + " " + value)
+def extract_total_cores(input_text, errors=None):
+    # Every Total Number of Cores value, from scan_report's single pass
+    return scan_report(input_text)[1]
 
-    return data
+## new functions
 
-def extract_total_cores(input_text):
-    global errors
-    # Extract Total Cores
-    try:
-        pattern = r"Total Number of Cores:\s+(\d+)"
-        cores_values = [int(val) for val in re.findall(pattern, input_text)]
-    except:
-        print("NUM CORES ERROR")
-        errors += "NUM CORES ERROR\n"
-    # print(cores_values)
-    return cores_values
+class ReportSection:
+    """
+    One top-level section of a system_profiler report (Hardware, Memory,
+    NVMExpress, SATA, Storage, Power, ...) with every `key: value` line
+    found anywhere under it, indexed by key in file order.
+    """
+    __slots__ = ("name", "_values")
 
-## new functions
+    def __init__(self, name: str):
+        self.name = name
+        self._values: Dict[str, List[str]] = {}
+
+    def add(self, key: str, value: str) -> None:
+        values = self._values.get(key)
+        if values is None:
+            self._values[key] = [value]
+        else:
+            values.append(value)
 
-def get_all_text_files():
-    path = os.path.join(MOUNT_BASE,APPLE_BASE,"Temp","*.txt")
-    res = glob.glob(path)
-    return res
+    def values(self, key: str) -> List[str]:
+        return self._values.get(key, [])
 
-RAW_LOGS = get_all_text_files()
-ERRORS = ""
+    def first(self, key: str) -> Optional[str]:
+        values = self._values.get(key)
+        return values[0] if values else None
 
-def clear_collision(xml_log):
-    log_dir = os.path.join(MOUNT_BASE,APPLE_BASE,"Processed")
+    def __contains__(self, key: str) -> bool:
+        return key in self._values
+
+# The newline before a line that starts in column 0. A lookahead from each
+# newline is far cheaper than a MULTILINE `^\S`, which tries every offset.
+SECTION_START_PATTERN = re.compile(r"\n(?=\S)")
+TOTAL_CORES_PATTERN = re.compile(r"Total Number of Cores:\s+(\d+)")
+
+def report_chunks(input_text: str) -> Iterator[Tuple[int, int]]:
+    # (start, end) of each section, header line included, in file order
+    start = 0
+    for match in SECTION_START_PATTERN.finditer(input_text):
+        yield start, match.start()
+        start = match.end()
+    yield start, len(input_text)
+
+def scan_report(input_text: str) -> Tuple[Dict[str, str], List[int], Dict[str, ReportSection]]:
+    """
+    Walk a log once, section by section, for everything a record reads.
+
+    A line that starts in column 0 opens a new section named by the text
+    before its first colon; every indented line belongs to the section
+    above it. Only SCANNED_SECTIONS are split into lines. Every other
+    section, most of a full report, is stepped over whole.
+
+    - output_data: the top-level lines (TECHID, ...) and the lines of
+      KEY_SECTIONS whose key is in PARSED_KEYS, split at the last colon as
+      the old `(.*):(.*)` findall did, later lines winning;
+    - total_cores: every Total Number of Cores value in KEY_SECTIONS, in
+      file order;
+    - report: the first section of each REPORT_SECTIONS name indexed by
+      key, the same one a `re.search` over the whole text would have found.
+
+    The walk ends with LAST_SECTION; nothing after it is looked at.
+
+    Returns:
+        (output_data, total_cores, report)
+    """
+    data: Dict[str, str] = {}
+    cores: List[int] = []
+    report: Dict[str, ReportSection] = {}
+    for start, end in report_chunks(input_text):
+        header_end = input_text.find("\n", start, end)
+        if header_end < 0:
+            header_end = end
+        header = input_text[start:header_end]
+        key, sep, value = header.rpartition(":")
+        if sep and key in PARSED_KEYS:
+            data[key] = value
+        name = header.partition(":")[0].strip()
+        if name not in SCANNED_SECTIONS:
+            continue
+        body = input_text[header_end + 1:end]
+        keyed = name in KEY_SECTIONS
+        if keyed:
+            cores += [int(count) for count in TOTAL_CORES_PATTERN.findall(body)]
+        section = None
+        if name in REPORT_SECTIONS and name not in report:
+            section = report[name] = ReportSection(name)
+        for line in body.split("\n"):
+            key, sep, value = line.rpartition(":")
+            if not sep:
+                continue
+            if keyed and key in PARSED_KEYS:
+                data[key] = value
+            if section is not None:
+                key, _, value = line.partition(":")
+                section.add(key.strip(), value.strip())
+        if name == LAST_SECTION:
+            break
+    return data, cores, report
+
+def tokenize_report(input_text: str) -> Dict[str, ReportSection]:
+    # The REPORT_SECTIONS index alone
+    return scan_report(input_text)[2]
+
+DRIVE_SECTIONS = ("NVMExpress", "SATA/SATA Express", "SATA")
+DRIVE_SERIAL_PATTERN = re.compile(r"[\w-]+")
+DRIVE_CAPACITY_PATTERN = re.compile(r"(?P<capacity>\d+(?:\.\d+)?) (TB|GB)")
+WORD_PATTERN = re.compile(r"\w+")
+# Every section a transform reads from the report
+REPORT_SECTIONS = frozenset(("Hardware", "Memory", "Storage") + DRIVE_SECTIONS)
+# Sections the indented PARSED_KEYS and the core counts are read from
+KEY_SECTIONS = frozenset(("Graphics/Displays", "Hardware", "Power"))
+SCANNED_SECTIONS = REPORT_SECTIONS | KEY_SECTIONS
+# system_profiler writes its sections in a fixed order, and none after
+# Storage holds anything a record reads: Software, Thunderbolt, USB, ...
+LAST_SECTION = "Storage"
+LAST_SECTION_HEADER = "\n" + LAST_SECTION + ":"
+
+def read_report(file: IO[str], chunk_size: int = 1 << 16) -> str:
+    """
+    Read a log up to where scan_report stops, the end of LAST_SECTION,
+    so the rest of a multi-megabyte full report is never read into memory.
+    A log without LAST_SECTION is read whole.
+    """
+    text = ""
+    searched = 0
+    header = -1
+    while chunk := file.read(chunk_size):
+        text += chunk
+        if header < 0:
+            header = text.find(LAST_SECTION_HEADER, searched)
+            searched = max(0, len(text) - len(LAST_SECTION_HEADER))
+        if header >= 0:
+            # The next line that starts in column 0 opens the section after it
+            match = SECTION_START_PATTERN.search(text, header + 1)
+            if match is not None:
+                return text[:match.end()]
+    return text
+
+def find_drive_section(report: Dict[str, ReportSection]) -> Optional[ReportSection]:
+    for name in DRIVE_SECTIONS:
+        if name in report:
+            return report[name]
+    return None
+
+def last_word(section: ReportSection, key: str) -> str:
+    # Last `key:` line's leading word, e.g. the final DIMM's "Speed: 2667 MHz"
+    word = None
+    for value in section.values(key):
+        match = WORD_PATTERN.match(value)
+        if match is not None:
+            word = match.group(0)
+    if word is None:
+        raise KeyError(f"no {key} in {section.name}")
+    return word
+
+class ProcessedIndex:
+    """
+    In-memory listing of the share's Processed directory, so collision
+    checks are a dict lookup instead of a stat over CIFS per log.
+
+    Built with one os.scandir, kept current from clear_collision's own
+    renames and from add() and discard() as XMLs land in Processed and
+    leave it again, and rescanned every reconcile_interval seconds to pick
+    up anything other clients changed. Maps name to mtime, where
+    known; a real collision stats the file for it. Only used while this
+    daemon is the one writing into Processed, i.e. without CLAIMS.
+    """
+
+    def __init__(self, directory: str, reconcile_interval: float = 300.0):
+        self.directory = os.path.abspath(directory)
+        self.reconcile_interval = reconcile_interval
+        self._lock = threading.Lock()
+        self._names: Dict[str, Optional[float]] = {}
+        self._scanned = 0.0
+        self.reconcile()
+
+    def reconcile(self) -> None:
+        try:
+            with os.scandir(self.directory) as entries:
+                names = dict.fromkeys(entry.name for entry in entries)
+        except OSError as e:
+            # Share trouble; keep the last listing and try again next time
+            print(f"Could not list {self.directory}: {e}")
+            return
+        with self._lock:
+            # Keep mtimes already known for names that are still there
+            for name in names.keys() & self._names.keys():
+                names[name] = self._names[name]
+            self._names = names
+            self._scanned = time.monotonic()
+
+    def clear(self, xml_log: str) -> None:
+        # Same effect as clear_collision's stat-and-rename, without the stat
+        if time.monotonic() - self._scanned > self.reconcile_interval:
+            self.reconcile()
+        log_file = os.path.join(self.directory, xml_log)
+        with self._lock:
+            if xml_log in self._names:
+                mtime = self._names.pop(xml_log)
+                try:
+                    if mtime is None:
+                        mtime = os.path.getmtime(log_file)
+                    new_log_name = collision_name(xml_log, mtime)
+                    os.rename(log_file, os.path.join(self.directory, new_log_name))
+                    print(f"Collision detected: {log_file}")
+                    self._names[new_log_name] = mtime
+                except FileNotFoundError:
+                    pass   # gone since the last scan, or never written
+
+    def add(self, log_file: str) -> None:
+        # Only once the XML is really there; its mtime is read on a collision
+        if os.path.dirname(os.path.abspath(log_file)) == self.directory:
+            with self._lock:
+                self._names[os.path.basename(log_file)] = None
+
+    def discard(self, log_file: str) -> None:
+        if os.path.dirname(os.path.abspath(log_file)) == self.directory:
+            with self._lock:
+                self._names.pop(os.path.basename(log_file), None)
+
+PROCESSED_INDEX: Optional[ProcessedIndex] = None
+
+def processed_added(log_file):
+    # An XML was written or moved into Processed
+    if PROCESSED_INDEX is not None:
+        PROCESSED_INDEX.add(log_file)
+
+def processed_removed(log_file):
+    # An XML was moved out of Processed or deleted
+    if PROCESSED_INDEX is not None:
+        PROCESSED_INDEX.discard(log_file)
+
+def collision_name(xml_log, mtime):
+    modification_time = datetime.datetime.fromtimestamp(mtime).strftime('_%m-%d-%Y_%H-%M-%S')
+    return xml_log[:-4] + str(modification_time) + xml_log[-4:]
+
+def clear_collision(xml_log, log_dir=None):
+    if log_dir is None:
+        log_dir = work_path("Processed")
     log_file = os.path.join(log_dir,xml_log)
 
+    if PROCESSED_INDEX is not None and os.path.abspath(log_dir) == PROCESSED_INDEX.directory:
+        PROCESSED_INDEX.clear(xml_log)
+        return log_file
+
     if os.path.isfile(log_file):
         print(f"Collision detected: {log_file}")
 
-        modification_time = datetime.datetime.fromtimestamp(
-            os.path.getmtime(log_file)
-            ).strftime('_%m-%d-%Y_%H-%M-%S')
-
-        new_log_name = xml_log[:-4] + str(modification_time) + xml_log[-4:]
+        new_log_name = collision_name(xml_log, os.path.getmtime(log_file))
         new_log_path = os.path.join(log_dir,new_log_name)
         os.rename(log_file,
                 new_log_path)
@@ -283,463 +670,986 @@ displayDict = {"1920x1080": "(16:9)", "1280x720": "(16:9)", "1366x768": "(16:9)"
                "3840x2160": "(16:9)", "1280x800": "(16:10)", "1440x900": "(16:10)", "1680x1050": "(16:10)", "1920x1200": "(16:10)",
                 "2256x1504": "(3:2)", "3000x2000": "(3:2)", "2736x1824": "(3:2)", "2304x1440": "(16:10)", "3024x1964": "(16:10)", "2560x1600": "(16:10)", "3072x1920": "(16:10)", "2880x1800": "(16:10)", "5120x2880": "(16:10)", "1024x768": "(4:3)", "3440x1440": "(21:9)"}
 
-def create_xml(output_data, total_cores, input_text):
-    global ERRORS
-    SERIALNUM = ""
-    batterycon = ""
-    if '          Condition' in output_data:
-        if output_data['          Condition'].split()[0] == "Normal":
-            batterycon = "Pass"
-        else:
-            batterycon = "Fail"
-    # SYSINFO
-    sysinfo = ET.Element('SYSINFO')
+# Tables the lookup file (LOOKUP_FILE) may replace while the daemon runs
+LOOKUP_TABLES = ("MAC_OS_DICT", "GRADE_DICT", "APPLE_MODEL_DICT", "RAM_SPEED_DICT",
+                 "ASSET_CATEGORY_DICT", "displayDict")
 
-    # SYSTEM_INVENTORY
-    system_inventory = ET.SubElement(sysinfo, 'SYSTEM_INVENTORY')
+# SYSINFO field mapping
+#
+# Every output element is described by one Field: the output_data key it
+# reads, the transform applied to it and the text used when the key is
+# missing. Fields that need more than one key (or the parsed report) set
+# source to None and read everything from the RecordContext instead.
 
-    # /// System_Information
-    system_info = ET.SubElement(system_inventory, 'System_Information')
+class RecordContext:
+    """
+    Inputs for one log plus the values several fields share, derived once.
+    """
+    __slots__ = ("data", "cores", "report", "drive", "drive_serial", "battery_condition")
+
+    def __init__(self, output_data, total_cores, report):
+        self.data = output_data
+        self.cores = total_cores
+        self.report = report
+        self.drive = find_drive_section(self.report)
+
+        # "" when there is no drive, None when there is one without a readable serial
+        self.drive_serial = ""
+        if self.drive is not None:
+            try:
+                self.drive_serial = DRIVE_SERIAL_PATTERN.match(self.drive.first("Serial Number")).group(0)
+            except (TypeError, AttributeError):
+                self.drive_serial = None
+
+        self.battery_condition = ""
+        if '          Condition' in output_data:
+            if output_data['          Condition'].split()[0] == "Normal":
+                self.battery_condition = "Pass"
+            else:
+                self.battery_condition = "Fail"
 
-    # Extract TECHID
-    if 'TECHID' in output_data:
-        ET.SubElement(system_info, 'Tech_ID').text = output_data['TECHID'].upper()
-    else:
-        ET.SubElement(system_info, 'Tech_ID').text = ""
+NUMBER_PATTERN = re.compile(r"\d+(\.\d+)?")
 
-    # Extract UID
-    if 'SYSUID' in output_data:
-        ET.SubElement(system_info, 'Asset_Identifier').text = output_data['SYSUID'].upper()
-    else:
-        ET.SubElement(system_info, 'Asset_Identifier').text = ""
+def number(text):
+    # An int or float for a plain number that reads back as the same text,
+    # so the XML is unchanged; anything else stays as it was written
+    match = NUMBER_PATTERN.fullmatch(text)
+    if match is None:
+        return text
+    value = int(text) if match.group(1) is None else float(text)
+    return value if str(value) == text else text
 
-    # Extract Form Factor
-    if 'SYSTYPE' in output_data:
-        if output_data["SYSTYPE"].upper() in ASSET_CATEGORY_DICT:
-            ET.SubElement(system_info, 'System_Chassis_Type').text = ASSET_CATEGORY_DICT[output_data["SYSTYPE"].upper()]
-        else:
-            ET.SubElement(system_info, 'System_Chassis_Type').text = ""
-    else:
-        ET.SubElement(system_info, 'System_Chassis_Type').text = ""
+class Unit(NamedTuple):
+    """
+    How a numeric DeviceRecord value is written in the XML: the number
+    followed by suffix, or an empty element when it is unknown.
+    """
+    suffix: str = ""
 
-    # Input Manufacturer
-    ET.SubElement(system_info, 'System_Manufacturer').text = "APPLE"
+    def text(self, value) -> str:
+        return "" if value is None else f"{value}{self.suffix}"
 
-    # Extract Model Number
-    if 'BUILDNO' in output_data:
-        ET.SubElement(system_info, 'System_ProductName').text = output_data['BUILDNO'].upper()
-    else:
-        ET.SubElement(system_info, 'System_ProductName').text = ""
-
-    # Extract Serial Number
-    if '      Serial Number (system)' in output_data:
-        ET.SubElement(system_info, 'System_Serial_Number').text = output_data['      Serial Number (system)'].strip()
-    else:
-        ET.SubElement(system_info, 'System_Serial_Number').text = ""
-
-    # Extract User Notes
-    if 'SYSNOTES' in output_data:
-        if batterycon == "Fail":
-            ET.SubElement(system_info, 'System_UUID').text = output_data['SYSNOTES'].upper() + ", BATTERY SERVICE RECOMMENDED"
-        else:
-            ET.SubElement(system_info, 'System_UUID').text = output_data['SYSNOTES'].upper()
-    else:
-        if batterycon == "Fail":
-            ET.SubElement(system_info, 'System_UUID').text = "" + "BATTERY SERVICE RECOMMENDED"
-        else:
-            ET.SubElement(system_info, 'System_UUID').text = ""
+    def parse(self, text: str):
+        if not text:
+            return None
+        if self.suffix and text.endswith(self.suffix):
+            text = text[:-len(self.suffix)]
+        return number(text)
 
-    # Extract Installed OS
-    if 'OSVER' in output_data:
-        if output_data['OSVER'] in MAC_OS_DICT:
-            ET.SubElement(system_info, 'System_Version').text = MAC_OS_DICT[output_data['OSVER']]
-        else:
-            ET.SubElement(system_info, 'System_Version').text = ""
-    else:
-        ET.SubElement(system_info, 'System_Version').text = ""
+class Capacity:
+    """
+    Drive capacity, kept in GB and written the way system_profiler shows
+    it: whole TB from 1000 GB up, whole GB below.
+    """
 
-    # Extract Drive Serial Number
-    try:
-        if re.search(r"NVMExpress:(.*?)\n\S", input_text, re.DOTALL) is not None:
-            match = re.search(r"NVMExpress:(.*?)\n\S", input_text, re.DOTALL).group(1)
-            SERIALNUM = re.search(r"Serial Number:\s*([\w-]+)", match, re.DOTALL).group(1)
-            ET.SubElement(system_info, 'System_Memory').text = SERIALNUM.upper()
-        elif re.search(r"SATA/SATA Express:(.*?)\n\S", input_text, re.DOTALL) is not None:
-            match = re.search(r"SATA/SATA Express:(.*?)\n\S", input_text, re.DOTALL).group(1)
-            SERIALNUM = re.search(r"Serial Number:\s*([\w-]+)", match, re.DOTALL).group(1)
-            ET.SubElement(system_info, 'System_Memory').text = SERIALNUM.upper()
-        elif re.search(r"SATA:(.*?)\n\S", input_text, re.DOTALL) is not None:
-            match = re.search(r"SATA:(.*?)\n\S", input_text, re.DOTALL).group(1)
-            SERIALNUM = re.search(r"Serial Number:\s*([\w-]+)", match, re.DOTALL).group(1)
-            ET.SubElement(system_info, 'System_Memory').text = SERIALNUM.upper()
-        else:
-            SERIALNUM = ""
-            ET.SubElement(system_info, 'System_Memory').text = ""
-    except:
-        ET.SubElement(system_info, 'System_Memory').text = ""
-        print("DRIVE SERIAL NUM ERROR/NO DRIVE PRESENT")
-        ERRORS += "DRIVE SERIAL NUM ERROR/NO DRIVE PRESENT\n"
-
-    # Extract Final Grade
-    if 'FINALGRADE' in output_data:
-        ET.SubElement(system_info, 'Original_Product_Key').text = output_data['FINALGRADE'].upper()
+    @staticmethod
+    def text(value) -> str:
+        if value is None:
+            return ""
+        if value >= 1000:
+            return f"{math.floor(value / 1000)} TB"
+        return f"{math.floor(value)} GB"
+
+    @staticmethod
+    def parse(text: str):
+        match = DRIVE_CAPACITY_PATTERN.fullmatch(text)
+        if match is None:
+            return None
+        return capacity_gb(match)
+
+class Field(NamedTuple):
+    tag: Union[str, Tuple[str, ...]]
+    source: Optional[str]
+    transform: Callable[[Optional[str], RecordContext], Any]
+    fallback: Optional[str] = ""
+    error: Optional[str] = None
+    name: Union[str, Tuple[str, ...]] = ""   # DeviceRecord attribute(s)
+    # Unit (or Capacity) of a numeric value, per tag for a group; the
+    # element is then always written, empty when the value is unknown
+    unit: Any = None
+
+class Section(NamedTuple):
+    path: str
+    fields: Tuple[Field, ...]
+    when: Optional[Callable[[RecordContext], bool]] = None
+
+## transforms
+# All take (value, ctx). Returning None leaves the element out entirely;
+# a field with a tuple tag returns one text per tag.
+
+def fixed(text):
+    return lambda value, ctx: text
+
+def lookup(table, upper=False):
+    # By name, so a reloaded table is used from the next record on
+    tables = globals()
+    if upper:
+        return lambda value, ctx: tables[table].get(value.upper(), "")
+    return lambda value, ctx: tables[table].get(value, "")
+
+def upper(value, ctx):
+    return value.upper()
+
+def stripped(value, ctx):
+    return value.strip()
+
+def system_notes(value, ctx):
+    if ctx.battery_condition == "Fail":
+        # An empty SYSNOTES line still gets the separator, as it always has
+        if 'SYSNOTES' in ctx.data:
+            return ctx.data['SYSNOTES'].upper() + ", BATTERY SERVICE RECOMMENDED"
+        return "BATTERY SERVICE RECOMMENDED"
+    return ctx.data['SYSNOTES'].upper() if 'SYSNOTES' in ctx.data else ""
+
+def drive_serial(value, ctx):
+    if ctx.drive_serial is None:
+        raise ValueError("drive has no readable serial number")
+    return ctx.drive_serial.upper()
+
+def display_resolution(value, ctx):
+    parts = value.split()
+    aspect = " (16:9)" if ctx.data['SYSTYPE'].upper() == "A" else " (16:10)"
+    return parts[0] + parts[1] + parts[2] + aspect
+
+def screen_size(value, ctx):
+    return number(value.upper())
+
+def drive_count(value, ctx):
+    return 1 if ctx.drive_serial else 0
+
+def video_adapter(value, ctx):
+    cpu_name = ctx.data['CPUNAME']
+    if cpu_name.split()[0] == "Apple":
+        return cpu_name + " " + str(ctx.cores[0]) + "-CORE"
+    return ctx.data['      Chipset Model'].strip()
+
+def processor_specs(value, ctx):
+    # (Model, Speed, Cores, Type)
+    cpu_name = ctx.data['CPUNAME']
+    cpu_words = cpu_name.split()
+    if cpu_words[0] == "Apple":
+        speed = number(APPLE_MODEL_DICT[cpu_name]) if cpu_name in APPLE_MODEL_DICT else None
+        return cpu_name, speed, ctx.cores[1], cpu_name
+
+    if cpu_words[1] == "Xeon(R)":
+        model = cpu_words[3] + " " + cpu_words[4]
     else:
-        ET.SubElement(system_info, 'Original_Product_Key').text = ""
-
-    # Extract Display Resolution
-    if '          Resolution' in output_data:
-        if output_data['SYSTYPE'].upper() == "A":
-            ET.SubElement(system_info, 'Display_Resolution').text = output_data['          Resolution'].split()[0] + \
-                                                                    output_data['          Resolution'].split()[1] + \
-                                                                    output_data['          Resolution'].split()[2] + " (16:9)"
-        else:
-            ET.SubElement(system_info, 'Display_Resolution').text = output_data['          Resolution'].split()[0] + \
-                                                                    output_data['          Resolution'].split()[1] + \
-                                                                    output_data['          Resolution'].split()[2] + " (16:10)"
+        model = cpu_words[2]
+    speed = number(ctx.data['      Processor Speed'].split()[0])
+    name_words = ctx.data['      Processor Name'].split()
+    if len(name_words) > 3:
+        cpu_type = " ".join(name_words[1:4])
     else:
-        ET.SubElement(system_info, 'Display_Resolution').text = ""
-
-    # Extract Display Size
-    if 'SCREENSIZE' in output_data:
-        ET.SubElement(system_info, 'Display_Size_Est').text = output_data["SCREENSIZE"].upper() + '"'
+        cpu_type = " ".join(name_words[0:3])
+    return model, speed, ctx.cores[0], cpu_type
+
+def ram_speed(value, ctx):
+    cpu_name = ctx.data['CPUNAME']
+    if cpu_name in APPLE_MODEL_DICT:
+        return number(RAM_SPEED_DICT[cpu_name])
+    return number(last_word(ctx.report["Memory"], "Speed"))
+
+def ram_size(value, ctx):
+    return number(WORD_PATTERN.match(ctx.report["Hardware"].first("Memory")).group(0))
+
+def ram_type(value, ctx):
+    if "Apple M" in ctx.data["CPUNAME"]:
+        return "INTEGRATED"
+    return last_word(ctx.report["Memory"], "Type")
+
+def cycle_count(value, ctx):
+    return number(value.strip())
+
+def drive_model(value, ctx):
+    return ctx.drive.first("Model").strip()
+
+def drive_type(value, ctx):
+    # Fall back to the Storage section when the drive doesn't report it
+    medium = ctx.drive.first("Medium Type")
+    if medium is None:
+        medium = ctx.report["Storage"].first("Medium Type")
+    return DRIVE_TYPES.get(medium.split()[0].upper())
+
+def capacity_gb(match):
+    gigabytes = number(match.group("capacity"))
+    return gigabytes * 1000 if match.group(2) == "TB" else gigabytes
+
+def drive_capacity(value, ctx):
+    for capacity in ctx.drive.values("Capacity"):
+        match = DRIVE_CAPACITY_PATTERN.match(capacity)
+        if match is not None:
+            return capacity_gb(match)
+    return None
+
+def erasure_date(value, ctx):
+    return datetime.datetime.now().strftime('%m/%d/%Y')
+
+DRIVE_TYPES = {"SSD": "SSD", "SOLID": "SSD", "ROTATIONAL": "HDD"}
+
+SYSINFO_SCHEMA = (
+    Section("SYSTEM_INVENTORY", ()),
+    Section("SYSTEM_INVENTORY/System_Information", (
+        Field('Tech_ID', 'TECHID', upper, name='tech_id'),
+        Field('Asset_Identifier', 'SYSUID', upper, name='asset_id'),
+        Field('System_Chassis_Type', 'SYSTYPE', lookup('ASSET_CATEGORY_DICT', upper=True), name='chassis_type'),
+        Field('System_Manufacturer', None, fixed("APPLE"), name='manufacturer'),
+        Field('System_ProductName', 'BUILDNO', upper, name='model_number'),
+        Field('System_Serial_Number', '      Serial Number (system)', stripped, name='system_serial'),
+        Field('System_UUID', None, system_notes, name='notes'),
+        Field('System_Version', 'OSVER', lookup('MAC_OS_DICT'), name='os_version'),
+        Field('System_Memory', None, drive_serial, error="DRIVE SERIAL NUM ERROR/NO DRIVE PRESENT", name='system_drive_serial'),
+        Field('Original_Product_Key', 'FINALGRADE', upper, name='final_grade'),
+        Field('Display_Resolution', '          Resolution', display_resolution, name='display_resolution'),
+        Field('Display_Size_Est', 'SCREENSIZE', screen_size, None, name='screen_size', unit=Unit('"')),
+        Field('MAC_Address', None, fixed("NIST 800-88"), name='erasure_standard'),   # Drive Erasure Method
+        Field('Color', 'SYSCOLOR', upper, name='color'),
+    )),
+    Section("SYSTEM_INVENTORY/Devices", (
+        Field('Network_Device', None, fixed(''), name='network_device'),
+        Field('Multimedia', None, drive_count, name='drive_count', unit=Unit()),
+        Field('USB_Controller', None, fixed('FaceTime HD Camera (Built-in)'), name='webcam'),   # Webcam Type
+        Field('Video_Adapter', None, video_adapter, error="CPU MODEL ERROR", name='video_adapter'),
+        Field('Data_Aquisition', 'SYSTYPE', lookup('ASSET_CATEGORY_DICT', upper=True), name='device_chassis_type'),
+        Field('Cardbus', 'COSGRADE', lookup('GRADE_DICT', upper=True), name='cosmetic_grade'),   # Cosmetic Grade
+        Field('Flash_Reader', None, fixed('N/A'), name='defects'),   # Defects Causing Failure
+    )),
+    Section("SYSTEM_INVENTORY/Devices/Processor", (
+        Field(('Model', 'Speed', 'Cores', 'Type'), None, processor_specs, None, error="CPU SPECS ERROR",
+              name=('cpu_model', 'cpu_speed', 'cpu_cores', 'cpu_type'), unit=(None, Unit(" GHz"), Unit(), None)),
+    )),
+    Section("SYSTEM_INVENTORY/Devices/Memory", (
+        Field('FormFactor', None, fixed("2"), name='ram_count'),   # RAM Count
+        Field('Speed', None, ram_speed, None, error="RAM SPEED ERROR", name='ram_speed', unit=Unit(" MHz")),
+        Field('Size', None, ram_size, None, error="RAM SIZE ERROR", name='ram_size', unit=Unit(" GB")),
+        Field('Type', None, ram_type, error="RAM TYPE ERROR", name='ram_type'),
+    )),
+    Section("SYSTEM_INVENTORY/Devices/Optical", (
+        Field('Model', None, fixed('Not Present'), name='optical_drive'),
+        Field('Type', 'LCDGRADE', lookup('GRADE_DICT', upper=True), name='lcd_grade'),   # LCD Grade
+    )),
+    Section("SYSTEM_INVENTORY/Devices/Battery", (
+        Field('Health', '          Cycle Count', cycle_count, None, name='battery_cycles', unit=Unit(" CYCLES")),
+        Field('Grade', '          Condition', fixed("Passed - Included"), name='battery_grade'),
+        Field('Capacity', 'SYSBAT', upper, name='battery_capacity'),
+    )),
+    Section("SYSTEM_INVENTORY/Devices/Storage", (
+        Field('Model', None, drive_model, error="DRIVE MODEL ERROR", name='drive_model'),
+        Field('DeviceType', None, drive_type, error="DRIVE TYPE ERROR", name='drive_type'),
+        Field('SerialNumber', None, drive_serial, error="DRIVE SERIAL ERROR", name='drive_serial'),
+        Field('ErasureMethod', None, fixed("NIST 800-88 rev1 Clear"), name='erasure_method'),
+        Field('ErasureResults', None, fixed("PASS"), name='erasure_result'),
+        Field('Size', None, drive_capacity, None, error="DRIVE CAPACITY ERROR", name='drive_size', unit=Capacity()),
+        Field('ErasureDate', None, erasure_date, name='erasure_date'),
+    ), when=lambda ctx: bool(ctx.drive_serial)),
+)
+
+# Keys scan_report collects: every schema source plus the ones
+# transforms and RecordContext read from ctx.data themselves
+CONTEXT_KEYS = ('SYSNOTES', 'SYSTYPE', 'CPUNAME', '      Chipset Model',
+                '      Processor Name', '      Processor Speed', '          Condition')
+PARSED_KEYS = frozenset([field.source for section in SYSINFO_SCHEMA for field in section.fields
+                         if field.source is not None] + list(CONTEXT_KEYS))
+
+def field_value(field, ctx, errors):
+    if field.source is not None and field.source not in ctx.data:
+        result = field.fallback
     else:
-        ET.SubElement(system_info, 'Display_Size_Est').text = ""
+        value = ctx.data[field.source] if field.source is not None else None
+        try:
+            result = field.transform(value, ctx)
+        except Exception:
+            if field.error is None:
+                raise
+            print(field.error)
+            errors.append(field.error + "\n")
+            result = field.fallback
+
+    if isinstance(field.tag, tuple) and not isinstance(result, tuple):
+        result = (result,) * len(field.tag)
+    return result
+
+def as_tuple(value):
+    # Field tags and names are a string, or a tuple for a group like processor_specs
+    return value if isinstance(value, tuple) else (value,)
+
+def field_units(field):
+    # The unit of each of the field's tags, None for text
+    if isinstance(field.tag, tuple):
+        return field.unit or (None,) * len(field.tag)
+    return (field.unit,)
+
+class DeviceRecord:
+    """
+    Everything one log says about a device, by the Field names in
+    SYSINFO_SCHEMA, plus the sections whose condition left them out.
 
-    # Input Drive Erasure Method
-    ET.SubElement(system_info, 'MAC_Address').text = "NIST 800-88"
+    One parse fills it; encode_sysinfo, encode_jsonl and encode_csv_row
+    turn it into each output format without touching the raw text again.
+    A value of None is an element the XML leaves out.
 
-    if 'SYSCOLOR' in output_data:
-        ET.SubElement(system_info, 'Color').text = output_data['SYSCOLOR'].upper()
-    else:
-        ET.SubElement(system_info, 'Color').text = ""
+    Fields with a unit hold numbers, an int or float in the unit's terms
+    (GHz, MHz, GB, cycles, inches), or None when unknown; only
+    encode_sysinfo writes the unit. A value the log did not give as a
+    plain number is kept as its text.
+    """
+    __slots__ = tuple(name for section in SYSINFO_SCHEMA for field in section.fields
+                      for name in as_tuple(field.name)) + ("skipped_sections",)
+
+    def __init__(self):
+        for name in self.__slots__:
+            setattr(self, name, None)
+        self.skipped_sections = ()
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {name: getattr(self, name) for name in RECORD_FIELDS}
+
+RECORD_FIELDS = DeviceRecord.__slots__[:-1]
+
+def build_record(output_data, total_cores, input_text, errors, report=None):
+    # report is scan_report's section index, when the caller already has it
+    if report is None:
+        report = tokenize_report(input_text)
+    ctx = RecordContext(output_data, total_cores, report)
+    record = DeviceRecord()
+    for section in SYSINFO_SCHEMA:
+        if section.when is not None and not section.when(ctx):
+            record.skipped_sections += (section.path,)
+            continue
+        for field in section.fields:
+            result = field_value(field, ctx, errors)
+            if isinstance(field.name, tuple):
+                for name, text in zip(field.name, result):
+                    setattr(record, name, text)
+            else:
+                setattr(record, field.name, result)
+    return record
 
-    # /// System_Information
+def encode_sysinfo(record):
+    sysinfo = ET.Element('SYSINFO')
+    elements = {"": sysinfo}
+    for section in SYSINFO_SCHEMA:
+        if section.path in record.skipped_sections:
+            continue
+        parent_path, _, tag = section.path.rpartition("/")
+        element = ET.SubElement(elements[parent_path], tag)
+        elements[section.path] = element
+        for field in section.fields:
+            for tag, name, unit in zip(as_tuple(field.tag), as_tuple(field.name), field_units(field)):
+                value = getattr(record, name)
+                if unit is not None:
+                    ET.SubElement(element, tag).text = unit.text(value)
+                elif value is not None or isinstance(field.tag, tuple):
+                    ET.SubElement(element, tag).text = value
+    return sysinfo
+
+def decode_sysinfo(sysinfo):
+    # Back from a SYSINFO document to its record, for XMLs already on disk
+    record = DeviceRecord()
+    for section in SYSINFO_SCHEMA:
+        element = sysinfo.find(section.path)
+        if element is None:
+            record.skipped_sections += (section.path,)
+            continue
+        for field in section.fields:
+            for tag, name, unit in zip(as_tuple(field.tag), as_tuple(field.name), field_units(field)):
+                child = element.find(tag)
+                if child is not None:
+                    text = child.text or ""
+                    setattr(record, name, text if unit is None else unit.parse(text))
+    return record
+
+def build_sysinfo(output_data, total_cores, input_text, errors):
+    return encode_sysinfo(build_record(output_data, total_cores, input_text, errors))
+
+def encode_jsonl(record):
+    return json.dumps(record.as_dict(), ensure_ascii=False) + "\n"
+
+def encode_csv_row(record):
+    # Columns are RECORD_FIELDS; a missing value is an empty cell
+    buffer = io.StringIO()
+    csv.writer(buffer).writerow(getattr(record, name) for name in RECORD_FIELDS)
+    return buffer.getvalue()
+
+# minidom stopped escaping " in text nodes in Python 3.13; follow whichever
+# behaviour this interpreter has so output matches toprettyxml() exactly
+QUOTE_TEXT = "&quot;" in minidom.parseString('<q>"</q>').documentElement.toxml()
+
+# Characters XML 1.0 cannot carry at all; expat refused them when the old
+# toprettyxml() path parsed its own output back
+XML_ILLEGAL_PATTERN = re.compile("[^\t\n\r\x20-\ud7ff\ue000-\ufffd\U00010000-\U0010ffff]")
+
+def escape_xml_text(text):
+    illegal = XML_ILLEGAL_PATTERN.search(text)
+    if illegal is not None:
+        raise ValueError(f"{illegal.group()!r} at offset {illegal.start()} cannot be written to XML")
+    if "\r" in text:
+        # A parser hands every line end back as \n, so the old path did too
+        text = text.replace("\r\n", "\n").replace("\r", "\n")
+    if "&" in text:
+        text = text.replace("&", "&amp;")
+    if "<" in text:
+        text = text.replace("<", "&lt;")
+    if ">" in text:
+        text = text.replace(">", "&gt;")
+    if QUOTE_TEXT and '"' in text:
+        text = text.replace('"', "&quot;")
+    return text
+
+def write_pretty_xml(element, write, indent=""):
+    """
+    Write an element tree in exactly the layout of minidom's
+    toprettyxml(indent="\t"), without the ET.tostring -> parseString round trip.
 
-    # /// Devices
-    devices = ET.SubElement(system_inventory, 'Devices')
-    # Input Network Device
-    ET.SubElement(devices, 'Network_Device').text = ''
-    # Input Drive Count
-    if SERIALNUM != "":
-        ET.SubElement(devices, 'Multimedia').text = '1'
+    Args:
+        element: ElementTree element to write
+        write: Callable taking str, e.g. file.write or StringIO.write
+        indent: Indentation of this element
+    """
+    tag = element.tag
+    if len(element):
+        write(f"{indent}<{tag}>\n")
+        child_indent = indent + "\t"
+        for child in element:
+            write_pretty_xml(child, write, child_indent)
+        write(f"{indent}</{tag}>\n")
+    elif element.text:
+        write(f"{indent}<{tag}>{escape_xml_text(element.text)}</{tag}>\n")
     else:
-        ET.SubElement(devices, 'Multimedia').text = '0'
-    # Input Webcam Type
-    ET.SubElement(devices, 'USB_Controller').text = 'FaceTime HD Camera (Built-in)'
+        write(f"{indent}<{tag}/>\n")
 
-    # Extract CPU Model
-    try:
-        if output_data['CPUNAME'].split()[0] == "Apple":
-            ET.SubElement(devices, 'Video_Adapter').text = output_data['CPUNAME'] + " " + str(total_cores[0]) + "-CORE"
-        else:
-            ET.SubElement(devices, 'Video_Adapter').text = output_data['      Chipset Model'].strip()
-    except:
-        ET.SubElement(devices, 'Video_Adapter').text = ""
-        print("CPU MODEL ERROR")
-        ERRORS += "CPU MODEL ERROR\n"
-
-    # Extract Form Factor
-    if 'SYSTYPE' in output_data:
-        if output_data['SYSTYPE'].upper() in ASSET_CATEGORY_DICT:
-            ET.SubElement(devices, 'Data_Aquisition').text = ASSET_CATEGORY_DICT[output_data["SYSTYPE"].upper()]
-        else:
-            ET.SubElement(devices, 'Data_Aquisition').text = ""
-    else:
-        ET.SubElement(devices, 'Data_Aquisition').text = ""
+def write_sysinfo(sysinfo, write):
+    write('<?xml version="1.0" ?>\n')
+    write_pretty_xml(sysinfo, write)
 
-    # Extract Cosmetic Grade
-    if 'COSGRADE' in output_data:
-        if output_data['COSGRADE'].upper() in GRADE_DICT:
-            ET.SubElement(devices, 'Cardbus').text = GRADE_DICT[output_data['COSGRADE'].upper()]
-        else:
-            ET.SubElement(devices, 'Cardbus').text = ""
-    else:
-        ET.SubElement(devices, 'Cardbus').text = ""
+def encode_xml(record):
+    buffer = io.StringIO()
+    write_sysinfo(encode_sysinfo(record), buffer.write)
+    return buffer.getvalue()
 
-    # Input Defects Causing Failure
-    ET.SubElement(devices, 'Flash_Reader').text = 'N/A'
-    # /// Devices
+def create_xml(output_data, total_cores, input_text, errors=None):
+    if errors is None:
+        errors = []
+    return encode_xml(build_record(output_data, total_cores, input_text, errors))
 
-    # /// Processor
-    processor = ET.SubElement(devices, 'Processor')
+# Output formats a parsed record can be written in
+ENCODERS = {"xml": encode_xml, "jsonl": encode_jsonl, "csv": encode_csv_row}
 
-    # Extract CPU Specs for M1's/M2's
-    try:
-        if output_data['CPUNAME'].split()[0] == "Apple":
-            # Extract CPU Model
-            ET.SubElement(processor, 'Model').text = output_data['CPUNAME']
-            # Extract CPU Speed
-            if output_data['CPUNAME'] in APPLE_MODEL_DICT:
-                ET.SubElement(processor, 'Speed').text = APPLE_MODEL_DICT[output_data['CPUNAME']] + " GHz"
-            else:
-                ET.SubElement(processor, 'Speed').text = ""
-            # Extract CPU Cores
-            ET.SubElement(processor, 'Cores').text = str(total_cores[1])
-            # Extract CPU Name
-            ET.SubElement(processor, 'Type').text = output_data['CPUNAME']
+def save_to_output_xml(xml_string, output_file):
+    with open(output_file, 'w', encoding='utf-8') as file:
+        file.write(xml_string)
 
+def log_errors(raw_path, errors):
+    if not errors:
+        return True
+    if ERROR_REPORTER is not None:
+        ERROR_REPORTER.report(raw_path, errors)
+        return False
+    uid = os.path.basename(raw_path)[:-4]
+    with errors_dir(uid) as errors_path:
+        error_file = os.path.join(errors_path,
+                                  uid+".log"
+                                  )
+        if os.path.isfile(error_file):
+            os.remove(error_file)
+        f = open(error_file, "a")
+        f.write("".join(errors))
+        f.close()
+        shutil.copy(raw_path, errors_path)
+    return False
 
-        # Extract CPU Specs for Intel Processors
-        else:
-            # Extract CPU Model
-            if output_data['CPUNAME'].split()[1] == "Xeon(R)":
-                ET.SubElement(processor, 'Model').text = output_data['CPUNAME'].split()[3] + " " + output_data['CPUNAME'].split()[4]
-            else:
-                ET.SubElement(processor, 'Model').text = output_data['CPUNAME'].split()[2]
-            # Extract CPU Speed
-            ET.SubElement(processor, 'Speed').text = output_data['      Processor Speed'].split()[0] + " GHz"
-            # Extract CPU Cores
-            ET.SubElement(processor, 'Cores').text = str(total_cores[0])
-            # Extract CPU Name
-            if len(output_data['      Processor Name'].split()) > 3:
-                ET.SubElement(processor, 'Type').text = output_data['      Processor Name'].split()[1] + " " + \
-                                                        output_data['      Processor Name'].split()[2] + " " + \
-                                                        output_data['      Processor Name'].split()[3]
-            else:
-                ET.SubElement(processor, 'Type').text = output_data['      Processor Name'].split()[0] + " " + \
-                                                        output_data['      Processor Name'].split()[1] + " " + \
-                                                        output_data['      Processor Name'].split()[2]
-    except:
-        ET.SubElement(processor, 'Model').text = ""
-        ET.SubElement(processor, 'Speed').text = ""
-        ET.SubElement(processor, 'Cores').text = ""
-        ET.SubElement(processor, 'Type').text = ""
-        print("CPU SPECS ERROR")
-        ERRORS += "CPU SPECS ERROR\n"
-    # /// Processor
-
-    # /// Memory
-    memory = ET.SubElement(devices, 'Memory')
-
-    # Input RAM Count
-    ET.SubElement(memory, 'FormFactor').text = "2"
-
-    # Extract RAM Speed
-    try:
-        if (output_data['CPUNAME'] in APPLE_MODEL_DICT):
-            RAMSPEED = RAM_SPEED_DICT[output_data['CPUNAME']]
-        else:
-            memorytemp = re.search(r"\nMemory:(.*?)\n\S", input_text, re.DOTALL).group(1)
-            pattern4 = r"Speed:\s*(\w+)"
-            for match in re.finditer(pattern4, memorytemp, re.DOTALL):
-                if match.group(1) != " Empty":
-                    RAMSPEED = match.group(1)
-            # print(RAMSPEED)
-        ET.SubElement(memory, 'Speed').text = RAMSPEED + " MHz"
-    except:
-        ET.SubElement(memory, 'Speed').text = ""
-        print("RAM SPEED ERROR")
-        ERRORS += "RAM SPEED ERROR\n"
-
-    # Extract RAM Size
-    try:
-        pattern5 = r"Hardware:.*?Memory:\s*(\w+)"
-        RAMSIZE = re.search(pattern5, input_text, re.DOTALL).group(1)
-        ET.SubElement(memory, 'Size').text = RAMSIZE + " GB"
-    except:
-        ET.SubElement(memory, 'Size').text = ""
-        print("RAM SIZE ERROR")
-        ERRORS += "RAM SIZE ERROR\n"
-
-    # Extract RAM Type
-    try:
-        if ("Apple M" in output_data["CPUNAME"]):
-            ET.SubElement(memory, 'Type').text = "INTEGRATED"
-        else:
-            # pattern6 = r"Memory Slots:.*?Type:\s*(\w+)"
-            # RAMTYPE = re.search(pattern6, input_text, re.DOTALL).group(1)
-            # ET.SubElement(memory, 'Type').text = RAMTYPE
-            typetemp = re.search(r"\nMemory:(.*?)\n\S", input_text, re.DOTALL).group(1)
-            pattern4 = r"Type:\s*(\w+)"
-            for match in re.finditer(pattern4, typetemp, re.DOTALL):
-                if match.group(1) != " Empty":
-                    RAMTYPE = match.group(1)
-            ET.SubElement(memory, 'Type').text = RAMTYPE
-    except:
-        ET.SubElement(memory, 'Type').text = ""
-        print("RAM TYPE ERROR")
-        ERRORS += "RAM TYPE ERROR\n"
-    # /// Memory
-
-    # /// Optical
-    optical = ET.SubElement(devices, 'Optical')
-
-    # Input Optical Drive
-    ET.SubElement(optical, 'Model').text = 'Not Present'
-    # Extract LCD Grade
-    if 'LCDGRADE' in output_data:
-        if output_data['LCDGRADE'].upper() in GRADE_DICT:
-            ET.SubElement(optical, 'Type').text = GRADE_DICT[output_data['LCDGRADE'].upper()]
-        else:
-            ET.SubElement(optical, 'Type').text = ""
-    else:
-        ET.SubElement(optical, 'Type').text = ""
-    # /// Optical
-
-    # /// Battery
-    battery = ET.SubElement(devices, 'Battery')
-    # Extract Cycle Count
-    if '          Cycle Count' in output_data:
-        ET.SubElement(battery, 'Health').text = output_data['          Cycle Count'].strip() + " CYCLES"
-    else:
-        ET.SubElement(battery, 'Health').text = ""
-    # Extract Battery Disposition
-    if '          Condition' in output_data:
-        ET.SubElement(battery, 'Grade').text = "Passed - Included"
-    else:
-        ET.SubElement(battery, 'Grade').text = ""
-    # Extract Battery Health Percentage
-    if 'SYSBAT' in output_data:
-        ET.SubElement(battery, 'Capacity').text = output_data['SYSBAT'].upper()
-    else:
-        ET.SubElement(battery, 'Capacity').text = ""
-    # /// Battery
+class ErrorReporter:
+    """
+    Takes failed logs off the hot path. report() only queues the failure;
+    a background thread writes the queued ones every flush_interval
+    seconds, or as soon as a cycle ends:
+    - each log's Errors/<uid>/<uid>.log;
+    - a rename of the raw log into Errors/<uid>, server-side on the share,
+      instead of a byte copy;
+    - one summary per flush under Errors/_summaries with every failed log
+      and how often each error came up.
+
+    The raw log belongs to the reporter from report() on, so callers must
+    not remove it. Until the flush it stays where it was, and a crash just
+    means it fails again after the restart.
+    """
 
-    # /// Storage
-    if SERIALNUM != "":
-        storage = ET.SubElement(devices, 'Storage')
+    def __init__(self, flush_interval: float = 5.0):
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._queue: List[Tuple[str, List[str]]] = []
+        self._owned: Set[str] = set()   # reported and not written yet
+        self._wake = threading.Event()
+        self._stop = False
+        self._thread: Optional[threading.Thread] = None
+
+    def report(self, raw_path: str, errors: List[str]) -> None:
+        with self._lock:
+            self._queue.append((raw_path, list(errors)))
+            self._owned.add(raw_path)
+        METRICS.count("errors_reported_total", "queued")
+
+    def holds(self, raw_path: str) -> bool:
+        with self._lock:
+            return raw_path in self._owned
+
+    def cycle_done(self) -> None:
+        with self._lock:
+            if self._queue:
+                self._wake.set()
+
+    def flush(self) -> None:
+        with self._lock:
+            batch, self._queue = self._queue, []
+        if not batch:
+            return
+        with METRICS.timed("error_flush"):
+            failed = []
+            for raw_path, errors in batch:
+                try:
+                    self.write(raw_path, errors)
+                except FileNotFoundError as e:
+                    if not os.path.exists(raw_path):
+                        continue   # raw log gone, e.g. reclaimed by another replica
+                    print(f"Could not write errors for {raw_path}: {e}")
+                    failed.append((raw_path, errors))
+                except OSError as e:
+                    print(f"Could not write errors for {raw_path}: {e}")
+                    failed.append((raw_path, errors))
+            try:
+                self.summarize(batch)
+            except OSError as e:
+                print(f"Could not write error summary: {e}")
+        with self._lock:
+            if failed:
+                # Share trouble; try those again on the next flush
+                self._queue[:0] = failed
+            self._owned = {raw_path for raw_path, _ in self._queue}
+
+    def write(self, raw_path: str, errors: List[str]) -> None:
+        uid = os.path.basename(raw_path)[:-4]
+        with errors_dir(uid) as errors_path:
+            with open(os.path.join(errors_path, uid + ".log"), "w") as f:
+                f.write("".join(errors))
+            shutil.move(raw_path, os.path.join(errors_path, os.path.basename(raw_path)))
+
+    def summarize(self, batch: List[Tuple[str, List[str]]]) -> None:
+        counts: Dict[str, int] = {}
+        lines = []
+        for raw_path, errors in batch:
+            firsts = [error.strip().splitlines()[0] for error in errors if error.strip()]
+            for first in firsts:
+                counts[first] = counts.get(first, 0) + 1
+            lines.append(f"{os.path.basename(raw_path)[:-4]}\t{'; '.join(firsts)}\n")
+        name = datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S") + ".log"
+        with errors_dir("_summaries") as summaries:
+            with open(os.path.join(summaries, name), "a") as f:
+                f.write(f"{len(batch)} failed logs\n\n")
+                for error, count in sorted(counts.items(), key=lambda item: -item[1]):
+                    f.write(f"{count:5d}  {error}\n")
+                f.write("\n")
+                f.writelines(lines)
+        print(f"{len(batch)} failed logs, summary in {name}")
+
+    def _run(self) -> None:
+        while not self._stop:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            # Spooled errors are written locally; straight to the share they wait for it
+            if SPOOL is not None or share_available():
+                self.flush()
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._run, name="error-flush", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop = True
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.flush()
+
+ERROR_REPORTER: Optional[ErrorReporter] = None
+
+# Metrics
+
+STAGE_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+class Histogram:
+    __slots__ = ("counts", "sum", "count")
+
+    def __init__(self):
+        self.counts = [0] * len(STAGE_BUCKETS)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        index = bisect.bisect_left(STAGE_BUCKETS, value)
+        if index < len(self.counts):   # past the last bound only lands in +Inf
+            self.counts[index] += 1
+        self.sum += value
+        self.count += 1
+
+class StageMetrics:
+    """
+    Latency histograms per pipeline stage (discover, read, parse, build_xml,
+    write_xml, upload, cleanup) plus counters and gauges, written out
+    periodically in the Prometheus text exposition format so a node
+    exporter textfile collector, or a human with cat, can read them.
+    """
 
-        # Extract Drive Model
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stages: Dict[str, Histogram] = {}
+        self._counters: Dict[Tuple[str, str], float] = {}
+        self._gauges: Dict[str, float] = {}
+        self._last_dump = time.monotonic()
+
+    def observe(self, stage: str, seconds: float) -> None:
+        with self._lock:
+            histogram = self._stages.get(stage)
+            if histogram is None:
+                histogram = self._stages[stage] = Histogram()
+            histogram.observe(seconds)
+
+    @contextlib.contextmanager
+    def timed(self, stage: str):
+        started = time.perf_counter()
         try:
-            if re.search(r"NVMExpress:(.*?)\n\S", input_text, re.DOTALL) is not None:
-                match = re.search(r"NVMExpress:(.*?)\n\S", input_text, re.DOTALL).group(1)
-                MODEL = re.search(r"Model:\s*(.*?)\n", match, re.DOTALL).group(1)
-            elif re.search(r"SATA/SATA Express:(.*?)\n\S", input_text, re.DOTALL) is not None:
-                match = re.search(r"SATA/SATA Express:(.*?)\n\S", input_text, re.DOTALL).group(1)
-                MODEL = re.search(r"Model:\s*(.*?)\n", match, re.DOTALL).group(1)
-            elif re.search(r"SATA:(.*?)\n\S", input_text, re.DOTALL) is not None:
-                match = re.search(r"SATA:(.*?)\n\S", input_text, re.DOTALL).group(1)
-                MODEL = re.search(r"Model:\s*(.*?)\n", match, re.DOTALL).group(1)
-            else:
-                MODEL = ""
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - started)
+
+    def count(self, name: str, label: str, amount: float = 1) -> None:
+        with self._lock:
+            self._counters[(name, label)] = self._counters.get((name, label), 0) + amount
+
+    def set_gauge(self, name: str, value: float) -> None:
+        with self._lock:
+            self._gauges[name] = value
+
+    def render(self) -> str:
+        lines = [
+            "# HELP apple_converter_stage_seconds Time spent per log in each pipeline stage",
+            "# TYPE apple_converter_stage_seconds histogram",
+        ]
+        with self._lock:
+            for stage, histogram in sorted(self._stages.items()):
+                cumulative = 0
+                for bound, count in zip(STAGE_BUCKETS, histogram.counts):
+                    cumulative += count
+                    lines.append(f'apple_converter_stage_seconds_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+                lines.append(f'apple_converter_stage_seconds_bucket{{stage="{stage}",le="+Inf"}} {histogram.count}')
+                lines.append(f'apple_converter_stage_seconds_sum{{stage="{stage}"}} {histogram.sum:.6f}')
+                lines.append(f'apple_converter_stage_seconds_count{{stage="{stage}"}} {histogram.count}')
+
+            for name in sorted({name for name, _ in self._counters}):
+                lines.append(f"# TYPE apple_converter_{name} counter")
+                for (counter, label), value in sorted(self._counters.items()):
+                    if counter == name:
+                        lines.append(f'apple_converter_{name}{{result="{label}"}} {value:g}')
+
+            for name, value in sorted(self._gauges.items()):
+                lines.append(f"# TYPE apple_converter_{name} gauge")
+                lines.append(f"apple_converter_{name} {value:g}")
+        return "\n".join(lines) + "\n"
+
+    def dump(self, path: str) -> None:
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        temp_path = path + ".tmp"
+        with open(temp_path, 'w', encoding='utf-8') as file:
+            file.write(self.render())
+        os.replace(temp_path, path)   # readers never see a half-written file
+        self._last_dump = time.monotonic()
+
+    def maybe_dump(self, path: str, interval: float) -> None:
+        if time.monotonic() - self._last_dump >= interval:
+            self.dump(path)
+
+METRICS = StageMetrics()
+
+def metrics_path():
+    return CONFIG.get("METRICS_FILE") or os.path.join(CONFIG.get("STATE_DIR", "state"), "metrics.prom")
+
+
+class FTPSessionPool:
+    """
+    Pool of logged-in FTP/FTPS sessions that are kept alive across files and
+    processing cycles, so an upload no longer pays for a connect, TLS
+    handshake and login every time.
 
-            # Input Drive Model
-            ET.SubElement(storage, 'Model').text = MODEL.strip()
-        except:
-            ET.SubElement(storage, 'Model').text = ""
-            print("DRIVE MODEL ERROR")
-            ERRORS += "DRIVE MODEL ERROR\n"
+    How many sessions may upload at once is adapted AIMD-style: the limit
+    grows by one per round of clean uploads made while every slot was busy,
+    and halves when an upload fails or takes longer than latency_tolerance
+    times the usual (baseline) time, at most once per round. The server's slowdown under parallel load then
+    settles the limit instead of a hand-tuned worker count.
 
-        # Input Drive Type
-        try:
-            # pattern9 = r"Storage:.*?Medium Type:\s*(.*?)\n"
-            # pattern9 = r"SATA/SATA Express:.*?Medium Type:\s*(.*?)\n"
-            # hddtype = re.search(pattern9, input_text, re.DOTALL).group(1)
-            if re.search(r"NVMExpress:(.*?)\n\S", input_text, re.DOTALL) is not None:
-                match = re.search(r"NVMExpress:(.*?)\n\S", input_text, re.DOTALL).group(1)
-                if re.search(r"Medium Type:\s*(.*?)\n", match, re.DOTALL) is not None:
-                    hddtype = re.search(r"Medium Type:\s*(.*?)\n", match, re.DOTALL).group(1)
-                else:
-                    match = re.search(r"Storage:(.*)", input_text, re.DOTALL).group(1)
-                    hddtype = re.search(r"Medium Type:\s*(.*?)\n", match, re.DOTALL).group(1)
-            elif re.search(r"SATA/SATA Express:(.*?)\n\S", input_text, re.DOTALL) is not None:
-                match = re.search(r"SATA/SATA Express:(.*?)\n\S", input_text, re.DOTALL).group(1)
-                if re.search(r"Medium Type:\s*(.*?)\n", match, re.DOTALL).group(1) is not None:
-                    hddtype = re.search(r"Medium Type:\s*(.*?)\n", match, re.DOTALL).group(1)
-                else:
-                    match = re.search(r"Storage:(.*?)", input_text, re.DOTALL).group(1)
-                    hddtype = re.search(r"Medium Type:\s*(.*?)\n", match, re.DOTALL).group(1)
-            elif re.search(r"SATA:(.*?)\n\S", input_text, re.DOTALL) is not None:
-                match = re.search(r"SATA:(.*?)\n\S", input_text, re.DOTALL).group(1)
-                if re.search(r"Medium Type:\s*(.*?)\n", match, re.DOTALL).group(1) is not None:
-                    hddtype = re.search(r"Medium Type:\s*(.*?)\n", match, re.DOTALL).group(1)
-                else:
-                    match = re.search(r"Storage:(.*?)", input_text, re.DOTALL).group(1)
-                    hddtype = re.search(r"Medium Type:\s*(.*?)\n", match, re.DOTALL).group(1)
-
-            hddtype = hddtype.split()[0]
-            if hddtype.upper() == "SSD":
-                ET.SubElement(storage, 'DeviceType').text = "SSD"
-            elif hddtype.upper() == "SOLID":
-                ET.SubElement(storage, 'DeviceType').text = "SSD"
-            elif hddtype.upper() == "ROTATIONAL":
-                ET.SubElement(storage, 'DeviceType').text = "HDD"
-        except:
-            ET.SubElement(storage, 'DeviceType').text = ""
-            print("DRIVE TYPE ERROR")
-            ERRORS += "DRIVE TYPE ERROR\n"
-
-            # Input Drive Serial Number
-        try:
-            ET.SubElement(storage, 'SerialNumber').text = SERIALNUM.upper()
-        except:
-            ET.SubElement(storage, 'SerialNumber').text = ""
-            print("DRIVE SERIAL ERROR")
-            ERRORS += "DRIVE SERIAL ERROR\n"
+    Args:
+        host, port, user, password: FTP endpoint and credentials
+        size: Maximum number of concurrent sessions, the limit's ceiling
+        tls: "auto" (AUTH TLS when offered), "yes" (require it) or "no"
+        timeout: Socket timeout in seconds
+        idle_check: Sessions idle longer than this are NOOP-probed before reuse
+        adaptive: False keeps the limit at size
+        latency_tolerance: Slowdown over the baseline upload time that counts as overload
+    """
 
-        # Input Erasure Method
-        ET.SubElement(storage, 'ErasureMethod').text = "NIST 800-88 rev1 Clear"
+    def __init__(self, host: str, port: int, user: str, password: str,
+                 size: int = 4, tls: str = "auto", timeout: float = 30,
+                 idle_check: float = 30, adaptive: bool = True,
+                 latency_tolerance: float = 2):
+        self.host = host
+        self.port = port
+        self.user = user
+        self.password = password
+        self.size = max(1, size)
+        self.tls = tls.lower()
+        self.timeout = timeout
+        self.idle_check = idle_check
+        self.adaptive = adaptive
+        self.latency_tolerance = latency_tolerance
+
+        # Same trust policy as the old `set ssl:verify-certificate no`
+        self._ssl_context = ssl.create_default_context()
+        self._ssl_context.check_hostname = False
+        self._ssl_context.verify_mode = ssl.CERT_NONE
+
+        self._lock = threading.Lock()
+        self._slot_freed = threading.Condition(self._lock)
+        self._in_use = 0
+        self._idle: List[Tuple[ftplib.FTP, float]] = []
+        self._closed = False
+
+        self.limit = 1.0 if adaptive else float(self.size)
+        self._baseline: Optional[float] = None
+        self._backed_off = 0.0
+        METRICS.set_gauge("ftp_upload_limit", int(self.limit))
+
+    def _connect(self) -> ftplib.FTP:
+        if self.tls in ("auto", "yes"):
+            ftp = ftplib.FTP_TLS(context=self._ssl_context, timeout=self.timeout)
+            ftp.connect(self.host, self.port)
+            try:
+                ftp.auth()
+            except ftplib.error_perm:
+                ftp.close()
+                if self.tls == "yes":
+                    raise
+            else:
+                ftp.login(self.user, self.password)
+                ftp.prot_p()
+                return ftp
 
-        # Input Erasure Status
-        ET.SubElement(storage, 'ErasureResults').text = "PASS"
+        ftp = ftplib.FTP(timeout=self.timeout)
+        ftp.connect(self.host, self.port)
+        ftp.login(self.user, self.password)
+        return ftp
 
-        # Extract Drive Capacity
+    @staticmethod
+    def _discard(ftp: ftplib.FTP) -> None:
         try:
-            if re.search(r"NVMExpress:(.*?)\n\S", input_text, re.DOTALL) is not None:
-                match = re.search(r"NVMExpress:(.*?)\n\S", input_text, re.DOTALL).group(1)
-                capmatch = re.search(r"Capacity: (?P<capacity>\d+(?:\.\d+)?) (TB|GB)", match, re.DOTALL)
-            elif re.search(r"SATA/SATA Express:(.*?)\n\S", input_text, re.DOTALL) is not None:
-                match = re.search(r"SATA/SATA Express:(.*?)\n\S", input_text, re.DOTALL).group(1)
-                capmatch = re.search(r"Capacity: (?P<capacity>\d+(?:\.\d+)?) (TB|GB)", match, re.DOTALL)
-            elif re.search(r"SATA:(.*?)\n\S", input_text, re.DOTALL) is not None:
-                match = re.search(r"SATA:(.*?)\n\S", input_text, re.DOTALL).group(1)
-                capmatch = re.search(r"Capacity: (?P<capacity>\d+(?:\.\d+)?) (TB|GB)", match, re.DOTALL)
-
-            if capmatch is not None:
-                capacity = capmatch.group("capacity")
-                capacity = str(math.floor(float(capacity)))
-                unit = capmatch.group(2)
-                if unit == "GB":
-                    unit_string = " GB"
-                elif unit == "TB":
-                    unit_string = " TB"
+            ftp.close()
+        except Exception:
+            pass
+
+    def _check_open(self) -> None:
+        # A pool retired by a config reload must not log in with its old credentials
+        if self._closed:
+            raise ftplib.error_temp("421 FTP session pool was closed")
+
+    def _take_slot(self) -> None:
+        with self._slot_freed:
+            while self._in_use >= int(self.limit) and not self._closed:
+                self._slot_freed.wait()
+            self._check_open()
+            self._in_use += 1
+
+    def _free_slot(self) -> None:
+        with self._slot_freed:
+            self._in_use -= 1
+            self._slot_freed.notify()
+
+    def over_limit(self) -> bool:
+        return self._in_use > int(self.limit)
+
+    def observe(self, started: float, seconds: Optional[float]) -> None:
+        """
+        Feed one upload into the limit; call it while the upload's slot is
+        still held. seconds is None for an upload that failed; started
+        (time.monotonic()) tells whether it was already under way when the
+        limit last came down.
+        """
+        with self._lock:
+            overloaded = seconds is None
+            if not overloaded:
+                # The best time seen, drifting up slowly so a lasting change is learned
+                if self._baseline is None or seconds < self._baseline:
+                    self._baseline = seconds
                 else:
-                    unit_string = ""  # Default if neither "GB" nor "TB" is captured
-
-                ET.SubElement(storage, 'Size').text = capacity + unit_string
-            else:
-                ET.SubElement(storage, 'Size').text = ""
-        except Exception as e:
-            ET.SubElement(storage, 'Size').text = ""
-            print("DRIVE CAPACITY ERROR")
-            ERRORS += "DRIVE CAPACITY ERROR\n"
-
-        # Input Erasure Date
-        ERASUREDATE = datetime.datetime.now().strftime('%m/%d/%Y')
-        ET.SubElement(storage, 'ErasureDate').text = ERASUREDATE
-    # /// Storage
-
-    xml_string = ET.tostring(sysinfo, encoding='utf-8').decode('utf-8')
-    xml_dom = minidom.parseString(xml_string)
-    xml_pretty_string = xml_dom.toprettyxml(indent="\t")
-
-    return xml_pretty_string
-
-def save_to_output_xml(xml_string, output_file):
-    with open(output_file, 'w', encoding='utf-8') as file:
-        file.write(xml_string)
-
-def log_errors(raw_path):
-    global ERRORS
-    if ERRORS == "":
-        return True
-    uid = os.path.basename(raw_path)[:-4]
-    errors_path = os.path.join(MOUNT_BASE,APPLE_BASE,"Errors",uid)
-    os.makedirs(errors_path, exist_ok=True)
-    error_file = os.path.join(errors_path,
-                              uid+".log"
-                              )
-    if os.path.isfile(error_file):
-        os.remove(error_file)
-    f = open(error_file, "a")
-    f.write(ERRORS)
-    f.close()
-    shutil.copy(raw_path, errors_path)
-    return False
-
-def ftp_upload(file_path):
-    global ERRORS
-    # return true if successful
+                    self._baseline += (seconds - self._baseline) * 0.01
+                overloaded = seconds > self.latency_tolerance * self._baseline
+            if not self.adaptive:
+                return
+            previous = int(self.limit)
+            # Only a full window shows the limit is what holds uploads back;
+            # the caller still holds its slot, so it counts in _in_use
+            if not overloaded:
+                if self._in_use >= previous:
+                    self.limit = min(float(self.size), self.limit + 1 / self.limit)
+            elif started >= self._backed_off:
+                self.limit = max(1.0, self.limit / 2)
+                self._backed_off = time.monotonic()
+            current = int(self.limit)
+            if current > previous:
+                self._slot_freed.notify_all()
+        if current != previous:
+            METRICS.set_gauge("ftp_upload_limit", current)
+            print(f"FTP upload concurrency {previous} -> {current}"
+                  + (" (failed or slow upload)" if overloaded else ""))
+
+    def acquire(self) -> ftplib.FTP:
+        self._take_slot()
+        try:
+            while True:
+                with self._lock:
+                    self._check_open()
+                    if not self._idle:
+                        break
+                    ftp, last_used = self._idle.pop()
+                if time.monotonic() - last_used < self.idle_check:
+                    return ftp
+                try:
+                    ftp.voidcmd("NOOP")
+                    return ftp
+                except ftplib.all_errors:
+                    self._discard(ftp)
+            return self._connect()
+        except BaseException:
+            self._free_slot()
+            raise
+
+    def release(self, ftp: ftplib.FTP, broken: bool = False) -> None:
+        with self._lock:
+            # A session out while the pool was closed is not kept either
+            keep = not broken and not self._closed
+            if keep:
+                self._idle.append((ftp, time.monotonic()))
+        if not keep:
+            self._discard(ftp)
+        self._free_slot()
+
+    def upload(self, file_paths: List[str], retries: int = 1) -> Dict[str, str]:
+        """
+        Upload several files over a single pooled session.
+
+        A session that fails mid-batch is dropped and replaced, and the file
+        that was in flight is retried up to `retries` times. The session is
+        handed back between files while the pool is over its limit.
+
+        Returns:
+            Mapping of file path to error text for every file that failed
+        """
+        failures: Dict[str, str] = {}
+        ftp = None
+        try:
+            for file_path in file_paths:
+                # A local file that cannot be read says nothing about the server
+                try:
+                    file = open(file_path, 'rb')
+                except OSError as e:
+                    failures[file_path] = repr(e)
+                    continue
+                with file:
+                    for attempt in range(retries + 1):
+                        attempted = time.monotonic()
+                        try:
+                            if ftp is None:
+                                ftp = self.acquire()
+                            file.seek(0)
+                            started = time.monotonic()
+                            ftp.storbinary(f"STOR {os.path.basename(file_path)}", file)
+                            seconds = time.monotonic() - started
+                            METRICS.observe("upload", seconds)
+                            self.observe(started, seconds)
+                            failures.pop(file_path, None)
+                            break
+                        except ftplib.error_perm as e:
+                            # The server refused this file; the session itself is fine
+                            failures[file_path] = repr(e)
+                            break
+                        except ftplib.all_errors as e:
+                            failures[file_path] = repr(e)
+                            self.observe(attempted, None)
+                            if ftp is not None:
+                                self.release(ftp, broken=True)
+                                ftp = None
+                if ftp is not None and self.over_limit():
+                    self.release(ftp)
+                    ftp = None
+        finally:
+            if ftp is not None:
+                self.release(ftp)
+        return failures
+
+    def upload_all(self, file_paths: List[str], retries: int = 1) -> Dict[str, str]:
+        """
+        upload() spread over up to `size` sessions. Sessions past the current
+        limit wait in acquire() and join in as the limit grows.
+        """
+        workers = min(self.size, len(file_paths))
+        if workers <= 1:
+            return self.upload(file_paths, retries)
+        pending = collections.deque(file_paths)
+
+        def take():
+            while pending:
+                try:
+                    yield pending.popleft()
+                except IndexError:
+                    return
+
+        failures: Dict[str, str] = {}
+        with ThreadPoolExecutor(workers, thread_name_prefix="ftp-upload") as threads:
+            for worker_failures in threads.map(lambda _: self.upload(take(), retries), range(workers)):
+                failures.update(worker_failures)
+        return failures
+
+    def close(self) -> None:
+        with self._lock:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            # Uploads waiting for a slot fail now instead of connecting
+            self._slot_freed.notify_all()
+        for ftp, _ in idle:
+            try:
+                ftp.quit()
+            except ftplib.all_errors:
+                self._discard(ftp)
+
+FTP_POOL: Optional[FTPSessionPool] = None
+
+# Changing any of these on a config reload replaces the pool
+FTP_POOL_KEYS = ("FTP_HOST", "FTP_PORT", "FTP_USER", "FTP_PASS", "FTP_POOL_SIZE", "FTP_TLS", "FTP_TIMEOUT",
+                 "FTP_CONCURRENCY", "FTP_LATENCY_TOLERANCE")
+
+def get_ftp_pool() -> FTPSessionPool:
+    global FTP_POOL
+    if FTP_POOL is None:
+        FTP_POOL = FTPSessionPool(
+            CONFIG["FTP_HOST"],
+            int(CONFIG["FTP_PORT"]),
+            CONFIG["FTP_USER"],
+            CONFIG["FTP_PASS"],
+            size=int(CONFIG.get("FTP_POOL_SIZE", 4)),
+            tls=CONFIG.get("FTP_TLS", "auto"),
+            timeout=float(CONFIG.get("FTP_TIMEOUT", 30)),
+            adaptive=CONFIG.get("FTP_CONCURRENCY", "adaptive") == "adaptive",
+            latency_tolerance=float(CONFIG.get("FTP_LATENCY_TOLERANCE", 2))
+        )
+    return FTP_POOL
+
+def lftp_upload(file_path):
+    # return None if successful, otherwise the failed process
     file_put_segment = "'set ssl:verify-certificate no; put {0}; exit;'".format(file_path)
     auth = f'{CONFIG["FTP_USER"]},{CONFIG["FTP_PASS"]}'
     
@@ -764,56 +1674,1816 @@ def ftp_upload(file_path):
         executable='/bin/bash' #Bash is needed for the <<< redirect
     )
     if process.returncode == 0:
-        return True
+        return None
+    return process
+
+def ftp_upload_batch(file_paths):
+    # returns {file_path: error text} for every file that failed to upload
+    if not file_paths:
+        return {}
+    if CONFIG.get("FTP_BACKEND", "pool") == "lftp":
+        failures = {}
+        for file_path in file_paths:
+            with METRICS.timed("upload"):
+                process = lftp_upload(file_path)
+            if process is not None:
+                failures[file_path] = str(process)
     else:
-        ERRORS += "FTP UPLOAD FAILED\n\n"
-        ERRORS += str(process)
-        ERRORS += "\n"
+        try:
+            failures = get_ftp_pool().upload_all(file_paths)
+        except Exception as e:
+            failures = {file_path: repr(e) for file_path in file_paths}
+
+    for file_path, error in failures.items():
         print(f"failed to upload {file_path}")
-        print(process)
+        print(error)
+        failures[file_path] = "FTP UPLOAD FAILED\n\n" + error + "\n"
+    return failures
+
+def ftp_upload(file_path, errors):
+    # return true if successful
+    failures = ftp_upload_batch([file_path])
+    if file_path in failures:
+        errors.append(failures[file_path])
         return False
+    return True
 
 
-def process_RAW_LOGS():
-    global ERRORS
-    for raw_log_path in RAW_LOGS:
-        ERRORS = ""
-        print(f"Processing {raw_log_path}")
-        basename = os.path.basename(raw_log_path)
-        log_xml_name = basename.replace(".txt",".xml")
-        
-        xml_log_path = clear_collision(log_xml_name)
+# Dedup cache
 
-        with open(raw_log_path, 'r', encoding='utf-8') as file:
-            input_text = file.read()
+class DedupCache:
+    """
+    Persistent record of raw logs that were already converted and uploaded,
+    keyed by a hash of the log text and CONVERTER_VERSION, so a re-dropped
+    log is recognised without parsing or uploading it again.
 
-        input_data = parse_input_txt(input_text)
-        total_cores = extract_total_cores(input_text)
-        xml_string = create_xml(input_data, total_cores, input_text)
-        if log_errors(raw_log_path):
-            save_to_output_xml(xml_string, xml_log_path)
-            if not ftp_upload(xml_log_path):
-                log_errors(raw_log_path)
-                os.remove(xml_log_path)
+    Entries not seen for max_age_days are evicted, and beyond max_entries
+    the least recently seen go first.
+    """
+
+    def __init__(self, path: str, max_entries: int = 50000, max_age_days: float = 30):
+        self.max_entries = max_entries
+        self.max_age = max_age_days * 86400
+        self._adds = 0
+        self._lock = threading.RLock()
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        # Shared with the pipeline's I/O threads, serialised by _lock
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS converted (
+                digest TEXT PRIMARY KEY,
+                xml_name TEXT NOT NULL,
+                last_seen REAL NOT NULL
+            )""")
+        self._db.execute("CREATE INDEX IF NOT EXISTS converted_last_seen ON converted (last_seen)")
+        self._db.commit()
+        self.evict()
+
+    @staticmethod
+    def digest(input_text: str) -> str:
+        return hashlib.sha256((CONVERTER_VERSION + "\0" + input_text).encode('utf-8')).hexdigest()
+
+    def seen(self, digest: str) -> Optional[str]:
+        """
+        Returns:
+            Name of the XML the log was uploaded as, or None if it is new
+        """
+        with self._lock:
+            row = self._db.execute("SELECT xml_name FROM converted WHERE digest = ?", (digest,)).fetchone()
+            if row is None:
+                return None
+            self._db.execute("UPDATE converted SET last_seen = ? WHERE digest = ?", (time.time(), digest))
+            self._db.commit()
+            return row[0]
+
+    def add(self, digest: str, xml_name: str) -> None:
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO converted VALUES (?, ?, ?)",
+                             (digest, xml_name, time.time()))
+            self._db.commit()
+            self._adds += 1
+            if self._adds % 100 == 0:
+                self.evict()
+
+    def evict(self) -> None:
+        with self._lock:
+            self._db.execute("DELETE FROM converted WHERE last_seen < ?", (time.time() - self.max_age,))
+            self._db.execute("""
+                DELETE FROM converted WHERE digest IN (
+                    SELECT digest FROM converted ORDER BY last_seen DESC LIMIT -1 OFFSET ?
+                )""", (self.max_entries,))
+            self._db.commit()
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+DEDUP_CACHE: Optional[DedupCache] = None
+
+def get_dedup_cache() -> Optional[DedupCache]:
+    global DEDUP_CACHE
+    if DEDUP_CACHE is None and CONFIG.get("DEDUP_CACHE", "on") != "off":
+        DEDUP_CACHE = DedupCache(
+            os.path.join(CONFIG.get("STATE_DIR", "state"), "dedup.sqlite3"),
+            max_entries=int(CONFIG.get("DEDUP_MAX_ENTRIES", 50000)),
+            max_age_days=float(CONFIG.get("DEDUP_MAX_AGE_DAYS", 30))
+        )
+    return DEDUP_CACHE
+
+
+def build_log(input_text, formats):
+    # Runs in a pool worker, so everything it needs comes in as arguments and
+    # everything it finds, errors and stage timings included, goes back in
+    # the return value. Every format is encoded from the same single parse.
+    errors = []
+    started = time.perf_counter()
+    input_data, total_cores, report = scan_report(input_text)
+    parsed = time.perf_counter()
+    record = build_record(input_data, total_cores, input_text, errors, report)
+    encoded = {name: ENCODERS[name](record) for name in formats}
+    timings = {"parse": parsed - started, "build_xml": time.perf_counter() - parsed}
+    return record, encoded, errors, timings
+
+def encode_log(input_text, formats):
+    _, encoded, errors, timings = build_log(input_text, formats)
+    return encoded, errors, timings
+
+def convert_log(input_text):
+    # The record comes back with the XML so the manifest never has to read
+    # the XML back from the share and parse it again
+    record, encoded, errors, timings = build_log(input_text, ("xml",))
+    return (encoded["xml"], record), errors, timings
+
+def run_inline(fn, *args):
+    # Same interface as executor.submit for the single-process path
+    future = Future()
+    try:
+        future.set_result(fn(*args))
+    except Exception as e:
+        future.set_exception(e)
+    return future
+
+def submission_window(jobs, jobs_ahead):
+    # Yields the (..., job) items of a lazy iterable in order, pulling at
+    # most jobs_ahead past the one being finished, so a large batch is
+    # never read and submitted all at once
+    window = collections.deque()
+    for item in jobs:
+        window.append(item)
+        if len(window) >= jobs_ahead:
+            yield window.popleft()
+    yield from window
+
+def window_size(jobs):
+    return 4 * max(jobs, 1)
+
+def lookup_tables():
+    return {name: globals()[name] for name in LOOKUP_TABLES}
+
+def install_lookup_tables(tables):
+    # Pool initializer; a worker starts from a fresh import of this module
+    globals().update(tables)
+
+def create_executor(jobs):
+    if jobs <= 1:
+        return None
+    # Workers come from a forkserver rather than a fork of this process: the
+    # daemon is running threads by now, and a forked worker could inherit a
+    # lock one of them holds (stdout's included) and hang on it. Conversion
+    # needs no CONFIG, only the lookup tables in use.
+    return ProcessPoolExecutor(max_workers=jobs,
+                               mp_context=multiprocessing.get_context("forkserver"),
+                               initializer=install_lookup_tables,
+                               initargs=(lookup_tables(),))
+
+# Local staging spool
+
+class StagingSpool:
+    """
+    Local-disk mirror of the share's Temp/Processed/Errors layout.
+
+    A raw log is claimed out of the share's Temp with a single move, and
+    all conversion, XML writes and error logs then happen on local disk.
+    A background thread writes the results back to Processed and Errors on
+    the share in batches every flush_interval seconds. Anything still in
+    the spool after a restart is picked up again: claimed logs by
+    recover(), pending results by the next flush.
+    """
+
+    def __init__(self, root: str, flush_interval: float = 5.0):
+        self.root = os.path.abspath(root)
+        self.flush_interval = flush_interval
+        for sub in ("Temp", "Processed", "Errors"):
+            os.makedirs(os.path.join(self.root, sub), exist_ok=True)
+        self._stop = threading.Event()
+        self._flush_lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._held_lock = threading.Lock()
+        self._held: Set[str] = set()
+        # Errors/<uid> directories being written, and the one being flushed
+        self._dir_free = threading.Condition(self._held_lock)
+        self._writing: Dict[str, int] = collections.Counter()
+        self._flushing: Optional[str] = None
+
+    def path(self, *parts: str) -> str:
+        return os.path.join(self.root, *parts)
+
+    def owns(self, path: str) -> bool:
+        return os.path.abspath(path).startswith(self.root + os.sep)
+
+    def claim(self, raw_log_path: str) -> Optional[str]:
+        """
+        Returns:
+            Local path of the claimed log, or None if it vanished from the share
+        """
+        local_path = self.path("Temp", os.path.basename(raw_log_path))
+        try:
+            shutil.move(raw_log_path, local_path)
+        except FileNotFoundError:
+            return None
+        return local_path
+
+    def hold(self, path: str) -> None:
+        # Keep a staged XML out of flushes until its upload has finished
+        with self._held_lock:
+            self._held.add(path)
+
+    def release(self, path: str) -> None:
+        with self._held_lock:
+            self._held.discard(path)
+
+    @contextlib.contextmanager
+    def holding(self, directory: str):
+        # Keep an Errors directory out of flushes while it is written; the
+        # flusher would otherwise copy it half done and rmdir it underneath
+        with self._dir_free:
+            self._dir_free.wait_for(lambda: self._flushing != directory)
+            self._writing[directory] += 1
+        try:
+            yield
+        finally:
+            with self._dir_free:
+                self._writing[directory] -= 1
+                if not self._writing[directory]:
+                    del self._writing[directory]
+
+    def abandon(self) -> None:
+        # A batch failed part way: drop the XMLs it staged, as its logs are converted again
+        with self._held_lock:
+            for path in self._held:
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(path)
+            self._held.clear()
+
+    def recover(self) -> List[str]:
+        # Logs a previous run claimed but never finished
+        return sorted(entry.path for entry in os.scandir(self.path("Temp"))
+                      if entry.name.endswith(".txt"))
+
+    def flush(self) -> None:
+        with self._flush_lock:
+            processed = self.path("Processed")
+            for entry in list(os.scandir(processed)):
+                with self._held_lock:
+                    if entry.path in self._held:
+                        continue
+                target = clear_collision(entry.name, apple_path("Processed"))
+                try:
+                    shutil.copyfile(entry.path, target)
+                except FileNotFoundError:
+                    if os.path.exists(entry.path):
+                        raise
+                    continue   # abandoned while we were looking
+                processed_added(target)
+                os.remove(entry.path)
+
+            errors = self.path("Errors")
+            for entry in list(os.scandir(errors)):
+                with self._dir_free:
+                    if entry.path in self._writing:
+                        continue
+                    self._flushing = entry.path
+                try:
+                    target_dir = apple_path("Errors", entry.name)
+                    ensure_dir(target_dir)
+                    for item in list(os.scandir(entry.path)):
+                        shutil.copyfile(item.path, os.path.join(target_dir, item.name))
+                        os.remove(item.path)
+                    os.rmdir(entry.path)
+                finally:
+                    with self._dir_free:
+                        self._flushing = None
+                        self._dir_free.notify_all()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.flush_interval):
+            if not share_available():
+                continue
+            try:
+                self.flush()
+            except OSError as e:
+                # Share trouble; everything stays spooled for the next flush
+                print(f"Spool flush failed: {e}")
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._run, name="spool-flush", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.flush()
+
+SPOOL: Optional[StagingSpool] = None
+
+@contextlib.contextmanager
+def errors_dir(*parts):
+    # work_path("Errors", ...), created and kept out of spool flushes while it is written
+    path = work_path("Errors", *parts)
+    with SPOOL.holding(path) if SPOOL is not None else contextlib.nullcontext():
+        ensure_dir(path)
+        yield path
+
+def apple_path(*parts):
+    # Location on the share
+    return os.path.join(MOUNT_BASE,APPLE_BASE,*parts)
+
+def work_path(*parts):
+    # Where logs are worked on: the local spool when staging, otherwise the share
+    if SPOOL is not None:
+        return SPOOL.path(*parts)
+    return apple_path(*parts)
+
+def share_available():
+    # Background writers hold off while the supervisor has the share down
+    return SUPERVISOR is None or SUPERVISOR.healthy
+
+def ensure_dir(path):
+    # os.makedirs, but never the share's base itself: with the share
+    # unmounted that would build the tree on the bare mount point, and
+    # whatever is written there disappears under the share once it is back
+    base = os.path.abspath(apple_path())
+    if os.path.abspath(path).startswith(base + os.sep) and not os.path.isdir(base):
+        raise OSError(errno.ENOTCONN, "share is not mounted", base)
+    os.makedirs(path, exist_ok=True)
+
+
+# Work claiming between replicas
+
+class WorkClaims:
+    """
+    Lets several converter replicas share one Temp without converting a
+    log twice.
+
+    A replica claims a log by renaming it from Temp into its own
+    Claims/<node_id> directory on the share. The rename is atomic on the
+    server, so exactly one replica wins and the others see the file gone.
+    Each replica rewrites a heartbeat counter into a .lease file in its
+    claim directory. The others note when they last saw each lease change
+    on their own monotonic clock, and once one hasn't changed for
+    lease_timeout they move that replica's unfinished logs back into Temp
+    for whoever picks them up next. No host's clock is compared with
+    another's, so skew between them doesn't matter.
+    """
+
+    def __init__(self, root: str, node_id: str, lease_timeout: float = 120.0):
+        self.root = os.path.abspath(root)
+        self.node_id = node_id
+        self.lease_timeout = lease_timeout
+        self.path = os.path.join(self.root, node_id)
+        self.lease = os.path.join(self.path, ".lease")
+        ensure_dir(self.path)
+        self._beat = 0
+        # node -> (lease as last read, time.monotonic() it last changed)
+        self._peers: Dict[str, Tuple[Optional[str], float]] = {}
+        self._reaped = -math.inf
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def owns(self, path: str) -> bool:
+        return os.path.dirname(os.path.abspath(path)) == self.path
+
+    def claim(self, raw_log_path: str) -> Optional[str]:
+        """
+        Returns:
+            Path of the claimed log, or None if another replica got it first
+        """
+        claimed_path = os.path.join(self.path, os.path.basename(raw_log_path))
+        try:
+            os.rename(raw_log_path, claimed_path)
+        except FileNotFoundError:
+            return None
+        return claimed_path
+
+    def recover(self) -> List[str]:
+        # Logs this replica claimed before a restart
+        return sorted(entry.path for entry in os.scandir(self.path) if entry.name.endswith(".txt"))
+
+    def renew(self) -> None:
+        # The pid tells a restarted replica's count from the one before it
+        self._beat += 1
+        with open(self.lease, "w") as f:
+            f.write(f"{os.getpid()} {self._beat}\n")
+
+    def reap(self, intake_dir: str) -> int:
+        """
+        Hand the logs of replicas with an expired lease back to intake.
+
+        Returns:
+            Number of logs moved back into intake_dir
+        """
+        now = time.monotonic()
+        if now - self._reaped > self.lease_timeout / 2:
+            # This replica wasn't looking (share down, or it stalled), so
+            # nobody's silence over that gap counts against them
+            self._peers.clear()
+        self._reaped = now
+        moved = 0
+        peers = {}
+        for node in os.scandir(self.root):
+            if not node.is_dir() or node.name == self.node_id:
+                continue
+            try:
+                with open(os.path.join(node.path, ".lease")) as f:
+                    lease = f.read()
+            except FileNotFoundError:
+                lease = None   # never started, or lost; the clock runs all the same
+            seen = self._peers.get(node.name)
+            if seen is None or seen[0] != lease:
+                seen = (lease, now)
+            peers[node.name] = seen
+            lease_age = now - seen[1]
+            if lease_age <= self.lease_timeout:
+                continue
+            for entry in os.scandir(node.path):
+                if not entry.name.endswith(".txt"):
+                    continue
+                try:
+                    os.rename(entry.path, os.path.join(intake_dir, entry.name))
+                except FileNotFoundError:
+                    continue   # another replica reaped it first
+                print(f"Reclaimed {entry.name} from {node.name}, lease unchanged for {lease_age:.0f}s")
+                moved += 1
+        self._peers = peers
+        return moved
+
+    def _run(self, intake_dir: str) -> None:
+        while not self._stop.wait(self.lease_timeout / 4):
+            if not share_available():
+                continue
+            try:
+                self.renew()
+                self.reap(intake_dir)
+            except OSError as e:
+                # Share trouble; the lease has a few more renewals' worth of slack
+                print(f"Lease renewal failed: {e}")
+
+    def start(self, intake_dir: str) -> None:
+        self.renew()
+        self._thread = threading.Thread(target=self._run, args=(intake_dir,), name="claim-lease", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        # Unfinished claims stay put; this replica recovers them on restart
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+CLAIMS: Optional[WorkClaims] = None
+
+
+# State journal
+
+class LogJournal:
+    """
+    Durable record of how far each raw log got: discovered, converted (XML
+    written), uploaded, then archived (raw removed), which drops its row.
+    Logs that end up in Errors are dropped too.
+
+    SQLite in WAL mode, so each transition is one small append. After a
+    restart, resume_journal() picks every unfinished log up from its last
+    committed step instead of converting and uploading it again.
+    """
+
+    def __init__(self, path: str):
+        self._lock = threading.RLock()
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS logs (
+                raw_path TEXT PRIMARY KEY,
+                state TEXT NOT NULL,
+                xml_path TEXT,
+                digest TEXT,
+                updated_at REAL NOT NULL
+            )""")
+        self._db.commit()
+
+    def record(self, raw_path: str, state: str, xml_path: Optional[str] = None,
+               digest: Optional[str] = None) -> None:
+        with self._lock:
+            self._db.execute("""
+                INSERT INTO logs VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (raw_path) DO UPDATE SET
+                    state = excluded.state,
+                    xml_path = COALESCE(excluded.xml_path, xml_path),
+                    digest = COALESCE(excluded.digest, digest),
+                    updated_at = excluded.updated_at
+                """, (raw_path, state, xml_path, digest, time.time()))
+            self._db.commit()
+
+    def forget(self, raw_path: str) -> None:
+        with self._lock:
+            self._db.execute("DELETE FROM logs WHERE raw_path = ?", (raw_path,))
+            self._db.commit()
+
+    def unfinished(self) -> List[Tuple[str, str, Optional[str], Optional[str]]]:
+        with self._lock:
+            return self._db.execute(
+                "SELECT raw_path, state, xml_path, digest FROM logs ORDER BY updated_at").fetchall()
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+JOURNAL: Optional[LogJournal] = None
+
+def get_journal() -> Optional[LogJournal]:
+    global JOURNAL
+    if JOURNAL is None and CONFIG.get("JOURNAL", "on") != "off":
+        JOURNAL = LogJournal(os.path.join(CONFIG.get("STATE_DIR", "state"), "journal.sqlite3"))
+    return JOURNAL
+
+def journal_record(raw_path, state, xml_path=None, digest=None):
+    journal = get_journal()
+    if journal is not None:
+        journal.record(raw_path, state, xml_path, digest)
+
+def journal_forget(raw_path):
+    journal = get_journal()
+    if journal is not None:
+        journal.forget(raw_path)
+
+def resume_journal():
+    """
+    Finish what a previous run left half done, before intake starts.
+
+    Converted logs whose XML is still there are uploaded now; uploaded logs
+    just get their raw file archived. Logs that were only discovered are
+    dropped from the journal, since the watcher (or the staging spool) hands
+    them over again anyway.
+    """
+    journal = get_journal()
+    if journal is None:
+        return
+    dedup = get_dedup_cache()
+    pending_upload = []
+    for raw_path, state, xml_path, digest in journal.unfinished():
+        if not os.path.isfile(raw_path):
+            journal.forget(raw_path)
+        elif state == "uploaded":
+            print(f"Resuming {raw_path}: already uploaded, archiving")
+            finish_log(raw_path, digest, xml_path, None, dedup)
+        elif state == "converted" and xml_path and os.path.isfile(xml_path):
+            print(f"Resuming {raw_path}: converted, uploading {xml_path}")
+            pending_upload.append((raw_path, digest, xml_path))
+        else:
+            journal.forget(raw_path)
+
+    failures = ftp_upload_batch([xml_path for _, _, xml_path in pending_upload])
+    for raw_path, digest, xml_path in pending_upload:
+        finish_log(raw_path, digest, xml_path, failures.get(xml_path), dedup)
+    flush_manifest()
+
+
+# Upload retries
+
+class UploadRetryQueue:
+    """
+    Failed uploads wait here instead of going straight to Errors.
+
+    The XML is moved into a local queue directory and retried from a
+    background thread with exponential backoff plus jitter, so a short FTP
+    outage no longer costs anyone a manual fix and new logs keep converting
+    meanwhile. After max_attempts uploads in total the log is dead-lettered
+    into the usual Errors layout. The raw log stays where it is until then;
+    the journal keeps the queued XML, so a restart uploads it again.
+    """
+
+    def __init__(self, directory: str, max_attempts: int = 5,
+                 base_delay: float = 30.0, max_delay: float = 1800.0):
+        self.directory = os.path.abspath(directory)
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        os.makedirs(self.directory, exist_ok=True)
+        self._heap: List[Tuple[float, int, str, Optional[str], str, int]] = []
+        self._held: Set[str] = set()
+        self._seq = 0
+        self._wake = threading.Condition()
+        self._stop = False
+        self._thread: Optional[threading.Thread] = None
+
+    def delay(self, attempts: int) -> float:
+        # Half the backoff is fixed, the other half random, so a burst of failures spreads out
+        backoff = min(self.max_delay, self.base_delay * 2 ** (attempts - 1))
+        return backoff / 2 + random.uniform(0, backoff / 2)
+
+    def holds(self, raw_log_path: str) -> bool:
+        with self._wake:
+            return raw_log_path in self._held
+
+    def schedule(self, raw_log_path: str, digest: Optional[str], xml_log_path: str,
+                 failure: str, attempts: int = 1) -> bool:
+        """
+        Queue a failed upload for another try.
+
+        Returns:
+            False once the log has used up its attempts and should be dead-lettered
+        """
+        if attempts >= self.max_attempts:
+            return False
+        if os.path.dirname(os.path.abspath(xml_log_path)) != self.directory:
+            queued_path = clear_collision(os.path.basename(xml_log_path), self.directory)
+            shutil.move(xml_log_path, queued_path)
+            processed_removed(xml_log_path)
+            release_xml(xml_log_path)
+            xml_log_path = queued_path
+        journal_record(raw_log_path, "converted", xml_log_path, digest)
+        due = time.monotonic() + self.delay(attempts)
+        print(f"Upload of {xml_log_path} failed (attempt {attempts}), retrying in {due - time.monotonic():.1f}s")
+        with self._wake:
+            self._seq += 1
+            heapq.heappush(self._heap, (due, self._seq, raw_log_path, digest, xml_log_path, attempts))
+            self._held.add(raw_log_path)
+            METRICS.set_gauge("upload_retry_pending", len(self._heap))
+            self._wake.notify()
+        return True
+
+    def _take_due(self) -> List[Tuple[float, int, str, Optional[str], str, int]]:
+        with self._wake:
+            while not self._stop:
+                now = time.monotonic()
+                if self._heap and self._heap[0][0] <= now:
+                    due = []
+                    while self._heap and self._heap[0][0] <= now:
+                        due.append(heapq.heappop(self._heap))
+                    return due
+                self._wake.wait(self._heap[0][0] - now if self._heap else None)
+            return []
+
+    def _run(self) -> None:
+        while due := self._take_due():
+            self.retry(due)
+
+    def retry(self, due) -> None:
+        dedup = get_dedup_cache()
+        failures = ftp_upload_batch([item[4] for item in due])
+        for item in due:
+            _, _, raw_log_path, digest, xml_log_path, attempts = item
+            failure = failures.get(xml_log_path)
+            if failure is not None and self.schedule(raw_log_path, digest, xml_log_path,
+                                                     failure, attempts + 1):
+                continue
+            if failure is None:
+                METRICS.count("upload_retries_total", "recovered")
             else:
+                METRICS.count("upload_retries_total", "dead_letter")
+                failure += f"\nGave up after {attempts + 1} upload attempts\n"
+            try:
+                if not share_available():
+                    raise OSError(errno.ENOTCONN, "share is not mounted")
+                archive_log(raw_log_path, digest, xml_log_path, failure, dedup)
+            except OSError as e:
+                # Share trouble; the upload itself is done, so only the bookkeeping waits
+                print(f"Could not finish {raw_log_path}: {e}")
+                with self._wake:
+                    heapq.heappush(self._heap, (time.monotonic() + self.base_delay,) + item[1:])
+                continue
+            with self._wake:
+                self._held.discard(raw_log_path)
+                METRICS.set_gauge("upload_retry_pending", len(self._heap))
+        flush_manifest()
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._run, name="upload-retry", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        # Whatever is still queued is in the journal and gets uploaded on the next start
+        with self._wake:
+            self._stop = True
+            self._wake.notify()
+        if self._thread is not None:
+            self._thread.join()
+
+RETRIES: Optional[UploadRetryQueue] = None
+
+def retry_dir():
+    return os.path.join(CONFIG.get("STATE_DIR", "state"), "upload-retry")
+
+
+# Device manifest
+
+class DeviceManifest:
+    """
+    Append-only record of every uploaded device: one JSONL file per day
+    and writer (YYYY-MM-DD.<writer>.jsonl) and index.<writer>.tsv, one
+    `serial, asset ID, file, offset` row per device. Inventory queries read
+    the indexes and seek straight to the line instead of walking Processed
+    and parsing every XML.
+
+    Replicas and sources share the directory, but each appends only to its
+    own files, so the offset it takes from tell() is the one the line lands
+    at; writer is the node ID, plus the source name in a multi-source daemon.
+
+    append() only queues a row in memory. flush(), once per batch, writes
+    every queued row with one open per file instead of two per device.
+    """
+
+    def __init__(self, directory: str, writer: str):
+        self.directory = directory
+        self.writer = writer
+        ensure_dir(directory)
+        self._lock = threading.Lock()
+        # (day file, line, index keys) not yet written, and index rows whose line was
+        self._rows: List[Tuple[str, bytes, List[str]]] = []
+        self._index: List[str] = []
+
+    def append(self, record: DeviceRecord, xml_name: str) -> None:
+        now = datetime.datetime.now()
+        row = {"uploaded_at": now.isoformat(timespec="seconds"), "xml": xml_name}
+        row.update(record.as_dict())
+        line = (json.dumps(row, ensure_ascii=False) + "\n").encode("utf-8")
+        keys = [(record.system_serial or "").replace("\t", " "),
+                (record.asset_id or "").replace("\t", " ")]
+        with self._lock:
+            self._rows.append((f"{now:%Y-%m-%d}.{self.writer}.jsonl", line, keys))
+
+    def pending(self) -> int:
+        with self._lock:
+            return len(self._rows) + len(self._index)
+
+    def flush(self) -> None:
+        """
+        Write the queued rows. On an OSError whatever was not written stays
+        queued for the next flush; a day file's rows go out in one write,
+        and are indexed only once that write has landed.
+        """
+        with self._lock:
+            while self._rows:
+                day_file = self._rows[0][0]
+                rows = [row for row in self._rows if row[0] == day_file]
+                with open(os.path.join(self.directory, day_file), "ab") as f:
+                    offset = f.tell()
+                    f.write(b"".join(line for _, line, _ in rows))
+                self._rows = [row for row in self._rows if row[0] != day_file]
+                for _, line, keys in rows:
+                    self._index.append("\t".join(keys + [day_file, str(offset)]) + "\n")
+                    offset += len(line)
+            if self._index:
+                with open(os.path.join(self.directory, f"index.{self.writer}.tsv"), "a", encoding="utf-8") as f:
+                    f.write("".join(self._index))
+                self._index = []
+
+    def lookup(self, serial: Optional[str] = None, asset_id: Optional[str] = None) -> List[Dict[str, Any]]:
+        """
+        Returns:
+            Manifest rows matching serial and/or asset ID from every
+            writer, oldest first
+        """
+        rows = []
+        for index_file in os.listdir(self.directory):
+            if not (index_file.startswith("index.") and index_file.endswith(".tsv")):
+                continue
+            with open(os.path.join(self.directory, index_file), encoding="utf-8") as index:
+                for entry in index:
+                    row_serial, row_asset_id, day_file, offset = entry.rstrip("\n").split("\t")
+                    if serial is not None and row_serial != serial:
+                        continue
+                    if asset_id is not None and row_asset_id != asset_id:
+                        continue
+                    with open(os.path.join(self.directory, day_file), "rb") as f:
+                        f.seek(int(offset))
+                        rows.append(json.loads(f.readline()))
+        rows.sort(key=lambda row: row["uploaded_at"])
+        return rows
+
+MANIFEST: Optional[DeviceManifest] = None
+
+# DeviceRecords back from conversion, by raw log path, until the upload lands
+MANIFEST_RECORDS: Dict[str, DeviceRecord] = {}
+
+def get_manifest() -> Optional[DeviceManifest]:
+    global MANIFEST
+    if MANIFEST is None and CONFIG.get("MANIFEST", "on") != "off":
+        writer = CONFIG.get("NODE_ID") or socket.gethostname()
+        if CURRENT_SOURCE is not None:
+            writer += "." + CURRENT_SOURCE
+        MANIFEST = DeviceManifest(CONFIG.get("MANIFEST_DIR") or apple_path("Manifest"), writer)
+    return MANIFEST
+
+def keep_for_manifest(raw_log_path, record):
+    if CONFIG.get("MANIFEST", "on") != "off":
+        MANIFEST_RECORDS[raw_log_path] = record
+
+def flush_manifest():
+    # Once per batch; rows that could not be written wait for the next one
+    if MANIFEST is None:
+        return
+    try:
+        with METRICS.timed("manifest"):
+            MANIFEST.flush()
+    except OSError as e:
+        print(f"Could not write {MANIFEST.pending()} manifest rows, keeping them for the next batch: {e}")
+
+def add_to_manifest(raw_log_path, xml_log_path):
+    record = MANIFEST_RECORDS.pop(raw_log_path, None)
+    try:
+        manifest = get_manifest()
+        if manifest is None:
+            return
+        with METRICS.timed("manifest"):
+            if record is None:
+                # Converted before a restart; only the XML is left to go on
+                record = decode_sysinfo(ET.parse(xml_log_path).getroot())
+            manifest.append(record, os.path.basename(xml_log_path))
+    except (OSError, ET.ParseError) as e:
+        # The device is uploaded either way; a gap here is what reconciliation is for
+        print(f"Could not add {xml_log_path} to the manifest: {e}")
+
+
+## per-log steps, shared by the sequential and pipelined loops
+
+def claim_raw_log(raw_log_path):
+    # returns the path to work on, or None if the log vanished or is waiting on
+    # an upload retry or an error report
+    if RETRIES is not None and RETRIES.holds(raw_log_path):
+        return None
+    if ERROR_REPORTER is not None and ERROR_REPORTER.holds(raw_log_path):
+        return None
+    if CLAIMS is not None and not CLAIMS.owns(raw_log_path) \
+            and not (SPOOL is not None and SPOOL.owns(raw_log_path)):
+        with METRICS.timed("claim"):
+            claimed_path = CLAIMS.claim(raw_log_path)
+        if claimed_path is None:
+            print(f"{raw_log_path} was claimed by another replica")
+            return None
+        raw_log_path = claimed_path
+    local_path = raw_log_path
+    if SPOOL is not None and not SPOOL.owns(raw_log_path):
+        with METRICS.timed("claim"):
+            local_path = SPOOL.claim(raw_log_path)
+        if local_path is None:
+            print(f"{raw_log_path} disappeared before it could be claimed")
+            return None
+    journal_record(local_path, "discovered")
+    return local_path
+
+def release_raw_log(raw_log_path):
+    # A failed log's copy is in Errors; a spooled or claimed original must not be retried forever
+    if ERROR_REPORTER is not None:
+        pass   # the reporter moves the raw log into Errors itself
+    elif SPOOL is not None and SPOOL.owns(raw_log_path):
+        os.remove(raw_log_path)
+    elif CLAIMS is not None and CLAIMS.owns(raw_log_path):
+        os.remove(raw_log_path)
+    journal_forget(raw_log_path)
+
+def read_raw_log(raw_log_path):
+    # returns None if the log vanished; undecodable logs raise UnicodeDecodeError
+    print(f"Processing {raw_log_path}")
+    try:
+        with METRICS.timed("read"):
+            with open(raw_log_path, 'r', encoding='utf-8') as file:
+                return read_report(file)
+    except FileNotFoundError:
+        print(f"{raw_log_path} disappeared before it could be read")
+        return None
+
+def check_duplicate(raw_log_path, input_text, dedup):
+    # returns (digest, duplicate); a duplicate has already been cleaned up
+    if dedup is None:
+        return None, False
+    digest = dedup.digest(input_text)
+    uploaded_as = dedup.seen(digest)
+    if uploaded_as is None:
+        return digest, False
+    print(f"{raw_log_path} was already uploaded as {uploaded_as}, skipping")
+    with METRICS.timed("cleanup"):
+        os.remove(raw_log_path)
+    journal_forget(raw_log_path)
+    METRICS.count("logs_total", "duplicate")
+    return digest, True
+
+def failed_job(error):
+    # A read failure surfaces as that log's conversion failure
+    job = Future()
+    job.set_exception(error)
+    return job
+
+def job_result(job):
+    # job is a finished concurrent or asyncio future of convert_log
+    try:
+        converted, errors, timings = job.result()
+    except BrokenProcessPool:
+        raise
+    except Exception as e:
+        converted, errors, timings = None, [f"CONVERSION FAILED\n\n{e!r}\n"], {}
+    for stage, seconds in timings.items():
+        METRICS.observe(stage, seconds)
+    return converted, errors
+
+def stage_xml(raw_log_path, digest, converted, errors):
+    # returns the XML path ready for upload, or None if the log went to Errors
+    basename = os.path.basename(raw_log_path)
+    log_xml_name = basename.replace(".txt",".xml")
+    
+    xml_log_path = clear_collision(log_xml_name)
+
+    if log_errors(raw_log_path, errors):
+        xml_string, record = converted
+        if SPOOL is not None:
+            SPOOL.hold(xml_log_path)
+        with METRICS.timed("write_xml"):
+            save_to_output_xml(xml_string, xml_log_path)
+        processed_added(xml_log_path)
+        keep_for_manifest(raw_log_path, record)
+        journal_record(raw_log_path, "converted", xml_log_path, digest)
+        return xml_log_path
+    release_raw_log(raw_log_path)
+    METRICS.count("logs_total", "error")
+    return None
+
+def finish_log(raw_log_path, digest, xml_log_path, failure, dedup):
+    if failure is not None and RETRIES is not None:
+        if RETRIES.schedule(raw_log_path, digest, xml_log_path, failure):
+            return
+    archive_log(raw_log_path, digest, xml_log_path, failure, dedup)
+
+def release_xml(xml_log_path):
+    if SPOOL is not None:
+        SPOOL.release(xml_log_path)
+
+def archive_log(raw_log_path, digest, xml_log_path, failure, dedup):
+    # Final step for a log: uploaded, or dead-lettered into Errors
+    if failure is not None:
+        log_errors(raw_log_path, [failure])
+        MANIFEST_RECORDS.pop(raw_log_path, None)
+        os.remove(xml_log_path)
+        processed_removed(xml_log_path)
+        release_raw_log(raw_log_path)
+        release_xml(xml_log_path)
+        METRICS.count("logs_total", "error")
+    else:
+        if os.path.dirname(os.path.abspath(xml_log_path)) == os.path.abspath(retry_dir()):
+            # Uploaded on a retry; file the XML with the rest
+            processed_path = clear_collision(os.path.basename(xml_log_path), work_path("Processed"))
+            shutil.move(xml_log_path, processed_path)
+            processed_added(processed_path)
+            xml_log_path = processed_path
+        journal_record(raw_log_path, "uploaded")
+        with METRICS.timed("cleanup"):
+            if os.path.isfile(raw_log_path):
                 os.remove(raw_log_path)
-            
+            if digest is not None and dedup is not None:
+                dedup.add(digest, os.path.basename(xml_log_path))
+        journal_forget(raw_log_path)
+        add_to_manifest(raw_log_path, xml_log_path)
+        release_xml(xml_log_path)
+        METRICS.count("logs_total", "uploaded")
+
+def process_RAW_LOGS(raw_logs, executor=None, jobs=1):
+    submit = executor.submit if executor is not None else run_inline
+    dedup = get_dedup_cache()
+
+    def submitted():
+        for raw_log_path in raw_logs:
+            raw_log_path = claim_raw_log(raw_log_path)
+            if raw_log_path is None:
+                continue
+            try:
+                input_text = read_raw_log(raw_log_path)
+            except UnicodeDecodeError as e:
+                yield raw_log_path, None, failed_job(e)
+                continue
+            if input_text is None:
+                continue
+
+            digest, duplicate = check_duplicate(raw_log_path, input_text, dedup)
+            if not duplicate:
+                yield raw_log_path, digest, submit(convert_log, input_text)
+
+    converted = []
+    for raw_log_path, digest, job in submission_window(submitted(), window_size(jobs)):
+        xml_log_path = stage_xml(raw_log_path, digest, *job_result(job))
+        if xml_log_path is not None:
+            converted.append((raw_log_path, digest, xml_log_path))
+
+    # The whole cycle's uploads go out together over the pool's sessions
+    failures = ftp_upload_batch([xml_log_path for _, _, xml_log_path in converted])
+    for raw_log_path, digest, xml_log_path in converted:
+        finish_log(raw_log_path, digest, xml_log_path, failures.get(xml_log_path), dedup)
+    flush_manifest()
+
+async def process_RAW_LOGS_async(raw_logs, executor=None, queue_size=8):
+    """
+    Pipelined process_RAW_LOGS. Reading from the share, conversion (in the
+    executor, or a thread when there is none), writing the XML back and FTP
+    uploads run as concurrent stages joined by bounded queues, so a slow
+    stage applies backpressure instead of letting logs pile up in memory.
+    A single upload stage sends whatever is already waiting as one batch,
+    which upload_all spreads over the pool's sessions, so there are never
+    more upload threads than FTP_POOL_SIZE.
+    """
+    loop = asyncio.get_running_loop()
+    dedup = get_dedup_cache()
+    converting = asyncio.Queue(queue_size)
+    uploading = asyncio.Queue(queue_size)
+
+    async def read_stage():
+        for raw_log_path in raw_logs:
+            raw_log_path = await asyncio.to_thread(claim_raw_log, raw_log_path)
+            if raw_log_path is None:
+                continue
+            try:
+                input_text = await asyncio.to_thread(read_raw_log, raw_log_path)
+            except UnicodeDecodeError as e:
+                await converting.put((raw_log_path, None, failed_job(e)))
+                continue
+            if input_text is None:
+                continue
+            digest, duplicate = await asyncio.to_thread(check_duplicate, raw_log_path, input_text, dedup)
+            if not duplicate:
+                job = loop.run_in_executor(executor, convert_log, input_text)
+                await converting.put((raw_log_path, digest, job))
+        await converting.put(None)
+
+    async def write_stage():
+        while (item := await converting.get()) is not None:
+            raw_log_path, digest, job = item
+            if not job.done():
+                await asyncio.wait([job])
+            xml_log_path = await asyncio.to_thread(stage_xml, raw_log_path, digest, *job_result(job))
+            if xml_log_path is not None:
+                await uploading.put((raw_log_path, digest, xml_log_path))
+        await uploading.put(None)
+
+    async def upload_stage():
+        finished = False
+        while not finished:
+            item = await uploading.get()
+            if item is None:
+                break
+            batch = [item]
+            while not uploading.empty():
+                item = uploading.get_nowait()
+                if item is None:
+                    finished = True
+                    break
+                batch.append(item)
+            failures = await asyncio.to_thread(ftp_upload_batch, [xml_log_path for _, _, xml_log_path in batch])
+            for raw_log_path, digest, xml_log_path in batch:
+                await asyncio.to_thread(finish_log, raw_log_path, digest, xml_log_path,
+                                        failures.get(xml_log_path), dedup)
+
+    try:
+        async with asyncio.TaskGroup() as tasks:
+            tasks.create_task(read_stage())
+            tasks.create_task(write_stage())
+            tasks.create_task(upload_stage())
+    except ExceptionGroup as group:
+        raise group.exceptions[0]
+    finally:
+        await asyncio.to_thread(flush_manifest)
+
+
+# Intake watching
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+INOTIFY_EVENT = struct.Struct("iIII")
+
+# inotify only sees local writes, so changes made by other SMB/NFS clients never show up
+NETWORK_FILESYSTEMS = {"cifs", "smb3", "smbfs", "nfs", "nfs4", "fuse.sshfs"}
+
+def get_mount_fstype(path: str) -> Optional[str]:
+    """
+    Find the filesystem type backing a path from /proc/mounts.
+
+    Returns:
+        The fstype of the longest matching mount point, or None if unknown
+    """
+    path = os.path.realpath(path)
+    best_point, best_type = "", None
+    try:
+        with open('/proc/mounts', 'r') as f:
+            for line in f:
+                fields = line.split()
+                if len(fields) < 3:
+                    continue
+                point = fields[1]
+                inside = path == point or path.startswith(point.rstrip("/") + "/")
+                if inside and len(point) > len(best_point):
+                    best_point, best_type = point, fields[2]
+    except OSError:
+        return None
+    return best_type
+
+class IntakeWatcher:
+    """
+    Hands new .txt logs in a directory to the pipeline once they are
+    completely written.
+
+    On local filesystems this blocks on inotify IN_CLOSE_WRITE/IN_MOVED_TO
+    events. On network mounts, or when inotify is unavailable, it polls
+    with os.scandir and only hands over a file once its size and mtime have
+    not changed for stable_window seconds, so a log still being copied in
+    is never converted half-written. Files already handed over are skipped
+    until they change. The poll interval starts at min_interval and doubles
+    up to max_interval while the directory stays idle.
+
+    inotify can lose events (a queue overflow, the watch going away), so
+    the directory is also rescanned then and every rescan_interval seconds.
+
+    Args:
+        directory: Directory to watch
+        min_interval: Shortest poll interval in seconds
+        max_interval: Longest poll interval in seconds
+        use_inotify: Force inotify on/off, None picks based on the mount type
+        stable_window: Seconds a polled file must stay unchanged
+        rescan_interval: Seconds between safety rescans in inotify mode
+        pause: Called before every scan; blocks while the directory can't be read
+    """
+
+    def __init__(self, directory: str, min_interval: float = 0.5,
+                 max_interval: float = 10.0, use_inotify: Optional[bool] = None,
+                 stable_window: float = 2.0, rescan_interval: float = 60.0,
+                 pause: Optional[Callable[[], None]] = None):
+        self.directory = directory
+        self.pause = pause
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.stable_window = stable_window
+        self.interval = min_interval
+        self.rescan_interval = rescan_interval
+        self._next_rescan = time.monotonic() + rescan_interval
+        self._inotify_fd: Optional[int] = None
+        self._pending: Set[str] = set()
+        # path -> (signature, when that signature was first seen)
+        self._seen: Dict[str, Tuple[Tuple[int, int], float]] = {}
+        self._handed: Dict[str, Tuple[int, int]] = {}
+
+        if use_inotify is None:
+            use_inotify = get_mount_fstype(directory) not in NETWORK_FILESYSTEMS
+        if use_inotify:
+            self._inotify_fd = self._start_inotify()
+
+        if self._inotify_fd is not None:
+            print(f"Watching {directory} with inotify")
+            self._pending |= self._rescan()
+            # Logs written just before the watch started never send a close event
+            self._next_rescan = time.monotonic() + max(stable_window, 2)
+        else:
+            print(f"Polling {directory} every {min_interval}-{max_interval}s")
+
+    def _start_inotify(self) -> Optional[int]:
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+            fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+            if fd < 0:
+                return None
+            wd = libc.inotify_add_watch(fd, os.fsencode(self.directory),
+                                        IN_CLOSE_WRITE | IN_MOVED_TO)
+            if wd < 0:
+                os.close(fd)
+                return None
+            return fd
+        except (OSError, AttributeError):
+            return None
+
+    def _scan(self) -> Dict[str, Tuple[int, int]]:
+        if self.pause is not None:
+            self.pause()
+        listing = {}
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if not entry.name.endswith(".txt"):
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                if stat.st_size > 0:
+                    listing[entry.path] = (stat.st_size, stat.st_mtime_ns)
+        return listing
+
+    def _rescan(self) -> Set[str]:
+        # Settled logs not handed over yet; anything written recently will
+        # still produce a close event, or turn up on the next rescan
+        settled = time.time() - max(self.stable_window, 2)
+        listing = self._scan()
+        ready = {path for path, signature in listing.items()
+                 if signature[1] / 1e9 < settled and self._handed.get(path) != signature}
+        self._handed = {p: s for p, s in self._handed.items() if p in listing}
+        self._next_rescan = time.monotonic() + self.rescan_interval
+        return ready
+
+    def _read_events(self, timeout: float) -> Set[str]:
+        ready = set()
+        lost = gone = False
+        readable, _, _ = select.select([self._inotify_fd], [], [], timeout)
+        while readable:
+            try:
+                buffer = os.read(self._inotify_fd, 64 * 1024)
+            except BlockingIOError:
+                break
+            offset = 0
+            while offset < len(buffer):
+                _, mask, _, name_len = INOTIFY_EVENT.unpack_from(buffer, offset)
+                offset += INOTIFY_EVENT.size
+                name = buffer[offset:offset + name_len].rstrip(b"\0").decode()
+                offset += name_len
+                if mask & IN_Q_OVERFLOW:
+                    lost = True
+                elif mask & IN_IGNORED:
+                    gone = True
+                elif name.endswith(".txt"):
+                    ready.add(os.path.join(self.directory, name))
+            # Give a burst of copies a moment to land in the same batch
+            readable, _, _ = select.select([self._inotify_fd], [], [], 0.05)
+        if lost:
+            print(f"inotify lost events for {self.directory}, rescanning")
+            ready |= self._rescan()
+            # Files still settling now are picked up by an early rescan
+            self._next_rescan = time.monotonic() + max(self.stable_window, 2)
+        if gone:
+            # The directory was removed or unmounted under the watch
+            print(f"inotify watch on {self.directory} went away, polling instead")
+            self.close()
+        return ready
+
+    def _hand_over(self, paths: Set[str]) -> None:
+        # Remember what inotify mode handed over, so a rescan skips it until it changes
+        for path in paths:
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            self._handed[path] = (stat.st_size, stat.st_mtime_ns)
+
+    def _poll(self) -> Set[str]:
+        with METRICS.timed("discover"):
+            listing = self._scan()
+        now = time.monotonic()
+        ready = set()
+        changed = False
+        settling = None   # seconds until the next unstable file could be ready
+        seen = {}
+        for path, signature in listing.items():
+            previous = self._seen.get(path)
+            if previous is not None and previous[0] == signature:
+                seen[path] = previous
+            else:
+                seen[path] = (signature, now)
+                changed = True
+            if self._handed.get(path) == signature:
+                continue
+            waited = now - seen[path][1]
+            # Seen unchanged on two polls at least, however short the window
+            if previous is not None and previous[0] == signature and waited >= self.stable_window:
+                ready.add(path)
+                self._handed[path] = signature
+            else:
+                remaining = max(self.stable_window - waited, 0)
+                settling = remaining if settling is None else min(settling, remaining)
+        changed = changed or len(seen) != len(self._seen)
+        self._seen = seen
+        self._handed = {p: s for p, s in self._handed.items() if p in listing}
+
+        if ready or changed:
+            self.interval = self.min_interval
+        else:
+            self.interval = min(self.interval * 2, self.max_interval)
+        if settling is not None:
+            # Come back when the next file is due instead of backing off past it
+            self.interval = min(self.interval, max(settling, self.min_interval))
+        return ready
+
+    def wait(self) -> List[str]:
+        """
+        Block until at least one log is ready.
+
+        Returns:
+            Sorted list of raw log paths
+        """
+        while True:
+            ready, self._pending = self._pending, set()
+            if self._inotify_fd is not None:
+                until_rescan = max(self._next_rescan - time.monotonic(), 0)
+                ready |= self._read_events(0 if ready else min(self.max_interval, until_rescan))
+                if self._inotify_fd is not None and time.monotonic() >= self._next_rescan:
+                    with METRICS.timed("discover"):
+                        ready |= self._rescan()
+                self._hand_over(ready)
+            else:
+                if not ready:
+                    time.sleep(self.interval)
+                ready |= self._poll()
+            if ready:
+                return sorted(ready)
+
+    def retry(self, paths: List[str]) -> None:
+        # Hand these logs out again on the next wait()
+        self._pending.update(paths)
+
+    def close(self) -> None:
+        if self._inotify_fd is not None:
+            os.close(self._inotify_fd)
+            self._inotify_fd = None
 
+# Offline conversion
+
+def convert_archive(source, out, jobs=1, formats=("xml",)):
+    """
+    Convert every raw log under source into out, mirroring its layout.
+
+    Nothing is mounted, uploaded or journaled and no credentials are
+    needed. A log that converts with errors gets a .log next to where its
+    XML would have gone instead of the XML, like the daemon's Errors.
+    The jsonl and csv formats collect one row per log in out/records.jsonl
+    and out/records.csv.
+
+    Returns:
+        Number of logs that failed
+    """
+    source, out = Path(source), Path(out)
+    raw_logs = sorted(source.rglob("*.txt"))
+    executor = create_executor(jobs)
+    submit = executor.submit if executor is not None else run_inline
+    started = time.perf_counter()
+    failed = 0
+    out.mkdir(parents=True, exist_ok=True)
+    tables = {name: open(out / f"records.{name}", "w", encoding="utf-8", newline="")
+              for name in formats if name != "xml"}
+    if "csv" in tables:
+        csv.writer(tables["csv"]).writerow(RECORD_FIELDS)
+
+    def finish(raw_log, job):
+        target = out / raw_log.relative_to(source)
+        target.parent.mkdir(parents=True, exist_ok=True)
+        encoded, errors = job_result(job)
+        if errors:
+            target.with_suffix(".log").write_text("".join(errors), encoding="utf-8")
+            print(f"{raw_log}: conversion errors, see {target.with_suffix('.log')}")
+            return False
+        if "xml" in encoded:
+            save_to_output_xml(encoded["xml"], target.with_suffix(".xml"))
+        for name, table in tables.items():
+            table.write(encoded[name])
+        return True
+
+    def submitted():
+        for raw_log in raw_logs:
+            try:
+                with raw_log.open(encoding="utf-8") as file:
+                    input_text = read_report(file)
+                yield raw_log, submit(encode_log, input_text, formats)
+            except UnicodeDecodeError as e:
+                yield raw_log, failed_job(e)
+
+    try:
+        for raw_log, job in submission_window(submitted(), window_size(jobs)):
+            failed += not finish(raw_log, job)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+        for table in tables.values():
+            table.close()
+
+    print(f"Converted {len(raw_logs) - failed}/{len(raw_logs)} logs into {out} "
+          f"in {time.perf_counter() - started:.2f}s")
+    return failed
+
+
+# Hot reload
+#
+# CREDS.env and the lookup file (LOOKUP_FILE, default STATE_DIR/lookups.json)
+# are polled while the daemon runs. The lookup file is a JSON object of table
+# name to mapping, e.g. {"MAC_OS_DICT": {"20": "MacOS Sequoia", ...}}; a
+# table it leaves out keeps its built-in contents.
+
+BUILTIN_LOOKUPS = {name: globals()[name] for name in LOOKUP_TABLES}
+
+def lookup_path():
+    return CONFIG.get("LOOKUP_FILE") or os.path.join(CONFIG.get("STATE_DIR", "state"), "lookups.json")
+
+def read_lookup_tables(path: str) -> Dict[str, Dict[str, str]]:
+    with open(path, encoding="utf-8") as file:
+        data = json.load(file)
+    if not isinstance(data, dict):
+        raise ValueError("expected an object of table name to mapping")
+    for name, table in data.items():
+        if name not in BUILTIN_LOOKUPS:
+            raise ValueError(f"unknown table {name!r}")
+        if not isinstance(table, dict) or not all(isinstance(value, str) for value in table.values()):
+            raise ValueError(f"{name} must map strings to strings")
+    return {**BUILTIN_LOOKUPS, **data}
+
+class ConfigReloader:
+    """
+    Watches CREDS.env and the lookup file and reloads them when they change.
+
+    The thread only reads and checks a changed file; apply() swaps the result
+    in between batches, so every log in a batch sees one set of tables and
+    config. A file that does not parse or verify is reported once and the
+    values already in use are kept. The share layout (MOUNT_BASE,
+    APPLE_BASE) and anything sized at startup still needs a restart.
+    """
 
-def main():
+    def __init__(self, env_file: str, lookup_file: str, interval: float = 5,
+                 source: Optional[str] = None):
+        self.env_file = env_file
+        self.lookup_file = lookup_file
+        self.interval = interval
+        self.source = source
+        # The lookup file starts unseen, so the first check() loads it
+        self._seen = {env_file: self._signature(env_file), lookup_file: None}
+        self._pending: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @staticmethod
+    def _signature(path: str) -> Optional[Tuple[int, int]]:
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        return (st.st_mtime_ns, st.st_size)
+
+    def _read_config(self) -> Dict[str, Any]:
+        config = read_env_config(self.env_file)
+        if self.source:
+            config = source_config(self.source, config)
+        config["MOUNT_BASE"], config["APPLE_BASE"] = MOUNT_BASE, APPLE_BASE
+        if not verify_env_config(config):
+            raise ValueError("required keys missing or empty")
+        return config
+
+    def check(self) -> None:
+        for path, seen in list(self._seen.items()):
+            signature = self._signature(path)
+            if signature == seen:
+                continue
+            self._seen[path] = signature
+            try:
+                if path == self.lookup_file:
+                    kind = "tables"
+                    loaded = read_lookup_tables(path) if signature else dict(BUILTIN_LOOKUPS)
+                else:
+                    kind = "config"
+                    loaded = self._read_config()
+            except (OSError, ValueError) as e:
+                print(f"Not reloading {path}: {e}")
+                continue
+            with self._lock:
+                self._pending[kind] = loaded
+
+    def apply(self) -> bool:
+        """
+        Swap in whatever check() found since the last call. Returns True when
+        the lookup tables changed, as forked workers still hold the old ones.
+        """
+        global CONFIG, FTP_POOL
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if "tables" in pending:
+            globals().update(pending["tables"])
+            print(f"Loaded lookup tables from {self.lookup_file}")
+        if "config" in pending:
+            old, CONFIG = CONFIG, pending["config"]
+            if FTP_POOL is not None and any(old.get(key) != CONFIG.get(key) for key in FTP_POOL_KEYS):
+                # Uploads already under way finish on the old sessions
+                pool, FTP_POOL = FTP_POOL, None
+                pool.close()
+                print("FTP settings changed, reconnecting")
+            print(f"Reloaded config from {self.env_file}")
+        return "tables" in pending
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            self.check()
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._run, name="config-reload", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+
+def unfinished_claims():
+    # Logs claimed by a batch that failed part way; claim_raw_log skips the
+    # ones the retry queue or the error reporter now own
+    paths = []
+    if SPOOL is not None:
+        SPOOL.abandon()
+        paths += SPOOL.recover()
+    if CLAIMS is not None:
+        try:
+            paths += CLAIMS.recover()
+        except OSError as e:
+            # Still in this replica's claim directory; recovered on restart
+            print(f"Could not list {CLAIMS.path}: {e}")
+    return paths
+
+def main(jobs=1, profile_cycles=0, profile_out=None, pipeline="sequential", staging_dir=None):
+    global SPOOL, RETRIES, PROCESSED_INDEX, CLAIMS, ERROR_REPORTER, SUPERVISOR
+    SUPERVISOR = supervisor = MountSupervisor(MOUNT_BASE, apple_path("Temp"),
+                                              interval=float(CONFIG.get("MOUNT_CHECK_INTERVAL", 15)),
+                                              probe_timeout=float(CONFIG.get("MOUNT_PROBE_TIMEOUT", 5)))
+    supervisor.start()
+    supervisor.wait_healthy()
+    if CONFIG.get("CLAIMS", "off") == "on":
+        CLAIMS = WorkClaims(apple_path("Claims"), CONFIG.get("NODE_ID") or socket.gethostname(),
+                            float(CONFIG.get("CLAIM_LEASE_TIMEOUT", 120)))
+        print(f"Claiming logs as {CLAIMS.node_id}")
+    else:
+        # Replicas write into Processed too, and an index would only see
+        # their files on the next reconcile; they keep the stat per log
+        PROCESSED_INDEX = ProcessedIndex(apple_path("Processed"),
+                                         float(CONFIG.get("PROCESSED_RECONCILE_INTERVAL", 300)))
+    if staging_dir:
+        SPOOL = StagingSpool(staging_dir, float(CONFIG.get("STAGING_FLUSH_INTERVAL", 5)))
+        print(f"Staging logs through {SPOOL.root}")
+    if CONFIG.get("ERROR_REPORTS", "batched") == "batched":
+        ERROR_REPORTER = ErrorReporter(float(CONFIG.get("ERROR_FLUSH_INTERVAL", 5)))
+    retry_attempts = int(CONFIG.get("UPLOAD_RETRY_ATTEMPTS", 5))
+    if retry_attempts > 1:
+        RETRIES = UploadRetryQueue(retry_dir(),
+                                   max_attempts=retry_attempts,
+                                   base_delay=float(CONFIG.get("UPLOAD_RETRY_BASE_DELAY", 30)),
+                                   max_delay=float(CONFIG.get("UPLOAD_RETRY_MAX_DELAY", 1800)))
+    # Before the watcher's first scan, so resumed logs are not handed over twice
+    resume_journal()
+    watcher = IntakeWatcher(apple_path("Temp"), stable_window=float(CONFIG.get("INTAKE_STABLE_WINDOW", 2)),
+                            pause=supervisor.wait_healthy)
+    if SPOOL is not None:
+        watcher.retry(SPOOL.recover())
+        SPOOL.start()
+    if RETRIES is not None:
+        RETRIES.start()
+    if ERROR_REPORTER is not None:
+        ERROR_REPORTER.start()
+    if CLAIMS is not None:
+        watcher.retry(CLAIMS.recover())
+        CLAIMS.start(apple_path("Temp"))
+    reloader = ConfigReloader("CREDS.env", lookup_path(),
+                              float(CONFIG.get("CONFIG_CHECK_INTERVAL", 5)), source=CURRENT_SOURCE)
+    # The lookup file is in place before the workers fork
+    reloader.check()
+    reloader.apply()
+    reloader.start()
+    executor = create_executor(jobs)
+    metrics_file = metrics_path()
+    metrics_interval = float(CONFIG.get("METRICS_INTERVAL", 15))
+    # Profiles the parent only; conversion in --jobs workers shows up as waiting
+    profiler = cProfile.Profile() if profile_cycles > 0 else None
     while True:
+        raw_logs = []
         try:
-            process_RAW_LOGS()
-            time.sleep(10)
+            supervisor.wait_healthy()
+            raw_logs = watcher.wait()
+            supervisor.wait_healthy()
+            if reloader.apply() and executor is not None:
+                executor.shutdown()
+                executor = create_executor(jobs)
+            if profiler is not None:
+                profiler.enable()
+            try:
+                if pipeline == "async":
+                    queue_size = int(CONFIG.get("PIPELINE_QUEUE_SIZE", max(8, 2 * jobs)))
+                    asyncio.run(process_RAW_LOGS_async(raw_logs, executor, queue_size))
+                else:
+                    process_RAW_LOGS(raw_logs, executor, jobs)
+            finally:
+                if profiler is not None:
+                    profiler.disable()
+                    profile_cycles -= 1
+                    if profile_cycles == 0:
+                        Path(profile_out).parent.mkdir(parents=True, exist_ok=True)
+                        profiler.dump_stats(profile_out)
+                        print(f"Wrote profile stats to {profile_out}")
+                        profiler = None
+            if ERROR_REPORTER is not None:
+                ERROR_REPORTER.cycle_done()
+            METRICS.maybe_dump(metrics_file, metrics_interval)
         except KeyboardInterrupt:
                 print("\nMonitoring stopped by user")
+                METRICS.dump(metrics_file)
+                watcher.close()
+                reloader.stop()
+                supervisor.stop()
+                if CLAIMS is not None:
+                    CLAIMS.stop()
+                if RETRIES is not None:
+                    RETRIES.stop()
+                flush_manifest()
+                if ERROR_REPORTER is not None:
+                    ERROR_REPORTER.stop()
+                if SPOOL is not None:
+                    SPOOL.stop()
+                if executor is not None:
+                    executor.shutdown(cancel_futures=True)
+                if FTP_POOL is not None:
+                    FTP_POOL.close()
+                if DEDUP_CACHE is not None:
+                    DEDUP_CACHE.close()
+                if JOURNAL is not None:
+                    JOURNAL.close()
                 break
         except Exception as e:
             print(f"Error during monitoring: {str(e)}")
             print(str(e))
-            time.sleep(10)
+            if isinstance(e, BrokenProcessPool):
+                executor = create_executor(jobs)
+            if isinstance(e, OSError):
+                # Most likely the share; let the supervisor look before retrying
+                supervisor.request_check()
+                time.sleep(1)
+                supervisor.wait_healthy()
+            else:
+                time.sleep(10)
+            # Logs the batch already claimed are no longer where the watcher saw them
+            claimed = unfinished_claims()
+            claimed_names = {os.path.basename(path) for path in claimed}
+            watcher.retry([path for path in raw_logs if os.path.basename(path) not in claimed_names])
+            watcher.retry(claimed)
+
+
+# Multi-source intake
+#
+# SOURCES=site1,site2 runs one intake per source in its own forked process,
+# so every source keeps its own share mount, worker pool, FTP sessions,
+# spool and state while the parent pays for startup once. Any config key
+# can be set per source as <NAME>_<KEY> (SITE2_SHARE_IP, SITE2_FTP_HOST,
+# SITE2_MOUNT_BASE, SITE2_APPLE_BASE, SITE2_JOBS, ...), falling back to
+# the unprefixed key.
+
+def source_names():
+    return [name.strip() for name in CONFIG.get("SOURCES", "").split(",") if name.strip()]
+
+# The source this process runs, None in a single-source daemon
+CURRENT_SOURCE: Optional[str] = None
+
+def source_config(name, config):
+    # config with one source's <NAME>_<KEY> overrides applied
+    prefix = name.upper() + "_"
+    overrides = {key[len(prefix):]: value for key, value in config.items() if key.startswith(prefix)}
+    overrides.setdefault("STATE_DIR", os.path.join(config.get("STATE_DIR", "state"), name))
+    overrides.setdefault("MOUNT_BASE", f"{MOUNT_BASE}_{name}")
+    return {**config, **overrides}
+
+def apply_source(name):
+    # Narrow this process's CONFIG and share layout down to one source
+    global CONFIG, MOUNT_BASE, APPLE_BASE, CURRENT_SOURCE
+    CURRENT_SOURCE = name
+    CONFIG = source_config(name, CONFIG)
+    MOUNT_BASE = CONFIG["MOUNT_BASE"]
+    APPLE_BASE = CONFIG.get("APPLE_BASE", APPLE_BASE)
+
+def run_source(name, args):
+    apply_source(name)
+    print(f"Source {name}: {MOUNT_BASE}/{APPLE_BASE} -> {CONFIG.get('FTP_HOST')}")
+    if not verify_env_config():
+        sys.exit(1)
+    options = watch_options(args)
+    if args.profile_out:
+        root, ext = os.path.splitext(args.profile_out)
+        options["profile_out"] = f"{root}.{name}{ext}"
+    try:
+        main(**options)
+    except KeyboardInterrupt:
+        pass   # interrupted before main() got to its own handler
 
+def run_sources(names, args, max_backoff=60.0):
+    """
+    Run every source in its own process and restart any that dies, waiting
+    longer after each crash of the same source.
+    """
+    context = multiprocessing.get_context("fork")
+    processes = {}
+    started = {}
+    crashes = dict.fromkeys(names, 0)
+    due = dict.fromkeys(names, 0.0)
+    try:
+        while True:
+            now = time.monotonic()
+            for name in names:
+                process = processes.get(name)
+                if process is not None and process.is_alive():
+                    continue
+                if process is not None:
+                    # A source that ran for a while before dying starts its backoff over
+                    if now - started[name] > max_backoff:
+                        crashes[name] = 0
+                    crashes[name] += 1
+                    delay = min(max_backoff, 2 ** crashes[name])
+                    print(f"Source {name} exited with {process.exitcode}, restarting in {delay:.0f}s")
+                    due[name] = now + delay
+                    processes[name] = None
+                if now >= due[name]:
+                    processes[name] = context.Process(target=run_source, args=(name, args),
+                                                      name=f"source-{name}")
+                    processes[name].start()
+                    started[name] = now
+            sentinels = [p.sentinel for p in processes.values() if p is not None]
+            multiprocessing.connection.wait(sentinels, timeout=1)
+    except KeyboardInterrupt:
+        # The children got the same SIGINT and shut down on their own
+        print("\nStopping sources")
+        for process in processes.values():
+            if process is None:
+                continue
+            process.join(timeout=30)
+            if process.is_alive():
+                process.terminate()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Convert Apple system_profiler logs to SYSINFO XML")
+    commands = parser.add_subparsers(dest="command")
+
+    watch = commands.add_parser("watch", help="run the intake daemon (the default)")
+    # Defaults come from CREDS.env, which is only read once watch is chosen
+    watch.add_argument("--jobs", type=int,
+                       help="number of worker processes used for conversion")
+    watch.add_argument("--profile-cycles", type=int, default=0, metavar="N",
+                       help="run the first N processing cycles under cProfile")
+    watch.add_argument("--profile-out",
+                       help="where to write the cProfile stats")
+    watch.add_argument("--pipeline", choices=["sequential", "async"],
+                       help="async overlaps share reads, conversion and uploads")
+    watch.add_argument("--stage-dir",
+                       help="claim logs into this local directory and write results back in batches")
+
+    convert = commands.add_parser("convert", help="convert a directory of raw logs offline")
+    convert.add_argument("source", help="directory searched recursively for .txt logs")
+    convert.add_argument("--out", required=True, help="where the XML files are written")
+    convert.add_argument("--jobs", type=int, default=os.cpu_count() or 1,
+                         help="number of worker processes used for conversion")
+    convert.add_argument("--format", action="append", choices=sorted(ENCODERS), dest="formats",
+                         help="output format, repeatable (default: xml)")
+    convert.add_argument("--lookups", metavar="FILE",
+                         help="lookup table file to use instead of the built-in tables")
+
+    argv = list(sys.argv[1:] if argv is None else argv)
+    if not argv or argv[0] not in ("watch", "convert", "-h", "--help"):
+        # Plain `AppleConverter.py [flags]`, as the container runs it
+        argv.insert(0, "watch")
+    return parser.parse_args(argv)
+
+def watch_options(args):
+    # CLI flags win over CREDS.env, which for a source already has its overrides applied
+    return dict(jobs=args.jobs if args.jobs is not None else int(CONFIG.get("JOBS", 1)),
+                profile_cycles=args.profile_cycles,
+                profile_out=args.profile_out or os.path.join(CONFIG.get("STATE_DIR", "state"), "cycles.pstats"),
+                pipeline=args.pipeline or CONFIG.get("PIPELINE", "sequential"),
+                staging_dir=args.stage_dir or CONFIG.get("STAGING_DIR"))
+
+def watch_command(args):
+    startup()
+    names = source_names()
+    if names:
+        run_sources(names, args)
+    else:
+        main(**watch_options(args))
+
+def convert_command(args):
+    if not os.path.isdir(args.source):
+        print(f"{args.source} is not a directory")
+        sys.exit(2)
+    if args.lookups:
+        try:
+            globals().update(read_lookup_tables(args.lookups))
+        except (OSError, ValueError) as e:
+            print(f"Cannot use {args.lookups}: {e}")
+            sys.exit(2)
+    formats = tuple(dict.fromkeys(args.formats or ["xml"]))
+    sys.exit(1 if convert_archive(args.source, args.out, args.jobs, formats) else 0)
 
-if __name__ == "__main__":
-    main()
 
+if __name__ == "__main__":
+    args = parse_args()
+    if args.command == "convert":
+        convert_command(args)
+    else:
+        watch_command(args)
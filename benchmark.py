@@ -0,0 +1,288 @@
+"""
+Converter throughput benchmark.
+
+Generates synthetic system_profiler logs (Apple Silicon and Intel; NVMe,
+SATA and driveless; laptops, desktops and all-in-ones; short logs, logs
+with a few bulky sections, and complete reports laid out like a real
+`system_profiler -detailLevel full` dump) and times each conversion stage
+in-process. No share mount, credentials or FTP are touched.
+
+    python benchmark.py                              # print results
+    python benchmark.py --save-baseline bench.json   # record a baseline
+    python benchmark.py --baseline bench.json        # exit 1 on regression
+"""
+import argparse,json,random,sys,time,tracemalloc,io
+from typing import *
+
+import AppleConverter as converter
+
+
+# Synthetic log generation
+
+APPLE_CHIPS = ["Apple M1", "Apple M1 Pro", "Apple M1 Max", "Apple M2", "Apple M2 Pro", "Apple M2 Max"]
+INTEL_CPUS = [
+    ("Intel(R) Core(TM) i5-8259U CPU @ 2.30GHz", "Quad-Core Intel Core i5", "2.3 GHz", 4),
+    ("Intel(R) Core(TM) i7-8850H CPU @ 2.60GHz", "6-Core Intel Core i7", "2.6 GHz", 6),
+    ("Intel(R) Core(TM) i9-9980HK CPU @ 2.40GHz", "8-Core Intel Core i9", "2.4 GHz", 8),
+    ("Intel(R) Xeon(R) W-2140B CPU @ 3.20GHz", "8-Core Intel Xeon W", "3.2 GHz", 8),
+]
+RESOLUTIONS = {"L": ["2560 x 1600 Retina", "3024 x 1964 Retina", "2880 x 1800 Retina"],
+               "D": ["3840 x 2160 (2160p/4K UHD 1 - Ultra High Definition)", "1920 x 1080 (1080p FHD - Full High Definition)"],
+               "A": ["5120 x 2880 Retina", "4480 x 2520 Retina"]}
+GRADES = "ABCDF"
+
+class LogProfile(NamedTuple):
+    name: str
+    cpu: str        # "apple" | "intel"
+    drive: str      # "nvme" | "sata" | "none"
+    chassis: str    # "L" | "D" | "A"
+    full: bool      # full system report with the bulky sections
+    report: bool = False   # every section of a real full report, in system_profiler's order
+
+PROFILES = [
+    LogProfile("apple-nvme-laptop", "apple", "nvme", "L", False),
+    LogProfile("apple-nvme-desktop", "apple", "nvme", "D", False),
+    LogProfile("apple-nvme-aio-full", "apple", "nvme", "A", True),
+    LogProfile("intel-sata-aio", "intel", "sata", "A", False),
+    LogProfile("intel-nvme-laptop-full", "intel", "nvme", "L", True),
+    LogProfile("intel-nodrive-desktop", "intel", "none", "D", False),
+    LogProfile("apple-nvme-desktop-report", "apple", "nvme", "D", True, True),
+    LogProfile("intel-sata-laptop-report", "intel", "sata", "L", True, True),
+]
+
+# Sections of a full report around the ones the converter reads, with a
+# rough item count each: before Graphics/Displays, between Hardware and
+# Memory, and after Storage. About 2 MB all told.
+REPORT_SECTIONS = {
+    "before": [("Applications", 1500), ("Audio", 4), ("Bluetooth", 12), ("Camera", 1), ("Card Reader", 1),
+               ("Developer", 8), ("Diagnostics", 2), ("Disabled Software", 20), ("Disc Burning", 1),
+               ("Ethernet", 2), ("Extensions", 600), ("Firewall", 30), ("Fonts", 2500), ("Frameworks", 1200)],
+    "middle": [("Installations", 900), ("Language & Region", 3), ("Legacy Software", 10), ("Locations", 4),
+               ("Logs", 800), ("Managed Client", 1)],
+    "after": [("Software", 2), ("Startup Items", 6), ("Sync Services", 1), ("Thunderbolt/USB4", 4),
+              ("USB", 40), ("Volumes", 6), ("Wi-Fi", 30)],
+}
+
+def serial(rng: random.Random, length: int = 12) -> str:
+    return "".join(rng.choice("ABCDEFGHJKLMNPQRSTUVWXYZ0123456789") for _ in range(length))
+
+def filler_section(rng: random.Random, title: str, items: int, item: Optional[str] = None) -> List[str]:
+    # Bulky sections of a full report that the converter has to skip over
+    lines = [f"{title}:", ""]
+    for i in range(items):
+        lines += [f"    {item or title[:-1]} {i} {serial(rng, 6)}:", "",
+                  f"      Version: {rng.randint(1, 20)}.{rng.randint(0, 9)}",
+                  f"      Obtained from: Identified Developer",
+                  f"      Last Modified: 1/{rng.randint(1, 28)}/24, {rng.randint(1, 12)}:{rng.randint(10, 59)} PM",
+                  f"      Location: /Library/{title}/{serial(rng, 8)}",
+                  f"      Signed by: Developer ID Application: Vendor {i}, Developer ID Certification Authority", ""]
+    return lines
+
+def report_sections(rng: random.Random, profile: LogProfile, where: str) -> List[str]:
+    if not profile.report:
+        return []
+    lines = []
+    for title, items in REPORT_SECTIONS[where]:
+        lines += filler_section(rng, title, items, item=title)
+    return lines
+
+def generate_log(rng: random.Random, profile: LogProfile) -> str:
+    chassis = profile.chassis
+    lines = [
+        f"TECHID:{rng.choice(['mg', 'jd', 'kt'])}",
+        f"SYSUID:{serial(rng, 7).lower()}",
+        f"SYSTYPE:{chassis.lower() if rng.random() < 0.5 else chassis}",
+        f"BUILDNO:a{rng.randint(1000, 3000)}",
+        f"OSVER:{rng.randint(11, 19)}",
+        f"FINALGRADE:{rng.choice(GRADES).lower()}",
+        f"SCREENSIZE:{rng.choice(['13', '14', '16', '21.5', '24', '27'])}",
+        f"SYSCOLOR:{rng.choice(['space gray', 'silver', 'midnight'])}",
+        f"COSGRADE:{rng.choice(GRADES)}",
+        f"LCDGRADE:{rng.choice(GRADES)}",
+    ]
+    if chassis == "L":
+        lines.append(f"SYSBAT:{rng.randint(70, 100)}%")
+    if rng.random() < 0.5:
+        lines.append("SYSNOTES:minor scratches on lid")
+
+    if profile.cpu == "apple":
+        chip = rng.choice(APPLE_CHIPS)
+        cpu_cores, gpu_cores = rng.choice([8, 10, 12]), rng.choice([8, 16, 32])
+        lines.append(f"CPUNAME:{chip}")
+    else:
+        cpu_name, processor_name, speed, cpu_cores = rng.choice(INTEL_CPUS)
+        lines.append(f"CPUNAME:{cpu_name}")
+
+    if profile.report:
+        lines += report_sections(rng, profile, "before")
+    elif profile.full:
+        lines += filler_section(rng, "Applications", 1500)
+        lines += filler_section(rng, "Extensions", 600)
+
+    lines += ["Graphics/Displays:", ""]
+    if profile.cpu == "apple":
+        lines += [f"    {chip}:", "", f"      Chipset Model: {chip}", "      Type: GPU",
+                  f"      Total Number of Cores: {gpu_cores}", "      Vendor: Apple (0x106b)"]
+    else:
+        lines += ["    Intel UHD Graphics 630:", "", "      Chipset Model: Intel UHD Graphics 630",
+                  "      Type: GPU", "      Bus: Built-In", "",
+                  "    AMD Radeon Pro 560X:", "", "      Chipset Model: AMD Radeon Pro 560X",
+                  "      Type: GPU", "      Bus: PCIe"]
+    if chassis != "D":
+        lines += ["      Displays:", "        Color LCD:", "          Display Type: Built-In Retina LCD",
+                  f"          Resolution: {rng.choice(RESOLUTIONS[chassis])}", "          Main Display: Yes"]
+    lines.append("")
+
+    memory = rng.choice([8, 16, 32, 64])
+    lines += ["Hardware:", "", "    Hardware Overview:", "", "      Model Name: Mac",
+              f"      Model Identifier: Mac{rng.randint(10, 20)},{rng.randint(1, 9)}"]
+    if profile.cpu == "apple":
+        lines += [f"      Chip: {chip}",
+                  f"      Total Number of Cores: {cpu_cores} ({cpu_cores - 4} performance and 4 efficiency)"]
+    else:
+        lines += [f"      Processor Name: {processor_name}", f"      Processor Speed: {speed}",
+                  "      Number of Processors: 1", f"      Total Number of Cores: {cpu_cores}"]
+    lines += [f"      Memory: {memory} GB", f"      Serial Number (system): {serial(rng)}",
+              f"      Hardware UUID: {serial(rng, 8)}-{serial(rng, 4)}", ""]
+
+    lines += report_sections(rng, profile, "middle")
+    lines += ["Memory:", ""]
+    if profile.cpu == "apple":
+        lines += [f"      Memory: {memory} GB", "      Type: LPDDR5", "      Manufacturer: Hynix", ""]
+    else:
+        lines += ["    Memory Slots:", "", "      ECC: Disabled", "      Upgradeable Memory: Yes", ""]
+        for bank in range(2):
+            lines += [f"        BANK {bank}/ChannelA-DIMM{bank}:", "", f"          Size: {memory // 2} GB",
+                      "          Type: DDR4", "          Speed: 2667 MHz", "          Status: OK", ""]
+
+    capacity = rng.choice(["251.0 GB", "500.28 GB", "1 TB", "2 TB"])
+    medium = rng.choice(["SSD", "Solid State", "Rotational"])
+    if profile.drive == "nvme":
+        lines += ["NVMExpress:", "", "    Apple SSD Controller:", "", "        APPLE SSD AP0512Q:", "",
+                  f"          Capacity: {capacity} (500,277,790,720 bytes)", "          TRIM Support: Yes",
+                  "          Model: APPLE SSD AP0512Q", f"          Serial Number: {serial(rng, 16).lower()}",
+                  "          Link Width: x4", ""]
+    if chassis == "L":
+        lines += ["Power:", "", "    Battery Information:", "", "      Health Information:",
+                  f"          Cycle Count: {rng.randint(1, 1200)}",
+                  f"          Condition: {rng.choice(['Normal', 'Normal', 'Service Recommended'])}", ""]
+    if profile.drive == "sata":
+        lines += ["SATA/SATA Express:", "", "    Intel SATA Controller:", "", "        APPLE HDD ST1000DM003:", "",
+                  f"          Capacity: {capacity} (1,000,204,886,016 bytes)",
+                  "          Model: APPLE HDD ST1000DM003", f"          Serial Number: {serial(rng, 8)}",
+                  f"          Medium Type: {medium}", ""]
+    lines += ["Storage:", "", "    Macintosh HD:", "", f"      Capacity: {capacity}", "      Physical Drive:",
+              f"          Medium Type: {medium}", ""]
+    if profile.report:
+        lines += report_sections(rng, profile, "after")
+    elif profile.full:
+        lines += filler_section(rng, "Logs", 800)
+    return "\n".join(lines) + "\n"
+
+
+# Timing
+
+STAGES = ("scan_report", "build_sysinfo", "serialize", "total")
+
+def run_stages(input_text: str) -> Dict[str, float]:
+    errors: List[str] = []
+    t0 = time.perf_counter()
+    input_data, total_cores, report = converter.scan_report(input_text)
+    t1 = time.perf_counter()
+    record = converter.build_record(input_data, total_cores, input_text, errors, report)
+    sysinfo = converter.encode_sysinfo(record)
+    t2 = time.perf_counter()
+    buffer = io.StringIO()
+    converter.write_sysinfo(sysinfo, buffer.write)
+    t3 = time.perf_counter()
+    return {"scan_report": t1 - t0, "build_sysinfo": t2 - t1, "serialize": t3 - t2, "total": t3 - t0}
+
+def benchmark_profile(profile: LogProfile, records: int, seed: int) -> Dict[str, Any]:
+    rng = random.Random(f"{seed}-{profile.name}")
+    logs = [generate_log(rng, profile) for _ in range(min(records, 20))]
+
+    # Silence the per-field error prints so they don't dominate the timings
+    stdout, sys.stdout = sys.stdout, io.StringIO()
+    try:
+        run_stages(logs[0])   # warm-up
+        totals = dict.fromkeys(STAGES, 0.0)
+        for i in range(records):
+            for stage, seconds in run_stages(logs[i % len(logs)]).items():
+                totals[stage] += seconds
+
+        tracemalloc.start()
+        run_stages(logs[0])
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    finally:
+        sys.stdout = stdout
+
+    return {
+        "log_bytes": sum(len(log) for log in logs) // len(logs),
+        "records_per_sec": {stage: records / seconds if seconds else float("inf")
+                            for stage, seconds in totals.items()},
+        "peak_kib": peak / 1024,
+    }
+
+def compare(results: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        for stage in STAGES:
+            old = baseline[name]["records_per_sec"].get(stage)
+            new = result["records_per_sec"][stage]
+            if old and new < old * (1 - tolerance):
+                regressions.append(f"{name} {stage}: {new:,.0f} rec/s vs baseline {old:,.0f} rec/s")
+    return regressions
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Benchmark log -> SYSINFO conversion throughput")
+    parser.add_argument("--records", type=int, default=200, help="records converted per profile")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--profile", action="append", choices=[p.name for p in PROFILES],
+                        help="only run these profiles (repeatable)")
+    parser.add_argument("--baseline", help="fail if throughput regresses against this JSON baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="allowed fractional slowdown against the baseline (default 0.25)")
+    parser.add_argument("--save-baseline", help="write results as a new baseline")
+    parser.add_argument("--dump-log", metavar="PROFILE", help="print one synthetic log and exit")
+    args = parser.parse_args()
+
+    if args.dump_log:
+        profile = next(p for p in PROFILES if p.name == args.dump_log)
+        sys.stdout.write(generate_log(random.Random(args.seed), profile))
+        return 0
+
+    results = {}
+    print(f"{'profile':<28}{'KiB/log':>9}{'scan':>10}{'build':>10}{'write':>10}{'total':>10}{'peak KiB':>10}")
+    for profile in PROFILES:
+        if args.profile and profile.name not in args.profile:
+            continue
+        result = benchmark_profile(profile, args.records, args.seed)
+        results[profile.name] = result
+        rates = result["records_per_sec"]
+        print(f"{profile.name:<28}{result['log_bytes'] / 1024:>9.1f}"
+              + "".join(f"{rates[stage]:>10,.0f}" for stage in STAGES)
+              + f"{result['peak_kib']:>10,.0f}")
+    print("(records per second per stage)")
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w", encoding="utf-8") as file:
+            json.dump(results, file, indent=2)
+        print(f"Baseline written to {args.save_baseline}")
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as file:
+            regressions = compare(results, json.load(file), args.tolerance)
+        if regressions:
+            print("THROUGHPUT REGRESSION")
+            for line in regressions:
+                print("  " + line)
+            return 1
+        print("No regressions against baseline")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,1195 @@
+"""
+Tests for the parts of AppleConverter that can run without a share mount
+or a real FTP server.
+
+    python -m pytest test_AppleConverter.py
+    python -m unittest test_AppleConverter
+"""
+import asyncio,csv,datetime,errno,ftplib,io,json,multiprocessing,multiprocessing.connection,os,random,re,shutil,socket,socketserver,ssl,subprocess,sys,tempfile,threading,time,unittest
+import xml.etree.ElementTree as ET
+from xml.dom import minidom
+from xml.parsers.expat import ExpatError
+from unittest import mock
+from typing import *
+
+import AppleConverter as converter
+import benchmark
+
+
+# FTP session pool
+
+class StubSession:
+    """Stands in for a logged-in ftplib.FTP; the server's script decides how each STOR goes."""
+
+    def __init__(self, server: "StubServer"):
+        self.server = server
+        self.closed = False
+        self.noop_fails = False
+
+    def storbinary(self, command: str, file) -> None:
+        outcome = self.server.script.pop(0) if self.server.script else "ok"
+        if outcome == "drop":
+            self.closed = True
+            raise EOFError()
+        if outcome == "refuse":
+            raise ftplib.error_perm("553 Could not create file")
+        self.server.stored.append((self, command[len("STOR "):], file.read()))
+
+    def voidcmd(self, command: str) -> str:
+        if self.noop_fails:
+            raise ConnectionResetError()
+        return "200 NOOP ok"
+
+    def quit(self) -> None:
+        self.closed = True
+
+    def close(self) -> None:
+        self.closed = True
+
+class StubServer:
+    def __init__(self, script: Optional[List[str]] = None):
+        self.script = list(script or [])
+        self.sessions: List[StubSession] = []
+        self.stored: List[Tuple[StubSession, str, bytes]] = []
+
+class StubPool(converter.FTPSessionPool):
+    def __init__(self, server: StubServer, **kwargs):
+        super().__init__("127.0.0.1", 21, "user", "pass", tls="no", **kwargs)
+        self.server = server
+
+    def _connect(self) -> StubSession:
+        session = StubSession(self.server)
+        self.server.sessions.append(session)
+        return session
+
+class FTPSessionPoolTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def files(self, *names: str) -> List[str]:
+        paths = []
+        for name in names:
+            path = os.path.join(self.directory, name)
+            with open(path, "wb") as f:
+                f.write(name.encode())
+            paths.append(path)
+        return paths
+
+    def test_session_is_reused_across_uploads(self):
+        server = StubServer()
+        pool = StubPool(server)
+        first, second = self.files("a.xml", "b.xml")
+        self.assertEqual(pool.upload([first]), {})
+        self.assertEqual(pool.upload([second]), {})
+        self.assertEqual(len(server.sessions), 1)
+        self.assertEqual([name for _, name, _ in server.stored], ["a.xml", "b.xml"])
+        self.assertFalse(server.sessions[0].closed)
+
+    def test_broken_session_is_replaced_and_file_retried(self):
+        server = StubServer(["drop"])
+        pool = StubPool(server)
+        paths = self.files("a.xml", "b.xml")
+        self.assertEqual(pool.upload(paths), {})
+        self.assertEqual(len(server.sessions), 2)
+        self.assertTrue(server.sessions[0].closed)
+        self.assertEqual([(session, name) for session, name, _ in server.stored],
+                         [(server.sessions[1], "a.xml"), (server.sessions[1], "b.xml")])
+
+    def test_file_fails_once_retries_are_used_up(self):
+        server = StubServer(["drop", "drop"])
+        pool = StubPool(server)
+        paths = self.files("a.xml", "b.xml")
+        failures = pool.upload(paths, retries=1)
+        self.assertEqual(list(failures), [paths[0]])
+        self.assertEqual([name for _, name, _ in server.stored], ["b.xml"])
+        self.assertEqual(len(server.sessions), 3)
+
+    def test_refused_file_keeps_the_session(self):
+        server = StubServer(["ok", "refuse", "ok"])
+        pool = StubPool(server)
+        paths = self.files("a.xml", "b.xml", "c.xml")
+        failures = pool.upload(paths)
+        self.assertEqual(list(failures), [paths[1]])
+        self.assertIn("553", failures[paths[1]])
+        self.assertEqual(len(server.sessions), 1)
+        self.assertFalse(server.sessions[0].closed)
+        self.assertEqual([name for _, name, _ in server.stored], ["a.xml", "c.xml"])
+
+    def test_stale_idle_session_is_probed_and_replaced(self):
+        server = StubServer()
+        pool = StubPool(server, idle_check=0)
+        first, second = self.files("a.xml", "b.xml")
+        pool.upload([first])
+        server.sessions[0].noop_fails = True
+        self.assertEqual(pool.upload([second]), {})
+        self.assertEqual(len(server.sessions), 2)
+        self.assertTrue(server.sessions[0].closed)
+
+    def test_close_quits_idle_sessions(self):
+        server = StubServer()
+        pool = StubPool(server)
+        pool.upload(self.files("a.xml"))
+        pool.close()
+        self.assertTrue(server.sessions[0].closed)
+
+    def test_closed_pool_fails_waiting_uploads_without_connecting(self):
+        server = StubServer()
+        pool = StubPool(server, size=1)
+        held = pool.acquire()
+        outcome = []
+        waiter = threading.Thread(target=lambda: outcome.append(pool.upload(self.files("a.xml"))), daemon=True)
+        waiter.start()
+        pool.close()
+        waiter.join(5)
+        self.assertFalse(waiter.is_alive())
+        self.assertIn("421", outcome[0][os.path.join(self.directory, "a.xml")])
+        pool.release(held)
+        self.assertEqual(len(server.sessions), 1)
+        self.assertTrue(held.closed)
+
+    def test_limit_grows_only_while_every_slot_is_busy(self):
+        pool = StubPool(StubServer(), size=4)
+        pool._in_use = 1
+        pool.observe(time.monotonic(), 1.0)
+        self.assertEqual(pool.limit, 2.0)
+        # One of two slots busy: the limit is not what holds uploads back
+        for _ in range(5):
+            pool.observe(time.monotonic(), 1.0)
+        self.assertEqual(pool.limit, 2.0)
+        pool._in_use = 2
+        pool.observe(time.monotonic(), 1.0)
+        self.assertEqual(pool.limit, 2.5)
+
+    def test_limit_stops_at_size(self):
+        pool = StubPool(StubServer(), size=2)
+        pool._in_use = 2
+        for _ in range(10):
+            pool.observe(time.monotonic(), 1.0)
+        self.assertEqual(pool.limit, 2.0)
+
+    def test_failed_or_slow_upload_halves_limit_once_per_round(self):
+        pool = StubPool(StubServer(), size=8)
+        pool.limit = 8.0
+        pool.observe(time.monotonic(), 1.0)
+        started = time.monotonic() - 1
+        pool.observe(started, None)
+        self.assertEqual(pool.limit, 4.0)
+        # Already under way before the cut: part of the same round
+        pool.observe(started, None)
+        self.assertEqual(pool.limit, 4.0)
+        pool.observe(time.monotonic(), 5.0)
+        self.assertEqual(pool.limit, 2.0)
+
+    def test_limit_does_not_drop_below_one(self):
+        pool = StubPool(StubServer(), size=4)
+        for _ in range(3):
+            pool.observe(time.monotonic(), None)
+        self.assertEqual(pool.limit, 1.0)
+
+    def test_unreadable_local_file_keeps_session_and_limit(self):
+        server = StubServer()
+        pool = StubPool(server, size=4)
+        pool.limit = 2.0
+        first, second = self.files("a.xml", "b.xml")
+        missing = os.path.join(self.directory, "gone.xml")
+        failures = pool.upload([first, missing, second])
+        self.assertEqual(list(failures), [missing])
+        self.assertIn("FileNotFoundError", failures[missing])
+        self.assertEqual(len(server.sessions), 1)
+        self.assertFalse(server.sessions[0].closed)
+        self.assertEqual(pool.limit, 2.0)
+        self.assertEqual([name for _, name, _ in server.stored], ["a.xml", "b.xml"])
+
+
+class FakeFTPHandler(socketserver.StreamRequestHandler):
+    """Speaks just enough FTP for ftplib: AUTH TLS, login, PROT P, PASV and STOR."""
+
+    def reply(self, line: str) -> None:
+        self.wfile.write((line + "\r\n").encode())
+        self.wfile.flush()
+
+    def secure(self) -> None:
+        self.connection = self.server.context.wrap_socket(self.connection, server_side=True)
+        self.rfile = self.connection.makefile("rb")
+        self.wfile = self.connection.makefile("wb")
+
+    def handle(self) -> None:
+        server = self.server
+        listener = None
+        protected = False
+        self.reply("220 fake FTP ready")
+        while line := self.rfile.readline().decode().strip():
+            command, _, argument = line.partition(" ")
+            command = command.upper()
+            server.commands.append(command)
+            if command == "AUTH":
+                if server.context is None:
+                    self.reply("500 AUTH not understood")
+                else:
+                    self.reply("234 AUTH TLS ok")
+                    self.secure()
+            elif command == "USER":
+                self.reply("331 password please")
+            elif command == "PASS":
+                if argument != server.password:
+                    self.reply("530 login incorrect")
+                    continue
+                server.logins += 1
+                self.reply("230 logged in")
+            elif command == "PROT":
+                protected = argument == "P"
+                self.reply("200 PROT ok")
+            elif command in ("PBSZ", "TYPE", "NOOP"):
+                self.reply("200 ok")
+            elif command == "PASV":
+                listener = socket.create_server(("127.0.0.1", 0))
+                port = listener.getsockname()[1]
+                self.reply(f"227 Entering Passive Mode (127,0,0,1,{port >> 8},{port & 255})")
+            elif command == "STOR":
+                self.reply("150 send it")
+                data, _ = listener.accept()
+                listener.close()
+                if protected:
+                    data = server.context.wrap_socket(data, server_side=True)
+                received = b""
+                while chunk := data.recv(65536):
+                    received += chunk
+                if protected:
+                    data = data.unwrap()
+                data.close()
+                server.stored[argument] = received
+                self.reply("226 stored")
+            elif command == "QUIT":
+                self.reply("221 bye")
+                return
+            else:
+                self.reply("502 not implemented")
+
+class FakeFTPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, context: Optional[ssl.SSLContext] = None, password: str = "pass"):
+        super().__init__(("127.0.0.1", 0), FakeFTPHandler)
+        self.context = context
+        self.password = password
+        self.commands: List[str] = []
+        self.logins = 0
+        self.stored: Dict[str, bytes] = {}
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    @property
+    def port(self) -> int:
+        return self.server_address[1]
+
+    def stop(self) -> None:
+        self.shutdown()
+        self.server_close()
+
+class FTPSessionPoolServerTest(unittest.TestCase):
+    """The real _connect against a fake server on localhost."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.certs = tempfile.mkdtemp()
+        cls.context = None
+        if shutil.which("openssl"):
+            cert, key = os.path.join(cls.certs, "cert.pem"), os.path.join(cls.certs, "key.pem")
+            subprocess.run(["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1",
+                            "-subj", "/CN=localhost", "-keyout", key, "-out", cert],
+                           check=True, capture_output=True)
+            cls.context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+            cls.context.load_cert_chain(cert, key)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.certs)
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def serve(self, tls: bool) -> FakeFTPServer:
+        server = FakeFTPServer(self.context if tls else None)
+        self.addCleanup(server.stop)
+        return server
+
+    def pool(self, server: FakeFTPServer, tls: str, password: str = "pass") -> converter.FTPSessionPool:
+        pool = converter.FTPSessionPool("127.0.0.1", server.port, "user", password, tls=tls, timeout=5)
+        self.addCleanup(pool.close)
+        return pool
+
+    def files(self, *names: str) -> List[str]:
+        paths = []
+        for name in names:
+            path = os.path.join(self.directory, name)
+            with open(path, "wb") as f:
+                f.write(f"<SYSINFO>{name}</SYSINFO>".encode())
+            paths.append(path)
+        return paths
+
+    def test_plain_ftp_when_server_refuses_auth_tls(self):
+        server = self.serve(tls=False)
+        pool = self.pool(server, "auto")
+        first, second = self.files("a.xml", "b.xml")
+        self.assertEqual(pool.upload([first]), {})
+        self.assertEqual(pool.upload([second]), {})
+        self.assertEqual(server.logins, 1)
+        self.assertEqual(server.commands.count("AUTH"), 1)
+        self.assertNotIn("PROT", server.commands)
+        self.assertEqual(server.stored, {"a.xml": b"<SYSINFO>a.xml</SYSINFO>",
+                                         "b.xml": b"<SYSINFO>b.xml</SYSINFO>"})
+
+    def test_required_tls_is_not_downgraded(self):
+        server = self.serve(tls=False)
+        pool = self.pool(server, "yes")
+        with self.assertRaises(ftplib.error_perm):
+            pool._connect()
+        self.assertEqual(server.logins, 0)
+
+    def test_bad_login_fails_the_file(self):
+        server = self.serve(tls=False)
+        pool = self.pool(server, "no", password="wrong")
+        paths = self.files("a.xml")
+        failures = pool.upload(paths)
+        self.assertIn("530", failures[paths[0]])
+        self.assertEqual(server.stored, {})
+
+    @unittest.skipUnless(shutil.which("openssl"), "needs openssl for a test certificate")
+    def test_ftps_session_is_protected_and_reused(self):
+        server = self.serve(tls=True)
+        pool = self.pool(server, "auto")
+        paths = self.files("a.xml", "b.xml", "c.xml")
+        self.assertEqual(pool.upload(paths[:2]), {})
+        self.assertEqual(pool.upload(paths[2:]), {})
+        self.assertEqual(server.logins, 1)
+        self.assertEqual(server.commands[:4], ["AUTH", "USER", "PASS", "PBSZ"])
+        self.assertIn("PROT", server.commands)
+        self.assertEqual(sorted(server.stored), ["a.xml", "b.xml", "c.xml"])
+        self.assertEqual(server.stored["c.xml"], b"<SYSINFO>c.xml</SYSINFO>")
+
+
+# Work claims between replicas
+
+class WorkClaimsTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.intake = os.path.join(self.directory, "Temp")
+        os.makedirs(self.intake)
+        self.now = 1000.0
+        clock = mock.patch.object(converter.time, "monotonic", lambda: self.now)
+        clock.start()
+        self.addCleanup(clock.stop)
+        root = os.path.join(self.directory, "Claims")
+        self.a = converter.WorkClaims(root, "a", lease_timeout=60)
+        self.b = converter.WorkClaims(root, "b", lease_timeout=60)
+
+    def claim_log(self, claims: converter.WorkClaims, name: str) -> str:
+        path = os.path.join(self.intake, name)
+        with open(path, "w") as f:
+            f.write(name)
+        return claims.claim(path)
+
+    def watch(self, seconds: float, renew_a: bool) -> int:
+        # b reaps every 15s, as its lease thread would; a renews too when alive
+        moved = 0
+        for _ in range(int(seconds // 15)):
+            self.now += 15
+            if renew_a:
+                self.a.renew()
+            self.b.renew()
+            moved += self.b.reap(self.intake)
+        return moved
+
+    def test_claim_goes_to_one_replica(self):
+        claimed = self.claim_log(self.a, "one.txt")
+        self.assertEqual(claimed, os.path.join(self.a.path, "one.txt"))
+        self.assertIsNone(self.b.claim(os.path.join(self.intake, "one.txt")))
+        self.assertEqual(self.a.recover(), [claimed])
+
+    def test_silent_lease_is_reaped_after_timeout(self):
+        self.a.renew()
+        self.claim_log(self.a, "one.txt")
+        # b first sees the lease at 15s; it is a minute stale at 75s
+        self.assertEqual(self.watch(75, renew_a=False), 0)
+        self.assertEqual(self.watch(15, renew_a=False), 1)
+        self.assertEqual(os.listdir(self.intake), ["one.txt"])
+        self.assertEqual(self.a.recover(), [])
+
+    def test_renewing_lease_is_kept_whatever_its_mtime(self):
+        # a's clock is far behind b's; only the lease changing counts
+        self.a.renew()
+        self.claim_log(self.a, "one.txt")
+        for _ in range(10):
+            self.assertEqual(self.watch(15, renew_a=True), 0)
+            os.utime(self.a.lease, (0, 0))
+        self.assertEqual(len(self.a.recover()), 1)
+
+    def test_gap_in_watching_restarts_the_clock(self):
+        self.a.renew()
+        self.claim_log(self.a, "one.txt")
+        self.b.reap(self.intake)
+        self.now += 600   # b was not looking, e.g. the share was down
+        self.assertEqual(self.b.reap(self.intake), 0)
+        self.assertEqual(self.watch(75, renew_a=False), 1)
+
+
+# Local staging spool and error reports
+
+class ErrorsSpoolTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        share = mock.patch.object(converter, "MOUNT_BASE", os.path.join(self.directory, "share"))
+        share.start()
+        self.addCleanup(share.stop)
+        os.makedirs(converter.apple_path("Errors"))
+        self.spool = converter.StagingSpool(os.path.join(self.directory, "spool"))
+
+    def test_flush_leaves_errors_being_written(self):
+        local = self.spool.path("Errors", "one")
+        with self.spool.holding(local):
+            os.makedirs(local)
+            with open(os.path.join(local, "one.log"), "w") as f:
+                f.write("CONVERSION FAILED")
+            self.spool.flush()
+            self.assertTrue(os.path.isdir(local))
+        self.spool.flush()
+        self.assertFalse(os.path.exists(local))
+        self.assertEqual(os.listdir(converter.apple_path("Errors", "one")), ["one.log"])
+
+    def test_report_is_kept_while_the_raw_log_is_there(self):
+        raw_path = os.path.join(self.directory, "one.txt")
+        with open(raw_path, "w") as f:
+            f.write("log")
+        reporter = converter.ErrorReporter()
+        reporter.report(raw_path, ["CONVERSION FAILED\n"])
+        with mock.patch.object(reporter, "write", side_effect=FileNotFoundError()):
+            reporter.flush()
+        self.assertTrue(reporter.holds(raw_path))
+        os.remove(raw_path)
+        with mock.patch.object(reporter, "write", side_effect=FileNotFoundError()):
+            reporter.flush()
+        self.assertFalse(reporter.holds(raw_path))
+
+# SYSINFO schema
+
+TESTDATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), "testdata")
+
+def read_testdata(name):
+    with open(os.path.join(TESTDATA, name), encoding="utf-8") as f:
+        return f.read()
+
+def expected_xml(name):
+    # testdata/<name>.xml is what the hand-written create_xml produced for
+    # testdata/<name>.txt, on the day it was written
+    today = datetime.datetime.now().strftime("%m/%d/%Y")
+    return re.sub(r"<ErasureDate>[^<]*</ErasureDate>", f"<ErasureDate>{today}</ErasureDate>",
+                  read_testdata(f"{name}.xml"))
+
+class SysinfoSchemaTest(unittest.TestCase):
+    def test_xml_matches_the_hand_written_converter(self):
+        for name in ("m1_laptop", "intel_desktop", "intel_nodrive"):
+            with self.subTest(name):
+                (xml_string, record), errors, timings = converter.convert_log(read_testdata(f"{name}.txt"))
+                self.assertEqual(xml_string, expected_xml(name))
+
+    def test_missing_sections_report_the_same_errors(self):
+        _, errors, _ = converter.convert_log(read_testdata("intel_nodrive.txt"))
+        self.assertEqual(errors, ["CPU MODEL ERROR\n", "RAM SPEED ERROR\n", "RAM TYPE ERROR\n"])
+        _, errors, _ = converter.convert_log(read_testdata("m1_laptop.txt"))
+        self.assertEqual(errors, [])
+
+    def test_record_reads_the_same_without_a_prebuilt_report(self):
+        text = read_testdata("intel_desktop.txt")
+        output_data, total_cores, report = converter.scan_report(text)
+        scanned = converter.build_record(output_data, total_cores, text, [], report)
+        tokenized = converter.build_record(output_data, total_cores, text, [])
+        self.assertEqual(scanned.as_dict(), tokenized.as_dict())
+
+
+class ReportCutoffTest(unittest.TestCase):
+    # An Apple Silicon desktop has no Power section, so nothing but the
+    # section order tells the scan it has seen everything it needs
+    def setUp(self):
+        self.text = read_testdata("m2_desktop.txt")
+
+    def test_apple_silicon_desktop_matches_a_full_scan(self):
+        with mock.patch.object(converter, "LAST_SECTION", None):
+            full_scan = converter.convert_log(self.text)
+        (xml_string, _), errors, _ = converter.convert_log(self.text)
+        self.assertEqual(xml_string, expected_xml("m2_desktop"))
+        self.assertEqual(xml_string, full_scan[0][0])
+        self.assertEqual(errors, full_scan[1])
+
+    def test_scan_stops_after_storage(self):
+        chunks = converter.report_chunks
+        headers = []
+
+        def seen_chunks(input_text):
+            for start, end in chunks(input_text):
+                headers.append(input_text[start:end].partition("\n")[0])
+                yield start, end
+
+        with mock.patch.object(converter, "report_chunks", seen_chunks):
+            converter.scan_report(self.text)
+        self.assertEqual(headers[-1], "Storage:")
+        self.assertNotIn("USB:", headers)
+
+    def test_read_stops_at_the_section_after_storage(self):
+        for chunk_size in (1, 7, 64, 512):
+            with self.subTest(chunk_size=chunk_size):
+                file = io.StringIO(self.text)
+                text = converter.read_report(file, chunk_size)
+                self.assertEqual(text, self.text[:self.text.index("Thunderbolt/USB4:")])
+                self.assertLess(file.tell(), len(self.text))
+                self.assertEqual(converter.convert_log(text)[0][0], expected_xml("m2_desktop"))
+
+    def test_log_without_storage_is_read_whole(self):
+        text = read_testdata("intel_nodrive.txt")
+        self.assertEqual(converter.read_report(io.StringIO(text), 64), text)
+
+
+class DeviceRecordTest(unittest.TestCase):
+    def record(self, name):
+        record, encoded, errors, _ = converter.build_log(read_testdata(f"{name}.txt"), ("xml", "jsonl", "csv"))
+        return record, encoded
+
+    def test_numbers_are_typed_in_jsonl(self):
+        record, encoded = self.record("m1_laptop")
+        row = json.loads(encoded["jsonl"])
+        self.assertEqual({name: row[name] for name in ("cpu_speed", "cpu_cores", "ram_speed", "ram_size",
+                                                      "battery_cycles", "drive_size", "screen_size", "drive_count")},
+                         {"cpu_speed": 3.2, "cpu_cores": 8, "ram_speed": 4266, "ram_size": 16,
+                          "battery_cycles": 123, "drive_size": 500.28, "screen_size": 13, "drive_count": 1})
+        self.assertEqual((row["cpu_model"], row["battery_capacity"], row["ram_type"]), ("Apple M1", "91%", "INTEGRATED"))
+        self.assertEqual(row, record.as_dict())
+
+    def test_units_are_written_by_the_xml_encoder_only(self):
+        _, encoded = self.record("m1_laptop")
+        for text in ("<Speed>3.2 GHz</Speed>", "<Cores>8</Cores>", "<Speed>4266 MHz</Speed>", "<Size>16 GB</Size>",
+                     "<Health>123 CYCLES</Health>", "<Size>500 GB</Size>", "<Display_Size_Est>13&quot;</Display_Size_Est>"):
+            self.assertIn(text, encoded["xml"])
+        self.assertNotIn("GHz", encoded["jsonl"])
+        self.assertNotIn("CYCLES", encoded["csv"])
+
+    def test_csv_cells_are_bare_numbers_and_missing_values_empty(self):
+        _, encoded = self.record("intel_desktop")
+        row = dict(zip(converter.RECORD_FIELDS, next(csv.reader(io.StringIO(encoded["csv"])))))
+        self.assertEqual((row["cpu_speed"], row["cpu_cores"], row["ram_speed"], row["ram_size"], row["drive_size"]),
+                         ("3.7", "6", "2667", "32", "1000"))
+        self.assertEqual((row["battery_cycles"], row["battery_capacity"]), ("", ""))
+
+    def test_unknown_numbers_are_empty_elements_and_null(self):
+        record, encoded = self.record("intel_nodrive")
+        self.assertIsNone(record.ram_speed)
+        self.assertIsNone(json.loads(encoded["jsonl"])["battery_cycles"])
+        self.assertIn("<Speed/>", encoded["xml"])
+        self.assertIn("<Health/>", encoded["xml"])
+
+    def test_decode_reads_the_units_back(self):
+        record, encoded = self.record("intel_desktop")
+        decoded = converter.decode_sysinfo(ET.fromstring(encoded["xml"]))
+        self.assertEqual(decoded.as_dict(), record.as_dict())
+        decoded = converter.decode_sysinfo(ET.fromstring(self.record("m1_laptop")[1]["xml"]))
+        self.assertEqual((decoded.cpu_speed, decoded.battery_cycles, decoded.drive_size), (3.2, 123, 500))
+
+    def test_numbers_keep_the_logged_text(self):
+        self.assertEqual([converter.number(text) for text in ("3", "3.49", "3.70", "013", "2,3", "")],
+                         [3, 3.49, "3.70", "013", "2,3", ""])
+        self.assertEqual([converter.Capacity.text(gb) for gb in (251.0, 500.28, 1000, 1500.0, 2000)],
+                         ["251 GB", "500 GB", "1 TB", "1 TB", "2 TB"])
+
+
+# XML output
+
+def sysinfo_tree(*texts):
+    sysinfo = ET.Element("SYSINFO")
+    notes = ET.SubElement(sysinfo, "NOTES")
+    for n, text in enumerate(texts):
+        ET.SubElement(notes, f"NOTE_{n}").text = text
+    ET.SubElement(sysinfo, "EMPTY")
+    return sysinfo
+
+def pretty_xml(sysinfo):
+    buffer = io.StringIO()
+    converter.write_sysinfo(sysinfo, buffer.write)
+    return buffer.getvalue()
+
+def minidom_xml(sysinfo):
+    # The path the converter used before write_pretty_xml
+    return minidom.parseString(ET.tostring(sysinfo)).toprettyxml(indent="\t")
+
+class PrettyXMLTest(unittest.TestCase):
+    def test_matches_minidom(self):
+        cases = {
+            "crlf": ("KT\r", "two\r\nlines", "lone\rreturn", "\r\n\r\n"),
+            "markup": ('minor scratch & dent <lid> "A" > B', "&amp;", "]]>", "'quoted'"),
+            "plain": ("", "MACOS SONOMA", "tab\there", " padded ", "caf\u00e9 \U0001f34e"),
+        }
+        for name, texts in cases.items():
+            with self.subTest(name):
+                sysinfo = sysinfo_tree(*texts)
+                self.assertEqual(pretty_xml(sysinfo), minidom_xml(sysinfo))
+
+    def test_refuses_what_minidom_refuses(self):
+        for char in ("\x00", "\x0c", "\x1b", "\ufffe"):
+            with self.subTest(repr(char)):
+                sysinfo = sysinfo_tree("ok", f"form{char}feed")
+                with self.assertRaises(ExpatError):
+                    minidom_xml(sysinfo)
+                with self.assertRaises(ValueError):
+                    pretty_xml(sysinfo)
+
+    def test_control_character_sends_the_log_to_errors(self):
+        log = benchmark.generate_log(random.Random(5), benchmark.PROFILES[0])
+        lines = [line for line in log.split("\n") if not line.startswith("SYSNOTES:")]
+        lines.insert(1, "SYSNOTES:page\x0cbreak")
+        log = "\n".join(lines)
+        converted, errors = converter.job_result(converter.run_inline(converter.convert_log, log))
+        self.assertIsNone(converted)
+        self.assertTrue(errors[0].startswith("CONVERSION FAILED"))
+
+
+# Intake watching
+
+class IntakeWatcherTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.now = 1000.0
+        clock = mock.patch.object(time, "monotonic", lambda: self.now)
+        clock.start()
+        self.addCleanup(clock.stop)
+
+    def write(self, name, text, age=0):
+        path = os.path.join(self.directory, name)
+        with open(path, "a") as f:
+            f.write(text)
+        if age:
+            settled = time.time() - age
+            os.utime(path, (settled, settled))
+        return path
+
+    def poll_after(self, seconds, watcher):
+        self.now += seconds
+        return watcher._poll()
+
+    def test_poll_waits_for_a_copy_to_settle(self):
+        watcher = converter.IntakeWatcher(self.directory, use_inotify=False, stable_window=2)
+        path = self.write("one.txt", "TECHID:mg\n")
+        self.assertEqual(self.poll_after(0, watcher), set())
+        self.write("one.txt", "SYSUID:a1\n")
+        self.assertEqual(self.poll_after(1.5, watcher), set())
+        # Unchanged, but not yet for stable_window since the last change
+        self.assertEqual(self.poll_after(1.5, watcher), set())
+        self.assertEqual(self.poll_after(1, watcher), {path})
+        self.assertEqual(self.poll_after(5, watcher), set())
+
+    def test_poll_hands_a_rewritten_log_over_again(self):
+        watcher = converter.IntakeWatcher(self.directory, use_inotify=False, stable_window=2)
+        path = self.write("one.txt", "TECHID:mg\n")
+        self.poll_after(0, watcher)
+        self.assertEqual(self.poll_after(2, watcher), {path})
+        self.write("one.txt", "SYSUID:a1\n")
+        self.assertEqual(self.poll_after(0.5, watcher), set())
+        self.assertEqual(self.poll_after(2, watcher), {path})
+
+    def test_poll_skips_empty_and_other_files(self):
+        watcher = converter.IntakeWatcher(self.directory, use_inotify=False, stable_window=0)
+        self.write("empty.txt", "")
+        self.write("notes.md", "TECHID:mg\n")
+        self.poll_after(0, watcher)
+        self.assertEqual(self.poll_after(1, watcher), set())
+
+    def test_poll_interval_backs_off_while_idle_and_resets_on_a_new_log(self):
+        watcher = converter.IntakeWatcher(self.directory, min_interval=0.5, max_interval=4,
+                                          use_inotify=False, stable_window=2)
+        for interval in (1, 2, 4, 4):
+            self.poll_after(watcher.interval, watcher)
+            self.assertEqual(watcher.interval, interval)
+        self.write("one.txt", "TECHID:mg\n")
+        self.poll_after(watcher.interval, watcher)
+        self.assertEqual(watcher.interval, 0.5)
+
+    def test_retry_hands_logs_out_again(self):
+        watcher = converter.IntakeWatcher(self.directory, use_inotify=False, stable_window=0)
+        path = self.write("one.txt", "TECHID:mg\n")
+        watcher.retry([path])
+        self.assertEqual(watcher.wait(), [path])
+
+    def test_inotify_hands_over_closed_writes_and_settled_backlog(self):
+        backlog = self.write("old.txt", "TECHID:mg\n", age=60)
+        watcher = converter.IntakeWatcher(self.directory, use_inotify=True, stable_window=2)
+        self.addCleanup(watcher.close)
+        if watcher._inotify_fd is None:
+            self.skipTest("inotify is not available")
+        self.assertEqual(watcher.wait(), [backlog])
+        path = self.write("new.txt", "TECHID:kt\n")
+        self.assertEqual(watcher.wait(), [path])
+        # A rescan skips what was already handed over until it changes
+        self.assertEqual(watcher._rescan(), set())
+        self.write("old.txt", "SYSUID:a1\n", age=60)
+        self.assertEqual(watcher._rescan(), {backlog})
+
+
+# Offline conversion
+
+class ConvertCommandTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.source = os.path.join(self.directory, "archive")
+        self.out = os.path.join(self.directory, "out")
+        for name, sub in (("m1_laptop", "2024"), ("intel_desktop", "2024/june"), ("intel_nodrive", "2025")):
+            os.makedirs(os.path.join(self.source, sub), exist_ok=True)
+            shutil.copy(os.path.join(TESTDATA, f"{name}.txt"), os.path.join(self.source, sub))
+
+    def convert(self, *args):
+        # A fresh interpreter with no credentials in the environment or working directory
+        env = {name: value for name, value in os.environ.items()
+               if not name.startswith(("FTP_", "SHARE_"))}
+        script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "AppleConverter.py")
+        return subprocess.run([sys.executable, script, "convert", *args], cwd=self.directory, env=env,
+                              capture_output=True, text=True, timeout=120)
+
+    def out_file(self, *parts):
+        with open(os.path.join(self.out, *parts), encoding="utf-8") as f:
+            return f.read()
+
+    def test_archive_is_mirrored_into_out(self):
+        run = self.convert(self.source, "--out", self.out, "--jobs", "2", "--format", "xml", "--format", "jsonl")
+        self.assertEqual(run.returncode, 1, run.stdout + run.stderr)
+        self.assertIn("Converted 2/3 logs", run.stdout)
+        self.assertEqual(self.out_file("2024", "m1_laptop.xml"), expected_xml("m1_laptop"))
+        self.assertEqual(self.out_file("2024", "june", "intel_desktop.xml"), expected_xml("intel_desktop"))
+        self.assertFalse(os.path.exists(os.path.join(self.out, "2025", "intel_nodrive.xml")))
+        self.assertIn("RAM TYPE ERROR", self.out_file("2025", "intel_nodrive.log"))
+        rows = [json.loads(line) for line in self.out_file("records.jsonl").splitlines()]
+        self.assertEqual(sorted(row["tech_id"] for row in rows), ["JD", "MG"])
+        self.assertFalse(os.path.exists(os.path.join(self.directory, "state")))
+
+    def test_lookup_file_replaces_the_built_in_tables(self):
+        lookups = os.path.join(self.directory, "lookups.json")
+        with open(lookups, "w") as f:
+            json.dump({"MAC_OS_DICT": {"14": "macOS 14"}}, f)
+        shutil.rmtree(os.path.join(self.source, "2025"))
+        run = self.convert(self.source, "--out", self.out, "--jobs", "1", "--lookups", lookups)
+        self.assertEqual(run.returncode, 0, run.stdout + run.stderr)
+        self.assertIn("<System_Version>macOS 14</System_Version>", self.out_file("2024", "m1_laptop.xml"))
+
+    def test_missing_source_is_a_usage_error(self):
+        run = self.convert(os.path.join(self.directory, "nowhere"), "--out", self.out)
+        self.assertEqual(run.returncode, 2)
+        self.assertFalse(os.path.exists(self.out))
+
+
+# Daemon batches
+
+class ShareTestCase(unittest.TestCase):
+    """
+    A share in a temporary directory, with every optional subsystem off
+    unless a test turns it on, and ftp_upload_batch replaced by upload().
+    """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        config = dict(STATE_DIR=os.path.join(self.directory, "state"), MANIFEST="off", JOURNAL="off")
+        state = mock.patch.multiple(converter, MOUNT_BASE=os.path.join(self.directory, "share"), CONFIG=config,
+                                    JOURNAL=None, DEDUP_CACHE=None, MANIFEST=None, MANIFEST_RECORDS={},
+                                    SPOOL=None, CLAIMS=None, ERROR_REPORTER=None, RETRIES=None,
+                                    PROCESSED_INDEX=None, ftp_upload_batch=self.upload)
+        state.start()
+        self.addCleanup(state.stop)
+        self.addCleanup(self.close_state)
+        for sub in ("Temp", "Processed", "Errors"):
+            os.makedirs(converter.apple_path(sub))
+        self.uploaded: List[str] = []
+        self.refused: Set[str] = set()
+
+    def close_state(self):
+        for name in ("JOURNAL", "DEDUP_CACHE"):
+            if getattr(converter, name) is not None:
+                getattr(converter, name).close()
+
+    def upload(self, file_paths):
+        failures = {}
+        for file_path in file_paths:
+            name = os.path.basename(file_path)
+            if name in self.refused:
+                failures[file_path] = "FTP UPLOAD FAILED\n\nerror_perm('550 refused')\n"
+            else:
+                self.uploaded.append(name)
+        return failures
+
+    def drop(self, name, text=None):
+        raw_path = converter.apple_path("Temp", name)
+        with open(raw_path, "w", encoding="utf-8") as f:
+            f.write(read_testdata("m1_laptop.txt") if text is None else text)
+        return raw_path
+
+    def listing(self, sub):
+        return sorted(os.listdir(converter.apple_path(sub)))
+
+class DedupCacheTest(ShareTestCase):
+    def test_redropped_log_is_not_converted_or_uploaded_again(self):
+        converter.process_RAW_LOGS([self.drop("one.txt")])
+        self.assertEqual(self.uploaded, ["one.xml"])
+
+        with mock.patch.object(converter, "convert_log", wraps=converter.convert_log) as convert:
+            converter.process_RAW_LOGS([self.drop("one.txt")])
+        convert.assert_not_called()
+        self.assertEqual(self.uploaded, ["one.xml"])
+        self.assertEqual(self.listing("Temp"), [])
+        self.assertEqual(self.listing("Processed"), ["one.xml"])
+
+    def test_edited_log_is_converted_again(self):
+        converter.process_RAW_LOGS([self.drop("one.txt")])
+        edited = read_testdata("m1_laptop.txt").replace("SYSCOLOR:space gray", "SYSCOLOR:silver")
+        converter.process_RAW_LOGS([self.drop("one.txt", edited)])
+        self.assertEqual(self.uploaded, ["one.xml", "one.xml"])
+        self.assertEqual(len(self.listing("Processed")), 2)
+
+    def test_uploads_are_remembered_across_restarts(self):
+        converter.process_RAW_LOGS([self.drop("one.txt")])
+        converter.DEDUP_CACHE.close()
+        converter.DEDUP_CACHE = None
+        converter.process_RAW_LOGS([self.drop("again.txt")])
+        self.assertEqual(self.uploaded, ["one.xml"])
+        self.assertEqual(self.listing("Temp"), [])
+
+
+class DeviceManifestTest(ShareTestCase):
+    def setUp(self):
+        super().setUp()
+        converter.CONFIG.update(MANIFEST="on", NODE_ID="n1")
+        self.manifest_dir = converter.apple_path("Manifest")
+        log = read_testdata("m1_laptop.txt")
+        self.raw_logs = [self.drop(f"{n}.txt", log.replace("SYSUID:a123456", f"SYSUID:a{n}")) for n in range(3)]
+
+    def opened(self):
+        # Every open of a manifest file, by name
+        real_open = open
+        names = []
+
+        def counting_open(file, *args, **kwargs):
+            if os.path.dirname(str(file)) == self.manifest_dir:
+                names.append(os.path.basename(file))
+            return real_open(file, *args, **kwargs)
+        return names, mock.patch("builtins.open", counting_open)
+
+    def test_batch_opens_each_manifest_file_once(self):
+        names, counting = self.opened()
+        with counting:
+            converter.process_RAW_LOGS(self.raw_logs)
+        day_file = datetime.date.today().strftime("%Y-%m-%d") + ".n1.jsonl"
+        self.assertEqual(sorted(names), sorted([day_file, "index.n1.tsv"]))
+        rows = converter.get_manifest().lookup(serial="FVFXC2ABQ6L4")
+        self.assertEqual(sorted(row["asset_id"] for row in rows), ["A0", "A1", "A2"])
+        self.assertEqual(converter.get_manifest().lookup(asset_id="A1")[0]["xml"], "1.xml")
+
+    def test_rows_wait_for_the_next_batch_when_the_index_cannot_be_written(self):
+        real_open = open
+
+        def index_unwritable(file, *args, **kwargs):
+            if str(file).endswith(".tsv"):
+                raise OSError(errno.EIO, "share went away")
+            return real_open(file, *args, **kwargs)
+
+        with mock.patch("builtins.open", index_unwritable):
+            converter.process_RAW_LOGS(self.raw_logs)
+        self.assertEqual(self.uploaded, ["0.xml", "1.xml", "2.xml"])
+        self.assertEqual(converter.MANIFEST.pending(), 3)
+
+        converter.flush_manifest()
+        self.assertEqual(converter.MANIFEST.pending(), 0)
+        rows = converter.get_manifest().lookup()
+        self.assertEqual([row["asset_id"] for row in rows], ["A0", "A1", "A2"])
+        day_files = [name for name in os.listdir(self.manifest_dir) if name.endswith(".jsonl")]
+        with open(os.path.join(self.manifest_dir, day_files[0])) as f:
+            self.assertEqual(len(f.readlines()), 3)
+
+
+class ProcessedIndexTest(ShareTestCase):
+    def setUp(self):
+        super().setUp()
+        self.index = converter.ProcessedIndex(converter.apple_path("Processed"))
+        converter.PROCESSED_INDEX = self.index
+
+    def indexed(self):
+        return sorted(self.index._names)
+
+    def test_name_is_listed_only_once_the_xml_is_written(self):
+        with mock.patch.object(converter, "save_to_output_xml", side_effect=OSError(errno.ENOSPC, "full")):
+            with self.assertRaises(OSError):
+                converter.process_RAW_LOGS([self.drop("one.txt")])
+        self.assertEqual(self.indexed(), [])
+        converter.process_RAW_LOGS([self.drop("one.txt")])
+        self.assertEqual(self.indexed(), ["one.xml"])
+
+    def test_collision_renames_the_indexed_xml(self):
+        converter.process_RAW_LOGS([self.drop("one.txt")])
+        edited = read_testdata("m1_laptop.txt").replace("SYSCOLOR:space gray", "SYSCOLOR:silver")
+        converter.process_RAW_LOGS([self.drop("one.txt", edited)])
+        self.assertEqual(self.indexed(), self.listing("Processed"))
+        self.assertEqual(len(self.indexed()), 2)
+
+    def test_retried_upload_leaves_the_index_until_it_lands(self):
+        converter.RETRIES = queue = converter.UploadRetryQueue(converter.retry_dir(), base_delay=0)
+        self.refused.add("one.xml")
+        converter.process_RAW_LOGS([self.drop("one.txt")])
+        self.assertEqual(self.indexed(), [])
+        self.refused.clear()
+        queue.retry(queue._take_due())
+        self.assertEqual(self.indexed(), ["one.xml"])
+        self.assertEqual(self.listing("Processed"), ["one.xml"])
+
+    def test_dead_lettered_xml_leaves_the_index(self):
+        self.refused.add("one.xml")
+        converter.process_RAW_LOGS([self.drop("one.txt")])
+        self.assertEqual(self.listing("Processed"), [])
+        self.assertEqual(self.indexed(), [])
+
+
+class AsyncPipelineTest(ShareTestCase):
+    def test_one_batch_uploads_at_a_time(self):
+        log = read_testdata("m1_laptop.txt")
+        raw_logs = [self.drop(f"{n}.txt", log.replace("SYSUID:a123456", f"SYSUID:a{n}")) for n in range(8)]
+        lock = threading.Lock()
+        running, most = 0, 0
+        upload = self.upload
+
+        def slow_upload(file_paths):
+            nonlocal running, most
+            with lock:
+                running += 1
+                most = max(most, running)
+            time.sleep(0.05)
+            with lock:
+                running -= 1
+            return upload(file_paths)
+
+        with mock.patch.object(converter, "ftp_upload_batch", slow_upload):
+            asyncio.run(converter.process_RAW_LOGS_async(raw_logs, queue_size=2))
+        self.assertEqual(most, 1)
+        self.assertEqual(sorted(self.uploaded), [f"{n}.xml" for n in range(8)])
+        self.assertEqual(self.listing("Temp"), [])
+
+
+class JournalResumeTest(ShareTestCase):
+    def setUp(self):
+        super().setUp()
+        converter.CONFIG["JOURNAL"] = "on"
+
+    def restart(self):
+        # What survives a crash: the share, the state directory and nothing in memory
+        self.close_state()
+        converter.JOURNAL = converter.DEDUP_CACHE = None
+        converter.MANIFEST_RECORDS.clear()
+
+    def convert_only(self, raw_path):
+        # process_RAW_LOGS up to the XML being written, then the crash
+        with open(raw_path, encoding="utf-8") as f:
+            text = f.read()
+        digest = converter.DedupCache.digest(text)
+        job = converter.run_inline(converter.convert_log, text)
+        return digest, converter.stage_xml(raw_path, digest, *converter.job_result(job))
+
+    def test_converted_log_is_uploaded_and_archived(self):
+        raw_path = self.drop("one.txt")
+        digest, xml_path = self.convert_only(raw_path)
+        self.assertEqual(converter.get_journal().unfinished(), [(raw_path, "converted", xml_path, digest)])
+        self.restart()
+
+        converter.resume_journal()
+        self.assertEqual(self.uploaded, ["one.xml"])
+        self.assertFalse(os.path.exists(raw_path))
+        self.assertEqual(self.listing("Processed"), ["one.xml"])
+        self.assertEqual(converter.get_journal().unfinished(), [])
+        self.assertEqual(converter.get_dedup_cache().seen(digest), "one.xml")
+
+    def test_uploaded_log_is_archived_without_uploading_again(self):
+        raw_path = self.drop("one.txt")
+        digest, xml_path = self.convert_only(raw_path)
+        converter.journal_record(raw_path, "uploaded")
+        self.restart()
+
+        converter.resume_journal()
+        self.assertEqual(self.uploaded, [])
+        self.assertFalse(os.path.exists(raw_path))
+        self.assertEqual(converter.get_journal().unfinished(), [])
+
+    def test_discovered_log_is_left_to_the_watcher(self):
+        raw_path = self.drop("one.txt")
+        converter.journal_record(raw_path, "discovered")
+        self.restart()
+
+        converter.resume_journal()
+        self.assertEqual(self.uploaded, [])
+        self.assertEqual(self.listing("Temp"), ["one.txt"])
+        self.assertEqual(converter.get_journal().unfinished(), [])
+
+
+class UploadRetryQueueTest(ShareTestCase):
+    def setUp(self):
+        super().setUp()
+        # No delay, so _take_due hands every scheduled retry straight back
+        self.queue = converter.UploadRetryQueue(converter.retry_dir(), max_attempts=3, base_delay=0)
+        converter.RETRIES = self.queue
+
+    def test_backoff_doubles_up_to_the_cap_with_jitter(self):
+        queue = converter.UploadRetryQueue(converter.retry_dir(), base_delay=30, max_delay=100)
+        with mock.patch.object(random, "uniform", lambda low, high: high):
+            self.assertEqual([queue.delay(n) for n in (1, 2, 3, 4)], [30, 60, 100, 100])
+        with mock.patch.object(random, "uniform", lambda low, high: low):
+            self.assertEqual([queue.delay(n) for n in (1, 2, 3, 4)], [15, 30, 50, 50])
+
+    def test_failed_upload_waits_in_the_queue_until_it_goes_through(self):
+        self.refused.add("one.xml")
+        raw_path = self.drop("one.txt")
+        converter.process_RAW_LOGS([raw_path])
+        self.assertTrue(self.queue.holds(raw_path))
+        self.assertEqual(os.listdir(self.queue.directory), ["one.xml"])
+        self.assertEqual(self.listing("Processed"), [])
+        self.assertEqual(self.listing("Temp"), ["one.txt"])
+
+        self.refused.clear()
+        self.queue.retry(self.queue._take_due())
+        self.assertFalse(self.queue.holds(raw_path))
+        self.assertEqual(self.uploaded, ["one.xml"])
+        self.assertEqual(os.listdir(self.queue.directory), [])
+        self.assertEqual(self.listing("Processed"), ["one.xml"])
+        self.assertEqual(self.listing("Temp"), [])
+
+    def test_upload_is_dead_lettered_after_max_attempts(self):
+        self.refused.add("one.xml")
+        raw_path = self.drop("one.txt")
+        converter.process_RAW_LOGS([raw_path])
+        self.queue.retry(self.queue._take_due())
+        self.assertTrue(self.queue.holds(raw_path))
+        self.queue.retry(self.queue._take_due())
+
+        self.assertFalse(self.queue.holds(raw_path))
+        self.assertEqual(self.uploaded, [])
+        self.assertEqual(os.listdir(self.queue.directory), [])
+        self.assertEqual(self.listing("Processed"), [])
+        self.assertEqual(sorted(os.listdir(converter.apple_path("Errors", "one"))), ["one.log", "one.txt"])
+        with open(converter.apple_path("Errors", "one", "one.log")) as f:
+            report = f.read()
+        self.assertIn("FTP UPLOAD FAILED", report)
+        self.assertIn("Gave up after 3 upload attempts", report)
+
+
+# Multi-source intake
+
+class SourcesTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        config = dict(SOURCES=" site1, site2 ,", FTP_HOST="ftp.example", STATE_DIR=os.path.join(self.directory, "state"),
+                      MANIFEST="off", JOURNAL="off", NODE_ID="n1",
+                      SITE2_FTP_HOST="ftp2.example", SITE2_APPLE_BASE="Logs/Mac", SITE2_JOBS="4")
+        state = mock.patch.multiple(converter, CONFIG=config, MOUNT_BASE=os.path.join(self.directory, "share"),
+                                    APPLE_BASE=converter.APPLE_BASE, CURRENT_SOURCE=None, JOURNAL=None,
+                                    DEDUP_CACHE=None, MANIFEST=None, MANIFEST_RECORDS={}, SPOOL=None, CLAIMS=None,
+                                    ERROR_REPORTER=None, RETRIES=None, PROCESSED_INDEX=None,
+                                    ftp_upload_batch=lambda paths: {})
+        state.start()
+        self.addCleanup(state.stop)
+        self.addCleanup(lambda: converter.DEDUP_CACHE is not None and converter.DEDUP_CACHE.close())
+
+    def test_source_names_come_from_sources(self):
+        self.assertEqual(converter.source_names(), ["site1", "site2"])
+
+    def test_prefixed_keys_override_and_the_rest_fall_back(self):
+        site1 = converter.source_config("site1", converter.CONFIG)
+        site2 = converter.source_config("site2", converter.CONFIG)
+        self.assertEqual((site1["FTP_HOST"], site2["FTP_HOST"]), ("ftp.example", "ftp2.example"))
+        self.assertEqual((site1.get("JOBS"), site2["JOBS"]), (None, "4"))
+        self.assertEqual(site1["STATE_DIR"], os.path.join(self.directory, "state", "site1"))
+        self.assertEqual(site2["MOUNT_BASE"], os.path.join(self.directory, "share") + "_site2")
+
+    def test_applied_source_keeps_to_its_own_share_state_and_manifest(self):
+        converter.apply_source("site2")
+        self.assertEqual(converter.apple_path("Temp"), os.path.join(self.directory, "share_site2", "Logs", "Mac", "Temp"))
+        for sub in ("Temp", "Processed", "Errors"):
+            os.makedirs(converter.apple_path(sub))
+        raw_path = converter.apple_path("Temp", "one.txt")
+        shutil.copy(os.path.join(TESTDATA, "m1_laptop.txt"), raw_path)
+
+        converter.CONFIG["MANIFEST"] = "on"
+        converter.process_RAW_LOGS([raw_path])
+        self.assertEqual(os.listdir(converter.apple_path("Processed")), ["one.xml"])
+        self.assertEqual(os.listdir(os.path.join(self.directory, "state")), ["site2"])
+        self.assertEqual(converter.get_manifest().writer, "n1.site2")
+
+    def test_crashing_source_is_restarted_with_backoff(self):
+        clock = [0.0]
+        starts: Dict[str, List[float]] = {"site1": [], "site2": []}
+
+        class Source:
+            # site1 dies as soon as it starts; site2 keeps running
+            def __init__(self, target, args, name):
+                self.source = args[0]
+                self.exitcode = 1
+                self.sentinel = None
+
+            def start(self):
+                starts[self.source].append(clock[0])
+
+            def is_alive(self):
+                return self.source == "site2"
+
+            def join(self, timeout=None):
+                pass
+
+            def terminate(self):
+                pass
+
+        def wait(sentinels, timeout):
+            clock[0] += timeout
+            if clock[0] > 20:
+                raise KeyboardInterrupt
+
+        with mock.patch.object(multiprocessing, "get_context", lambda method: mock.Mock(Process=Source)), \
+                mock.patch.object(multiprocessing.connection, "wait", wait), \
+                mock.patch.object(time, "monotonic", lambda: clock[0]):
+            converter.run_sources(["site1", "site2"], None, max_backoff=60)
+        self.assertEqual(starts, {"site1": [0, 3, 8, 17], "site2": [0]})
+
+
+# Conversion batches
+
+class SubmissionWindowTest(unittest.TestCase):
+    def test_window_pulls_a_bounded_number_ahead(self):
+        pulled = []
+        def jobs():
+            for n in range(10):
+                pulled.append(n)
+                yield n
+        for n in converter.submission_window(jobs(), 3):
+            self.assertLessEqual(len(pulled), n + 3)
+        self.assertEqual(pulled, list(range(10)))
+
+    def test_batch_is_read_no_further_ahead_than_the_window(self):
+        reads, ahead = [], []
+        def read(path):
+            reads.append(path)
+            return "log"
+        def stage(path, digest, converted, errors):
+            ahead.append(len(reads) - (int(path) + 1))
+        logs = [str(n) for n in range(20)]
+        with mock.patch.multiple(converter, claim_raw_log=lambda path: path, read_raw_log=read,
+                                 get_dedup_cache=lambda: None, stage_xml=stage,
+                                 convert_log=lambda text: ((text, None), [], {}),
+                                 ftp_upload_batch=lambda paths: {}):
+            converter.process_RAW_LOGS(logs, jobs=2)
+        self.assertEqual(reads, logs)
+        self.assertLess(max(ahead), converter.window_size(2))
+
+
+if __name__ == "__main__":
+    unittest.main()